@@ -0,0 +1,160 @@
+"""Benchmarks of the overhead of cyppy.lib wrappers relative to Fortran time.
+
+For every scheme whose run routine can be called on synthetic (zero) inputs,
+as found by first calling it in a subprocess (schemes may stop or crash the
+process on such inputs), times the run routine at several column counts when called through the
+validated wrapper, the unvalidated wrapper, and a bound routine. Per-call
+wrapper overhead relative to the time spent in the Fortran cap (measured
+by lib profiling), throughput and bytes allocated per call are recorded in
+each benchmark's extra_info.
+
+Requires pytest-benchmark. Run with:
+
+    python -m pytest benchmarks/bench_lib.py --benchmark-only
+
+and compare against a saved run with --benchmark-autosave / --benchmark-compare.
+"""
+import functools
+import subprocess
+import sys
+import timeit
+import tracemalloc
+import pytest
+import cyppy
+
+COLUMN_COUNTS = [1, 32, 1024, 16384]
+N_LEVELS = 64
+N_OVERHEAD_CALLS = 100
+PROBE_TIMEOUT = 600  # seconds
+PROBE_OK = 'probe ok'
+
+
+def get_dimensions(n_columns):
+    return {'horizontal_dimension': n_columns, 'vertical_dimension': N_LEVELS}
+
+
+def make_run_args(scheme_name, n_columns):
+    """Return the run routine of a scheme and synthetic arguments for it."""
+    state = cyppy.State(
+        cyppy.lib.CCPP_METADATA, get_dimensions(n_columns), scheme_names=[scheme_name]
+    )
+    routine = getattr(cyppy.lib, f"{scheme_name}_run")
+    return routine, [state[slot.standard_name] for slot in routine.plan.slots]
+
+
+def probe(scheme_name, n_columns):
+    """Call the run routine of a scheme on synthetic arguments, printing PROBE_OK
+    if it returns. Run in a subprocess by get_probe_error."""
+    try:
+        routine, args = make_run_args(scheme_name, n_columns)
+        routine(*args)
+    except (cyppy.lib.CCPPError, NotImplementedError) as err:
+        sys.exit(str(err))
+    print(PROBE_OK)
+
+
+@functools.lru_cache(maxsize=None)
+def get_probe_error(scheme_name, n_columns):
+    """Return why the run routine of a scheme cannot be called on synthetic arguments,
+    or None if it can. The call is made in a subprocess, so a scheme which stops or
+    crashes only ends that process."""
+    try:
+        result = subprocess.run(
+            [sys.executable, __file__, scheme_name, str(n_columns)],
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True,
+            timeout=PROBE_TIMEOUT,
+        )
+    except subprocess.TimeoutExpired:
+        return f"timed out after {PROBE_TIMEOUT} s"
+    # Fortran stop statements exit with status 0, so success is only taken from PROBE_OK
+    if result.returncode == 0 and result.stdout.strip().endswith(PROBE_OK):
+        return None
+    elif result.returncode < 0:
+        return f"killed by signal {-result.returncode}"
+    lines = result.stderr.strip().splitlines() or result.stdout.strip().splitlines()
+    return lines[-1] if len(lines) > 0 else f"exited with status {result.returncode}"
+
+
+def get_run_args(scheme_name, n_columns):
+    """Return the run routine of a scheme and synthetic arguments for it, skipping
+    the benchmark if the routine cannot be called on them."""
+    error = get_probe_error(scheme_name, n_columns)
+    if error is not None:
+        pytest.skip(f"routine cannot be called on synthetic inputs: {error}")
+    return make_run_args(scheme_name, n_columns)
+
+
+def get_allocated_bytes(func):
+    """Return the peak bytes allocated by Python during one call of func."""
+    tracemalloc.start()
+    try:
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return peak
+
+
+def time_per_call(func):
+    return timeit.timeit(func, number=N_OVERHEAD_CALLS) / N_OVERHEAD_CALLS
+
+
+def fortran_time_per_call(func, routine_name):
+    """Return the mean time spent in the Fortran cap during calls of func,
+    as recorded by lib profiling."""
+    was_profiling = cyppy.lib.is_profiling_enabled()
+    cyppy.lib.reset_profile()
+    cyppy.lib.enable_profiling()
+    try:
+        for _ in range(N_OVERHEAD_CALLS):
+            func()
+    finally:
+        if not was_profiling:
+            cyppy.lib.disable_profiling()
+    row, = [row for row in cyppy.lib.get_profile() if row.routine == routine_name]
+    cyppy.lib.reset_profile()
+    return row.fortran_time / row.calls
+
+
+@pytest.fixture(params=[scheme.name for scheme in cyppy.lib.CCPP_METADATA.schemes])
+def scheme_name(request):
+    return request.param
+
+
+@pytest.fixture(params=COLUMN_COUNTS)
+def n_columns(request):
+    return request.param
+
+
+def record_info(benchmark, func, routine_name, n_columns):
+    fortran_time = fortran_time_per_call(func, routine_name)
+    call_time = time_per_call(func)
+    benchmark.extra_info['wrapper_overhead_s'] = max(call_time - fortran_time, 0.)
+    benchmark.extra_info['columns_per_second'] = n_columns / call_time
+    benchmark.extra_info['allocated_bytes'] = get_allocated_bytes(func)
+
+
+def test_call(benchmark, scheme_name, n_columns):
+    routine, args = get_run_args(scheme_name, n_columns)
+    benchmark.group = f"{scheme_name}-{n_columns}"
+    record_info(benchmark, lambda: routine(*args), routine.plan.name, n_columns)
+    benchmark(routine, *args)
+
+
+def test_call_unvalidated(benchmark, scheme_name, n_columns):
+    routine, args = get_run_args(scheme_name, n_columns)
+    benchmark.group = f"{scheme_name}-{n_columns}"
+    record_info(benchmark, lambda: routine(*args, validate=False), routine.plan.name, n_columns)
+    benchmark(lambda: routine(*args, validate=False))
+
+
+def test_bound_call(benchmark, scheme_name, n_columns):
+    routine, args = get_run_args(scheme_name, n_columns)
+    benchmark.group = f"{scheme_name}-{n_columns}"
+    bound = routine.bind(*args, check=False)
+    record_info(benchmark, bound, routine.plan.name, n_columns)
+    benchmark(bound)
+
+
+if __name__ == '__main__':
+    probe(sys.argv[1], int(sys.argv[2]))
@@ -0,0 +1,43 @@
+"""Benchmarks of loading the .meta files in lib/physics.
+
+Compares the line-oriented reader used by default with the ConfigParser reader
+it replaced, serially and with the files read in a process pool.
+
+Requires pytest-benchmark. Run with:
+
+    python -m pytest benchmarks/bench_meta.py --benchmark-only
+"""
+import os
+import concurrent.futures
+import pytest
+from cyppy import meta
+
+META_DIR = os.path.join(os.path.dirname(os.path.realpath(__file__)), '../lib/physics')
+
+
+@pytest.fixture(scope='module')
+def meta_filenames():
+    filenames = [
+        os.path.join(META_DIR, fname) for fname in meta.get_meta_files(META_DIR)
+    ]
+    filenames = [fname for fname in filenames if os.path.exists(fname)]
+    if len(filenames) == 0:
+        pytest.skip(f"no .meta files found in {META_DIR}")
+    return filenames
+
+
+@pytest.mark.parametrize(
+    "read_file",
+    [
+        pytest.param(meta.read_meta_file, id='streaming'),
+        pytest.param(meta.read_meta_file_configparser, id='configparser'),
+    ]
+)
+def test_load_meta(benchmark, meta_filenames, read_file):
+    benchmark.extra_info['n_files'] = len(meta_filenames)
+    benchmark(meta.load_meta, meta_filenames, read_file=read_file)
+
+
+def test_load_meta_process_pool(benchmark, meta_filenames):
+    with concurrent.futures.ProcessPoolExecutor() as executor:
+        benchmark(meta.load_meta, meta_filenames, executor=executor)
@@ -1,2 +1,15 @@
 from .meta import load_meta, SchemeSpec, RoutineSpec, ArgSpec, CCPPMetadata, ModuleSpec, DerivedDataTypeSpec, AttributeSpec
 from . import lib
+from .lib import DerivedTypeHandle
+from .suite import Suite, load_suite
+from .state import State
+from .scheduler import ChunkScheduler
+
+
+def __getattr__(name):
+    # ProcessPool requires Python 3.8 for multiprocessing.shared_memory, so it is
+    # only imported when used
+    if name == 'ProcessPool':
+        from .process import ProcessPool
+        return ProcessPool
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
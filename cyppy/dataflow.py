@@ -0,0 +1,188 @@
+import concurrent.futures
+from collections import namedtuple
+from . import lib, meta
+
+
+# standard names of the values a routine reads and writes
+Access = namedtuple("Access", ["reads", "writes"])
+# predecessors[i] are the indices of the calls which must complete before call i starts
+DataflowGraph = namedtuple("DataflowGraph", ["names", "predecessors"])
+Schedule = namedtuple(
+    "Schedule", ["work", "span", "parallelism", "max_width", "critical_path"]
+)
+
+
+def get_arg_names(arg, ddt_lookup, expansion_cache):
+    """Return the standard names of the values accessed through an argument, which
+    for derived types are the type and each of its attributes."""
+    if arg.type not in ddt_lookup:
+        return (arg.standard_name,)
+    attrs, _ = meta.get_ddt_expansion(arg.type, ddt_lookup, expansion_cache)
+    return (arg.standard_name,) + tuple(attr.standard_name for attr in attrs)
+
+
+def get_access(routine, buffer_names=None, ddt_lookup=None):
+    """Return the Access of a routine, from the intent of its arguments.
+
+    Values held in shared buffers are accessed by the name of their buffer,
+    given by standard name in buffer_names. Derived type arguments access every
+    attribute of the type, given by type name in ddt_lookup.
+    """
+    if buffer_names is None:
+        buffer_names = {}
+    if ddt_lookup is None:
+        ddt_lookup = {}
+    expansion_cache = {}
+    reads = set()
+    writes = set()
+    for arg in lib.get_call_args(routine):
+        names = [
+            buffer_names.get(standard_name, standard_name)
+            for standard_name in get_arg_names(arg, ddt_lookup, expansion_cache)
+        ]
+        if arg.intent in ('in', 'inout'):
+            reads.update(names)
+        if arg.intent in ('out', 'inout'):
+            writes.update(names)
+    return Access(reads=frozenset(reads), writes=frozenset(writes))
+
+
+def get_graph(names, accesses):
+    """Return the DataflowGraph of a sequence of calls, given the name and Access of each.
+
+    A call depends on the last earlier call writing any value it reads or writes
+    (read after write, write after write), and on every call reading a value it
+    writes since that value was last written (write after read). Calls of the same
+    name depend on each other, as routines may keep module state.
+    """
+    last_writer = {}
+    readers = {}
+    last_call = {}
+    predecessors = []
+    for i, (name, access) in enumerate(zip(names, accesses)):
+        depends = set()
+        if name in last_call:
+            depends.add(last_call[name])
+        for standard_name in access.reads | access.writes:
+            if standard_name in last_writer:
+                depends.add(last_writer[standard_name])
+        for standard_name in access.writes:
+            depends.update(readers.pop(standard_name, ()))
+        for standard_name in access.reads:
+            readers.setdefault(standard_name, []).append(i)
+        for standard_name in access.writes:
+            last_writer[standard_name] = i
+        last_call[name] = i
+        depends.discard(i)
+        predecessors.append(frozenset(depends))
+    return DataflowGraph(names=tuple(names), predecessors=tuple(predecessors))
+
+
+def get_group_graph(group_spec, schemes, buffer_names=None, ddt_lookup=None):
+    """Return the DataflowGraph of the run routines called by a suite group,
+    given a dict of SchemeSpec by name, the buffer names of values held
+    in shared buffers by standard name, and the DerivedDataTypeSpec of derived
+    types by name."""
+    routines = [
+        schemes[scheme_name].run
+        for subcycle in group_spec.subcycles
+        for _ in range(subcycle.loop)
+        for scheme_name in subcycle.schemes
+    ]
+    accesses = {}
+    for routine in routines:
+        if routine.name not in accesses:
+            accesses[routine.name] = get_access(routine, buffer_names, ddt_lookup)
+    return get_graph(
+        [routine.name for routine in routines], [accesses[routine.name] for routine in routines]
+    )
+
+
+def get_successors(graph):
+    successors = [[] for _ in graph.names]
+    for i, predecessors in enumerate(graph.predecessors):
+        for j in predecessors:
+            successors[j].append(i)
+    return successors
+
+
+def get_schedule(graph, costs=None):
+    """Return the Schedule of a graph, given the cost of each call by name
+    (by default, every call costs 1).
+
+    The span is the total cost along the critical path, which bounds the time
+    to run the graph with any number of threads, and the parallelism is the
+    total work divided by the span. The width is the most calls which can run
+    at once when every call starts as early as possible and has unit cost.
+    """
+    if costs is None:
+        costs = {}
+    finish = []
+    critical_predecessor = []
+    levels = []
+    for i, predecessors in enumerate(graph.predecessors):
+        # ties go to the earliest call, so the critical path follows the suite order
+        previous = max(sorted(predecessors), key=finish.__getitem__, default=None)
+        start = 0. if previous is None else finish[previous]
+        finish.append(start + costs.get(graph.names[i], 1.))
+        critical_predecessor.append(previous)
+        levels.append(max((levels[j] + 1 for j in predecessors), default=0))
+    work = sum(costs.get(name, 1.) for name in graph.names)
+    if len(finish) == 0:
+        return Schedule(work=0., span=0., parallelism=0., max_width=0, critical_path=())
+    critical_path = []
+    i = max(range(len(finish)), key=finish.__getitem__)
+    while i is not None:
+        critical_path.append(graph.names[i])
+        i = critical_predecessor[i]
+    span = max(finish)
+    return Schedule(
+        work=work,
+        span=span,
+        parallelism=work / span if span > 0 else 0.,
+        max_width=max(levels.count(level) for level in set(levels)),
+        critical_path=tuple(reversed(critical_path)),
+    )
+
+
+def get_profiled_costs():
+    """Return the mean time of each routine recorded by lib profiling, by name."""
+    return {row.routine: row.total_time / row.calls for row in lib.get_profile() if row.calls > 0}
+
+
+def format_schedule(group_name, graph, costs=None):
+    schedule = get_schedule(graph, costs)
+    return (
+        f"group {group_name}: {len(graph.names)} calls, work {schedule.work:.4g}, "
+        f"span {schedule.span:.4g}, parallelism {schedule.parallelism:.2f}, "
+        f"max width {schedule.max_width}\n"
+        f"  critical path: {' -> '.join(schedule.critical_path)}"
+    )
+
+
+def run_graph(calls, graph, executor):
+    """Call each function in calls on executor as soon as its predecessors in
+    graph have completed.
+
+    If a call raises, no further calls are started and the first error is raised
+    once the calls already running have completed.
+    """
+    n_waiting = [len(predecessors) for predecessors in graph.predecessors]
+    successors = get_successors(graph)
+    pending = {
+        executor.submit(calls[i]): i for i, n in enumerate(n_waiting) if n == 0
+    }
+    error = None
+    while len(pending) > 0:
+        done, _ = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+        for future in done:
+            i = pending.pop(future)
+            if future.exception() is not None:
+                error = error or future.exception()
+            elif error is None:
+                for j in successors[i]:
+                    n_waiting[j] -= 1
+                    if n_waiting[j] == 0:
+                        pending[executor.submit(calls[j])] = j
+    if error is not None:
+        raise error
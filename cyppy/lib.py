@@ -1,37 +1,36 @@
 import os
+import json
 import logging
+import time
 import ctypes
+import collections
+import concurrent.futures
+import threading
 import forge
 import numpy as np
+from collections import namedtuple
 from . import meta
 
 
 FILE_DIR = os.path.dirname(os.path.abspath(__file__))
 LIB_DIR = os.path.join(FILE_DIR, '../lib')
 META_DIR = os.path.join(LIB_DIR, 'physics')
+LIBRARY_FILENAME = os.path.join(LIB_DIR, 'libccpp.so')
+METADATA_CACHE_FILENAME = os.path.join(LIB_DIR, 'ccpp_metadata.pickle')
 ERRLEN = 128
 
-libccpp = ctypes.cdll.LoadLibrary(os.path.join(LIB_DIR, 'libccpp.so'))
-
-CCPP_METADATA = meta.load_meta_dir(META_DIR)
+# the library, metadata and routine wrappers are loaded on first use, see __getattr__
+_libccpp = None
+_ccpp_metadata = None
+_routine_specs = None
+_derived_type_specs = None
+_load_lock = threading.RLock()
 
 
 class CCPPError(Exception):
     pass
 
 
-def numpy_pointer(array):
-    if array.dtype == np.float64:
-        return array.ctypes.data_as(ctypes.POINTER(ctypes.c_double))
-    elif array.dtype == np.float32:
-        return array.ctypes.data_as(ctypes.POINTER(ctypes.c_float))
-    elif array.dtype == np.bool:
-        return array.ctypes.data_as(ctypes.POINTER(ctypes.c_bool))
-    elif array.dtype == np.int32:
-        return array.ctypes.data_as(ctypes.POINTER(ctypes.c_int))
-    return ctypes.c_void_p(array.ctypes.data)
-
-
 def get_python_routines(scheme):
     return_dict = {}
     for routine in scheme.init, scheme.run, scheme.finalize:
@@ -39,51 +38,181 @@ def get_python_routines(scheme):
     return return_dict
 
 
-ERRMSG = ' ' * ERRLEN
-ERRFLG = np.array(0)
+# dimensions which may be given by either of these standard names
+HORIZONTAL_DIMENSIONS = ('horizontal_dimension', 'horizontal_loop_extent')
+PLUS_ONE_SUFFIX = '_plus_one'
 
+# byte width of values of each type without a kind, as built by lib/conf/configure.fv3
+# (which compiles with -fdefault-real-8)
+DEFAULT_WIDTHS = {'real': 8, 'integer': 4, 'logical': 4}
+# byte width of the named kinds defined by the physics module machine
+KIND_WIDTHS = {
+    'kind_phys': 8,
+    'kind_dbl_prec': 8,
+    'kind_sngl_prec': 4,
+    'kind_rad': 8,
+    'kind_dyn': 8,
+    'kind_grid': 8,
+    'kind_evod': 8,
+    'kind_taum': 8,
+    'kind_ior': 8,
+    'kind_io4': 4,
+    'kind_io8': 8,
+    'kind_REAL': 8,
+    'kind_INTEGER': 4,
+    'kind_LOGICAL': 4,
+}
+# numpy dtype characters for each type, by byte width
+# logical values are 0 or 1 in an integer of the width of the kind
+DTYPE_CHARS = {
+    'real': {4: 'f4', 8: 'f8'},
+    'integer': {1: 'i1', 2: 'i2', 4: 'i4', 8: 'i8'},
+    'logical': {1: 'i1', 2: 'i2', 4: 'i4', 8: 'i8'},
+}
 
-def check_dimensions(array, signature, arg_dict):
-    if len(array.shape) != len(signature.dimensions):
-        raise CCPPError(
-            f"value for {signature.name} should have dimensions "
-            f"{signature.dimensions}, but it has {len(array.shape)} dimensions"
-        )
-    for length, dim_name in zip(array.shape, signature.dimensions):
-        arg_index = find_arg_index(dim_name, signature.args)
-        length_in_args = arg_dict[arg_index]
-        if length != length_in_args:
-            raise CCPPError(
-                f"value for {signature.name} has a length of {length} for dimension "
-                f"{dim_name}, but a value of {length_in_args} was given for {dim_name}"
-            )
+# precomputed information used to validate and pass one argument
+ArgSlot = namedtuple(
+    "ArgSlot",
+    [
+        "name", "standard_name", "type", "intent", "dimensions", "dim_indices",
+        "horizontal_axis", "dtype", "ctype",
+    ]
+)
+CallPlan = namedtuple("CallPlan", ["name", "slots", "f_routine", "extent_indices"])
+ErrorBuffers = namedtuple("ErrorBuffers", ["errmsg", "errflg"])
+Copy = namedtuple("Copy", ["scratch", "array", "copy_out"])
+# scratch is a view of buffer holding the columns of array given by index
+Gather = namedtuple("Gather", ["buffer", "scratch", "array", "index", "copy_out"])
+
+# holds the error buffers, scratch arrays and scalar values used by calls from each thread
+_thread_state = threading.local()
+
+_copy_counts = collections.Counter()
+_copy_counts_lock = threading.Lock()
 
+# profiling is opt-in, see enable_profiling
+_profiling = False
+_profile_events = None
+_profile_stats = {}
+_profile_lock = threading.Lock()
 
-def find_arg_index(name, args):
+
+def get_call_args(routine):
+    """Return the arguments of a routine which are given by the caller.
+
+    These are the arguments of the Fortran routine, with derived types given as
+    DerivedTypeHandle rather than expanded into their attributes.
+    """
+    return routine.internal_args[:-2]  # skip errmsg, errflg args as we treat those internally
+
+
+def split_dimension(dim_name):
+    """Return (candidates, offset) such that the length of dimension dim_name is
+    the value of any of the candidate standard names plus offset."""
+    offset = 0
+    if dim_name.endswith(PLUS_ONE_SUFFIX):
+        dim_name = dim_name[:-len(PLUS_ONE_SUFFIX)]
+        offset = 1
+    if dim_name in HORIZONTAL_DIMENSIONS:
+        return HORIZONTAL_DIMENSIONS, offset
+    else:
+        return (dim_name,), offset
+
+
+def get_dimension_index(dim_name, args):
+    """Return (arg_index, offset) such that the length of dimension dim_name is
+    the value of args[arg_index] plus offset, or None if no argument gives the length."""
+    candidates, offset = split_dimension(dim_name)
     for i, arg in enumerate(args):
-        if arg.name == name:
+        if arg.standard_name in candidates and len(arg.dimensions) == 0:
+            return i, offset
+    return None
+
+
+def get_horizontal_axis(dimensions):
+    for i, dim_name in enumerate(dimensions):
+        if dim_name in HORIZONTAL_DIMENSIONS:
             return i
-    raise ValueError(f"arg name {name} not found in argument list {[arg.name for arg in args]}")
+    return None
 
 
-def check_type(array, signature):
-    if signature.type == 'real' and not is_real(array.dtype):
+def count_horizontal_dimensions(dimensions):
+    """Return the number of dimensions which are horizontal, including those of
+    the horizontal length plus one."""
+    return sum(
+        split_dimension(dim_name)[0] == HORIZONTAL_DIMENSIONS for dim_name in dimensions
+    )
+
+
+def get_call_plan(routine, f_routine):
+    args = get_call_args(routine)
+    slots = tuple(
+        ArgSlot(
+            name=arg.name,
+            standard_name=arg.standard_name,
+            type=arg.type,
+            intent=arg.intent,
+            dimensions=arg.dimensions,
+            dim_indices=tuple(get_dimension_index(dim, args) for dim in arg.dimensions),
+            horizontal_axis=get_horizontal_axis(arg.dimensions),
+            dtype=get_dtype(arg.type, arg.kind) if arg.type in DTYPE_CHARS else None,
+            ctype=get_ctype(arg.type, arg.kind) if len(arg.dimensions) == 0 else None,
+        )
+        for arg in args
+    )
+    extent_indices = tuple(
+        i for i, arg in enumerate(args)
+        if arg.standard_name in HORIZONTAL_DIMENSIONS and len(arg.dimensions) == 0
+    )
+    f_routine.argtypes = (
+        [ctypes.c_void_p] * len(slots) + [ctypes.c_char_p, ctypes.POINTER(ctypes.c_int)]
+    )
+    f_routine.restype = None
+    return CallPlan(
+        name=routine.name, slots=slots, f_routine=f_routine, extent_indices=extent_indices
+    )
+
+
+def check_dimensions(array, slot, args):
+    if array.ndim != len(slot.dimensions):
         raise CCPPError(
-            f"value for {signature.name} should be of type real, "
+            f"value for {slot.name} should have dimensions "
+            f"{slot.dimensions}, but it has {array.ndim} dimensions"
+        )
+    for length, dim_name, dim_index in zip(array.shape, slot.dimensions, slot.dim_indices):
+        if dim_index is not None and args[dim_index[0]] is not None:
+            arg_index, offset = dim_index
+            length_in_args = int(args[arg_index]) + offset
+            if length != length_in_args:
+                raise CCPPError(
+                    f"value for {slot.name} has a length of {length} for dimension "
+                    f"{dim_name}, but a value of {length_in_args} was given for {dim_name}"
+                )
+
+
+def check_type(array, slot, cast=False):
+    if slot.type == 'real' and not is_real(array.dtype):
+        raise CCPPError(
+            f"value for {slot.name} should be of type real, "
             f"but dtype {array.dtype} was given"
         )
-    elif signature.type == 'integer' and not is_integer(array.dtype):
+    elif slot.type == 'integer' and not is_integer(array.dtype):
         raise CCPPError(
-            f"value for {signature.name} should be of type integer, "
+            f"value for {slot.name} should be of type integer, "
             f"but dtype {array.dtype} was given"
         )
-    elif signature.type == 'logical' and not is_bool(array.dtype):
+    elif slot.type == 'logical' and not is_bool(array.dtype):
         raise CCPPError(
-            f"value for {signature.name} should be of type logical, "
+            f"value for {slot.name} should be of type logical, "
             f"but dtype {array.dtype} was given"
         )
-    elif signature.type not in ('real', 'integer', 'logical'):
-        raise NotImplementedError(f"Need code for type {signature.type}")
+    elif slot.type not in DTYPE_CHARS:
+        raise NotImplementedError(f"Need code for type {slot.type}")
+    elif not cast and array.dtype != slot.dtype:
+        raise CCPPError(
+            f"value for {slot.name} should have dtype {slot.dtype}, but dtype "
+            f"{array.dtype} was given, pass cast=True to convert it on each call"
+        )
 
 
 def is_real(dtype):
@@ -91,41 +220,1148 @@ def is_real(dtype):
 
 
 def is_integer(dtype):
-    return dtype == np.int64
+    return np.issubdtype(dtype, np.signedinteger)
 
 
 def is_bool(dtype):
-    return dtype == np.bool
+    # logical arrays are passed as integers, but may be cast from booleans
+    return dtype == np.bool_ or is_integer(dtype)
+
+
+def get_width(arg_type, arg_kind):
+    """Return the size in bytes of values of the given Fortran type and kind."""
+    if arg_kind is None:
+        return DEFAULT_WIDTHS[arg_type]
+    elif arg_kind in KIND_WIDTHS:
+        return KIND_WIDTHS[arg_kind]
+    elif arg_kind.isdigit():
+        return int(arg_kind)
+    else:
+        raise CCPPError(f"width of kind {arg_kind} for type {arg_type} is not known")
+
+
+def get_dtype(arg_type, arg_kind):
+    """Return the numpy dtype with the memory layout of the given Fortran type and kind."""
+    if arg_type not in DTYPE_CHARS:
+        raise NotImplementedError(f"Need code for type {arg_type}")
+    width = get_width(arg_type, arg_kind)
+    if width not in DTYPE_CHARS[arg_type]:
+        raise CCPPError(f"{arg_type} of kind {arg_kind} has unsupported width {width}")
+    return np.dtype(DTYPE_CHARS[arg_type][width])
+
+
+def get_ctype(arg_type, arg_kind):
+    """Return the ctypes type used to pass scalars of the given Fortran type and kind,
+    or None if scalars of that type cannot be passed as Python values."""
+    if arg_type not in DTYPE_CHARS:
+        return None
+    return np.ctypeslib.as_ctypes_type(get_dtype(arg_type, arg_kind))
+
+
+def check_scalar(value, slot):
+    if slot.ctype is None or len(slot.dimensions) > 0:
+        raise CCPPError(
+            f"value for {slot.name} must be a numpy array, but {type(value)} was given"
+        )
+    elif value is None:
+        if slot.intent != 'out':
+            raise CCPPError(f"value for intent({slot.intent}) {slot.name} must not be None")
+    elif slot.type == 'real' and not isinstance(value, (int, float, np.integer, np.floating)):
+        raise CCPPError(
+            f"value for {slot.name} should be of type real, but {type(value)} was given"
+        )
+    elif slot.type == 'integer' and not isinstance(value, (int, np.integer)):
+        raise CCPPError(
+            f"value for {slot.name} should be of type integer, but {type(value)} was given"
+        )
+    elif slot.type == 'logical' and not isinstance(value, (bool, np.bool_)):
+        raise CCPPError(
+            f"value for {slot.name} should be of type logical, but {type(value)} was given"
+        )
+
+
+def check_handle(value, slot):
+    if not isinstance(value, DerivedTypeHandle):
+        raise CCPPError(
+            f"value for {slot.name} must be a DerivedTypeHandle of type {slot.type}, "
+            f"but {type(value)} was given"
+        )
+    elif value.type_name != slot.type:
+        raise CCPPError(
+            f"value for {slot.name} must be a DerivedTypeHandle of type {slot.type}, "
+            f"but a handle of type {value.type_name} was given"
+        )
+
+
+def validate_args(plan, args, cast=False):
+    if len(args) != len(plan.slots):
+        raise TypeError(
+            f"{plan.name} takes {len(plan.slots)} arguments but {len(args)} were given"
+        )
+    for arg, slot in zip(args, plan.slots):
+        if slot.type not in meta.INTRINSIC_TYPES:
+            check_handle(arg, slot)
+        elif isinstance(arg, np.ndarray):
+            check_dimensions(arg, slot, args)
+            check_type(arg, slot, cast)
+        else:
+            check_scalar(arg, slot)
+
+
+def get_copy_counts():
+    """Return the number of copies made of arguments which were not contiguous
+    in Fortran order or were cast to another dtype, by (routine name, argument name)."""
+    with _copy_counts_lock:
+        return dict(_copy_counts)
+
+
+def reset_copy_counts():
+    with _copy_counts_lock:
+        _copy_counts.clear()
+
+
+def get_scratch_pool():
+    """Return the scratch arrays of the current thread, by (shape, dtype)."""
+    try:
+        return _thread_state.scratch_pool
+    except AttributeError:
+        _thread_state.scratch_pool = collections.defaultdict(list)
+        return _thread_state.scratch_pool
+
+
+def acquire_scratch(shape, dtype):
+    buffers = get_scratch_pool()[shape, dtype]
+    if len(buffers) > 0:
+        return buffers.pop()
+    else:
+        return np.empty(shape, dtype=dtype, order='F')
+
+
+def release_scratch(array):
+    get_scratch_pool()[array.shape, array.dtype].append(array)
+
+
+def get_scalar_values(plan):
+    """Return the ctypes values of the current thread used to pass Python scalars
+    for each argument of a routine, or None for arguments which cannot be scalars."""
+    try:
+        scalar_values = _thread_state.scalar_values
+    except AttributeError:
+        scalar_values = _thread_state.scalar_values = {}
+    try:
+        return scalar_values[plan.name]
+    except KeyError:
+        scalar_values[plan.name] = new_scalar_values(plan)
+        return scalar_values[plan.name]
+
+
+def new_scalar_values(plan):
+    return [
+        None if slot.ctype is None else ScalarValue(slot.ctype())
+        for slot in plan.slots
+    ]
+
+
+class ScalarValue:
+    """A ctypes value and its address, used to pass a scalar by reference."""
+
+    __slots__ = ('value', 'address', 'convert')
+
+    def __init__(self, value):
+        self.value = value
+        self.address = ctypes.addressof(value)
+        # converts Python or numpy scalars to a type ctypes accepts
+        self.convert = float if isinstance(value, (ctypes.c_float, ctypes.c_double)) else int
+
+
+def get_output(scalar_value, slot):
+    if slot.type == 'logical':
+        return bool(scalar_value.value.value)
+    else:
+        return scalar_value.value.value
+
+
+def get_return_value(outputs):
+    """Return None, one value, or a tuple of values for a list of (ScalarValue, ArgSlot)."""
+    if len(outputs) == 0:
+        return None
+    elif len(outputs) == 1:
+        return get_output(*outputs[0])
+    else:
+        return tuple(get_output(*output) for output in outputs)
+
+
+def is_direct(array, slot):
+    """Return whether an array can be passed to the Fortran cap without copying."""
+    return array.flags.f_contiguous and (
+        array.dtype is slot.dtype or slot.dtype is None or array.dtype == slot.dtype
+    )
+
+
+def get_scratch_dtype(array, slot):
+    return array.dtype if slot.dtype is None else slot.dtype
+
+
+def prepare_args(plan, args, scalar_values=None):
+    """Return the pointers to pass for args, a list of Copy for any arguments
+    which had to be copied to Fortran-contiguous scratch arrays of the dtype of
+    the argument, and a list of
+    (ScalarValue, ArgSlot) for scalars given as Python values which may be written."""
+    pointers = []
+    copies = []
+    outputs = []
+    for i, (arg, slot) in enumerate(zip(args, plan.slots)):
+        if not isinstance(arg, np.ndarray):
+            if isinstance(arg, DerivedTypeHandle):
+                pointers.append(arg.address)
+                continue
+            if scalar_values is None:
+                scalar_values = get_scalar_values(plan)
+            scalar_value = scalar_values[i]
+            if arg is not None:
+                scalar_value.value.value = scalar_value.convert(arg)
+            pointers.append(scalar_value.address)
+            if slot.intent != 'in':
+                outputs.append((scalar_value, slot))
+        elif is_direct(arg, slot):
+            pointers.append(arg.ctypes.data)
+        else:
+            with _copy_counts_lock:
+                _copy_counts[plan.name, slot.name] += 1
+            scratch = acquire_scratch(arg.shape, get_scratch_dtype(arg, slot))
+            # scratch holds values from earlier calls, and schemes need not write every
+            # element of intent(out) arrays, so those are copied in as well
+            scratch[...] = arg
+            copies.append(Copy(scratch=scratch, array=arg, copy_out=(slot.intent != 'in')))
+            pointers.append(scratch.ctypes.data)
+    return pointers, copies, outputs
+
+
+def finish_copies(copies):
+    for copy in copies:
+        if copy.copy_out:
+            copy.array[...] = copy.scratch
+        release_scratch(copy.scratch)
+
+
+def call_routine(plan, args, error_buffers=None, scalar_values=None):
+    """Call a routine, returning the values of any scalars given as Python values
+    which are intent(out) or intent(inout)."""
+    pointers, copies, outputs = prepare_args(plan, args, scalar_values)
+    try:
+        call_fortran(plan, pointers, error_buffers)
+    finally:
+        finish_copies(copies)
+    return get_return_value(outputs)
+
+
+def new_error_buffers():
+    return ErrorBuffers(errmsg=ctypes.create_string_buffer(ERRLEN), errflg=ctypes.c_int(0))
+
+
+def get_error_buffers():
+    """Return the error buffers of the current thread, creating them if needed."""
+    try:
+        return _thread_state.error_buffers
+    except AttributeError:
+        _thread_state.error_buffers = new_error_buffers()
+        return _thread_state.error_buffers
+
+
+def call_fortran(plan, pointers, error_buffers=None):
+    if error_buffers is None:
+        error_buffers = get_error_buffers()
+    errmsg, errflg = error_buffers
+    errflg.value = 0  # caps of routines without error handling do not set errflg
+    if _profiling:
+        start = time.perf_counter()
+        plan.f_routine(*pointers, errmsg, errflg)
+        _thread_state.fortran_span = (start, time.perf_counter())
+    else:
+        plan.f_routine(*pointers, errmsg, errflg)
+    if errflg.value != 0:
+        raise CCPPError(f"{plan.name}: {errmsg.value.decode().strip()}")
+
+
+def call_validated(plan, args, validate=True, cast=False):
+    logging.debug("calling routine %s", plan.name)
+    if validate:
+        validate_args(plan, args, cast)
+    return_value = call_routine(plan, args)
+    logging.debug("completed routine %s", plan.name)
+    return return_value
+
+
+def get_ordered_args(plan, args, kwargs):
+    """Return the arguments for a call plan in order, given positionally or by name."""
+    ordered_args = list(args) + [None] * (len(plan.slots) - len(args))
+    for i, slot in enumerate(plan.slots[len(args):], start=len(args)):
+        if slot.name not in kwargs:
+            raise TypeError(f"{plan.name} missing argument {slot.name}")
+        ordered_args[i] = kwargs.pop(slot.name)
+    if len(kwargs) > 0 or len(args) > len(plan.slots):
+        raise TypeError(
+            f"{plan.name} got unexpected arguments, "
+            f"expected {[slot.name for slot in plan.slots]}"
+        )
+    return tuple(ordered_args)
+
+
+class BoundRoutine:
+    """A routine with its arguments resolved to pointers once, so that repeated
+    calls on the same arrays only invoke the Fortran cap.
+
+    Arrays are held by reference, so changes to their values in-place are
+    seen by later calls. If check is True, each call compares the data pointer
+    of each array to the bound pointer and updates the pointers if any has changed.
+    Scalars given as Python values are copied when bound; intent(inout) scalars
+    keep the value written by the previous call.
+
+    Each bound routine has its own error buffers, so different bound routines
+    can be called concurrently from different threads.
+
+    Arrays which are not Fortran-contiguous, or (if cast is True) do not have
+    the dtype of their argument, are copied on every call.
+    """
+
+    def __init__(self, plan, args, validate=True, check=True, cast=False):
+        self.plan = plan
+        self.error_buffers = new_error_buffers()
+        self.scalar_values = new_scalar_values(plan)
+        self.validate = validate
+        self.check = check
+        self.cast = cast
+        self.bind(*args)
+
+    def bind(self, *args, **kwargs):
+        """Bind new argument values, given positionally or by name."""
+        args = get_ordered_args(self.plan, args, kwargs)
+        if self.validate:
+            validate_args(self.plan, args, self.cast)
+        self.args = args
+        # Python scalars are converted once here, so that calls pass the values
+        # written by previous calls
+        for arg, scalar_value in zip(args, self.scalar_values):
+            if not isinstance(arg, (np.ndarray, DerivedTypeHandle)):
+                scalar_value.value.value = scalar_value.convert(arg)
+        self.call_args = tuple(
+            arg if isinstance(arg, (np.ndarray, DerivedTypeHandle)) else None for arg in args
+        )
+        self.arrays = tuple(arg for arg in args if isinstance(arg, np.ndarray))
+        self.nbytes = sum(array.nbytes for array in self.arrays)
+        self.direct = all(
+            is_direct(arg, slot) for arg, slot in zip(args, self.plan.slots)
+            if isinstance(arg, np.ndarray)
+        )
+        if self.direct:
+            pointers, _, self.outputs = prepare_args(self.plan, self.call_args, self.scalar_values)
+            self.pointers = tuple(ctypes.c_void_p(pointer) for pointer in pointers)
+            self.array_pointers = tuple(
+                pointer for arg, pointer in zip(args, pointers) if isinstance(arg, np.ndarray)
+            )
+
+    def refresh(self):
+        """Update the pointers of bound arrays whose data has moved, keeping the
+        values of bound scalars."""
+        self.direct = all(
+            is_direct(arg, slot) for arg, slot in zip(self.args, self.plan.slots)
+            if isinstance(arg, np.ndarray)
+        )
+        if self.direct:
+            self.pointers = tuple(
+                ctypes.c_void_p(arg.ctypes.data) if isinstance(arg, np.ndarray) else pointer
+                for arg, pointer in zip(self.args, self.pointers)
+            )
+            self.array_pointers = tuple(array.ctypes.data for array in self.arrays)
+
+    def __call__(self):
+        if _profiling:
+            return call_profiled(self.plan, self.nbytes, self.call)
+        return self.call()
+
+    def call(self):
+        if not self.direct:
+            return call_routine(self.plan, self.call_args, self.error_buffers, self.scalar_values)
+        if self.check:
+            for array, pointer in zip(self.arrays, self.array_pointers):
+                if array.ctypes.data != pointer:
+                    self.refresh()
+                    return self.call()
+        call_fortran(self.plan, self.pointers, self.error_buffers)
+        return get_return_value(self.outputs)
+
+
+_executor = None
+
+
+def get_executor():
+    """Return the thread pool shared by chunked calls, creating it if needed."""
+    global _executor
+    if _executor is None:
+        _executor = concurrent.futures.ThreadPoolExecutor()
+    return _executor
+
+
+def get_chunk_bounds(n_columns, n_chunks):
+    """Return (start, stop) column bounds splitting n_columns into n_chunks nearly equal chunks."""
+    n_chunks = max(1, min(n_chunks, n_columns))
+    edges = [n_columns * i // n_chunks for i in range(n_chunks + 1)]
+    return list(zip(edges[:-1], edges[1:]))
+
+
+def check_chunkable(plan):
+    if len(plan.extent_indices) == 0:
+        raise CCPPError(f"{plan.name} has no horizontal extent argument to split into chunks")
+    for slot in plan.slots:
+        if slot.type not in meta.INTRINSIC_TYPES:
+            raise CCPPError(
+                f"{plan.name} cannot be split into chunks because {slot.name} "
+                f"is of derived type {slot.type}"
+            )
+        n_horizontal = count_horizontal_dimensions(slot.dimensions)
+        if n_horizontal > (1 if slot.horizontal_axis is not None else 0):
+            raise CCPPError(
+                f"{plan.name} cannot be split into chunks because {slot.name} "
+                f"has dimensions {slot.dimensions}"
+            )
+        elif slot.intent != 'in' and slot.horizontal_axis is None:
+            raise CCPPError(
+                f"{plan.name} cannot be split into chunks because {slot.name} "
+                f"is intent({slot.intent}) but is not horizontally dimensioned"
+            )
+
+
+def get_chunk_args(plan, args, start, stop):
+    """Return the arguments for one chunk of columns, as views where possible."""
+    chunk_args = list(args)
+    for i, slot in enumerate(plan.slots):
+        if slot.horizontal_axis is not None:
+            index = (slice(None),) * slot.horizontal_axis + (slice(start, stop),)
+            chunk_args[i] = args[i][index]
+    for i in plan.extent_indices:
+        chunk_args[i] = stop - start
+    return chunk_args
+
+
+def call_chunk(plan, args, start, stop):
+    # chunks of multi-dimensional arrays are not contiguous, and are copied by call_routine
+    chunk_args = get_chunk_args(plan, args, start, stop)
+    if _profiling:
+        call_profiled(plan, get_nbytes(chunk_args), call_routine, plan, chunk_args)
+    else:
+        call_routine(plan, chunk_args)
+
+
+def call_chunked(plan, args, n_chunks=None, executor=None):
+    """Call a routine by splitting its horizontal dimension into chunks
+    which are run concurrently on a thread pool."""
+    check_chunkable(plan)
+    if n_chunks is None:
+        n_chunks = os.cpu_count()
+    if executor is None:
+        executor = get_executor()
+    n_columns = int(args[plan.extent_indices[0]])
+    futures = [
+        executor.submit(call_chunk, plan, args, start, stop)
+        for start, stop in get_chunk_bounds(n_columns, n_chunks)
+    ]
+    for future in futures:
+        future.result()
+
+
+def check_maskable(plan):
+    if len(plan.extent_indices) == 0:
+        raise CCPPError(f"{plan.name} has no horizontal extent argument to compact")
+    for slot in plan.slots:
+        if slot.type not in meta.INTRINSIC_TYPES:
+            raise CCPPError(
+                f"{plan.name} cannot be compacted because {slot.name} "
+                f"is of derived type {slot.type}"
+            )
+        n_horizontal = count_horizontal_dimensions(slot.dimensions)
+        if n_horizontal > (1 if slot.horizontal_axis is not None else 0):
+            raise CCPPError(
+                f"{plan.name} cannot be compacted because {slot.name} "
+                f"has dimensions {slot.dimensions}"
+            )
+
+
+def get_mask_index(plan, mask):
+    """Return the index of the argument of a routine given by name or standard name,
+    which must be a horizontally dimensioned array."""
+    for i, slot in enumerate(plan.slots):
+        if mask in (slot.name, slot.standard_name):
+            if slot.horizontal_axis is None or len(slot.dimensions) != 1:
+                raise CCPPError(f"{plan.name} argument {mask} is not a horizontal mask")
+            return i
+    raise CCPPError(f"{plan.name} has no argument {mask}")
+
+
+def get_compact_args(plan, args, columns):
+    """Return the arguments restricted to the given column indices, with each
+    horizontally dimensioned array gathered into a Fortran-contiguous scratch array,
+    and a list of Gather for those arrays."""
+    compact_args = list(args)
+    gathers = []
+    try:
+        for i, slot in enumerate(plan.slots):
+            if slot.horizontal_axis is None:
+                continue
+            array = args[i]
+            axis = slot.horizontal_axis
+            shape = array.shape[:axis] + (len(columns),) + array.shape[axis + 1:]
+            # scratch is sized for all columns, so it is reused whatever the number of columns
+            buffer = acquire_scratch((array.size,), get_scratch_dtype(array, slot))
+            scratch = buffer[:int(np.prod(shape))].reshape(shape, order='F')
+            index = (slice(None),) * axis + (columns,)
+            gathers.append(
+                Gather(buffer=buffer, scratch=scratch, array=array, index=index,
+                       copy_out=(slot.intent != 'in'))
+            )
+            # intent(out) arrays are gathered too, see prepare_args
+            if scratch.dtype == array.dtype:
+                # taking from the transposes is much faster, as they are in C order;
+                # columns are within the horizontal extent, so clipping never applies
+                np.take(
+                    array.T, columns, axis=array.ndim - 1 - axis, out=scratch.T, mode='clip'
+                )
+            else:
+                scratch[...] = array[index]
+            compact_args[i] = scratch
+    except BaseException:
+        release_gathers(gathers)
+        raise
+    for i in plan.extent_indices:
+        compact_args[i] = len(columns)
+    return compact_args, gathers
+
+
+def release_gathers(gathers):
+    for gather in gathers:
+        release_scratch(gather.buffer)
+
+
+def finish_gathers(gathers):
+    """Scatter the results in each Gather back to its array, releasing every
+    scratch buffer even if scattering fails."""
+    try:
+        for gather in gathers:
+            if gather.copy_out:
+                gather.array[gather.index] = gather.scratch
+    finally:
+        release_gathers(gathers)
+
+
+def call_masked(plan, args, mask, validate=True, cast=False):
+    """Call a routine on only the columns where mask is nonzero, gathering its
+    horizontally dimensioned arrays into scratch arrays and scattering the results back.
+
+    mask is an argument name or standard name, or an array of the horizontal dimension.
+    The routine must leave the columns where mask is zero unchanged, as they are not
+    passed to it. Returns the value of the call, or None if no column is active.
+    """
+    check_maskable(plan)
+    if validate:
+        validate_args(plan, args, cast)
+    if isinstance(mask, str):
+        mask = args[get_mask_index(plan, mask)]
+    mask = np.asarray(mask)
+    n_columns = int(args[plan.extent_indices[0]])
+    if mask.shape != (n_columns,):
+        raise CCPPError(
+            f"mask for {plan.name} should have shape ({n_columns},), "
+            f"but shape {mask.shape} was given"
+        )
+    columns = np.flatnonzero(mask)
+    if len(columns) == 0:
+        return None
+    compact_args, gathers = get_compact_args(plan, args, columns)
+    try:
+        return call_routine(plan, compact_args)
+    finally:
+        finish_gathers(gathers)
+
+
+def check_batchable(plan):
+    if len(plan.extent_indices) == 0:
+        raise CCPPError(f"{plan.name} has no horizontal extent argument to batch over")
+    for slot in plan.slots:
+        if slot.type not in meta.INTRINSIC_TYPES:
+            raise CCPPError(
+                f"{plan.name} cannot be batched because {slot.name} "
+                f"is of derived type {slot.type}"
+            )
+        n_horizontal = count_horizontal_dimensions(slot.dimensions)
+        if n_horizontal > (1 if slot.horizontal_axis is not None else 0):
+            raise CCPPError(
+                f"{plan.name} cannot be batched because {slot.name} "
+                f"has dimensions {slot.dimensions}"
+            )
+        elif slot.intent != 'in' and slot.horizontal_axis is None:
+            raise CCPPError(
+                f"{plan.name} cannot be batched because {slot.name} "
+                f"is intent({slot.intent}) but is not horizontally dimensioned"
+            )
+
+
+def get_n_members(plan, args):
+    """Return the length of the leading ensemble axis of the horizontally dimensioned arguments."""
+    n_members = None
+    for arg, slot in zip(args, plan.slots):
+        if slot.horizontal_axis is None:
+            continue
+        elif not isinstance(arg, np.ndarray) or arg.ndim != len(slot.dimensions) + 1:
+            raise CCPPError(
+                f"value for {slot.name} should be an array with a leading ensemble axis "
+                f"followed by dimensions {slot.dimensions}"
+            )
+        elif n_members is None:
+            n_members = arg.shape[0]
+        elif arg.shape[0] != n_members:
+            raise CCPPError(
+                f"value for {slot.name} has {arg.shape[0]} ensemble members, "
+                f"but other values have {n_members}"
+            )
+    if n_members is None:
+        raise CCPPError(f"{plan.name} has no horizontally dimensioned arguments to batch")
+    return n_members
+
+
+def get_member_args(plan, args, member):
+    """Return the arguments of one ensemble member, as views."""
+    return [
+        arg[member] if slot.horizontal_axis is not None else arg
+        for arg, slot in zip(args, plan.slots)
+    ]
+
+
+def get_batch_args(plan, args, n_members):
+    """Return arguments with the ensemble axis of each array merged into its horizontal
+    axis, and a list of Copy for arrays which had to be copied to do so."""
+    batch_args = list(args)
+    copies = []
+    for i, slot in enumerate(plan.slots):
+        if slot.horizontal_axis is None:
+            continue
+        axis = slot.horizontal_axis
+        # columns of each member are followed by those of the next member,
+        # so the ensemble axis goes just after the horizontal axis
+        array = np.moveaxis(args[i], 0, axis + 1)
+        batch_shape = array.shape[:axis] + (array.shape[axis] * n_members,) + array.shape[axis + 2:]
+        if not is_direct(array, slot):
+            with _copy_counts_lock:
+                _copy_counts[plan.name, slot.name] += 1
+            scratch = acquire_scratch(array.shape, get_scratch_dtype(array, slot))
+            # intent(out) arrays are copied in too, see prepare_args
+            scratch[...] = array
+            copies.append(Copy(scratch=scratch, array=array, copy_out=(slot.intent != 'in')))
+            array = scratch
+        batch_args[i] = array.reshape(batch_shape, order='F')
+    for i in plan.extent_indices:
+        batch_args[i] = int(args[i]) * n_members
+    return batch_args, copies
+
+
+def call_batched(plan, args, validate=True, cast=False):
+    """Call a routine once on a stack of independent ensemble members.
+
+    Horizontally dimensioned arrays have a leading ensemble axis, and the horizontal
+    extent is the number of columns of one member. Other arguments are shared by
+    every member. Arrays are passed without copying if their columns are already
+    laid out one member after another in Fortran order.
+    """
+    check_batchable(plan)
+    n_members = get_n_members(plan, args)
+    if validate:
+        validate_args(plan, get_member_args(plan, args, 0), cast)
+    batch_args, copies = get_batch_args(plan, args, n_members)
+    try:
+        call_routine(plan, batch_args)
+    finally:
+        finish_copies(copies)
+
+
+HandleFunctions = namedtuple(
+    "HandleFunctions", ["create", "destroy", "attr_loc", "attr_shape", "allocate"]
+)
+
+
+def get_handle_functions(type_name):
+    """Return the functions of the types cap which manage instances of a derived type."""
+    library = get_library()
+    prefix = f"cyppy_{type_name.lower()}"
+    functions = HandleFunctions(
+        *(getattr(library, f"{prefix}_{name}") for name in HandleFunctions._fields)
+    )
+    functions.create.argtypes = []
+    functions.create.restype = ctypes.c_void_p
+    functions.destroy.argtypes = [ctypes.c_void_p]
+    functions.destroy.restype = None
+    functions.attr_loc.argtypes = [ctypes.c_void_p, ctypes.c_int]
+    functions.attr_loc.restype = ctypes.c_void_p
+    for function in functions.attr_shape, functions.allocate:
+        function.argtypes = [ctypes.c_void_p, ctypes.c_int, ctypes.c_void_p]
+        function.restype = None
+    return functions
+
+
+def get_fortran_view(address, shape, dtype, owner):
+    """Return a Fortran-ordered array of the memory at address, which keeps owner alive."""
+    dtype = np.dtype(dtype)
+    nbytes = int(np.prod(shape)) * dtype.itemsize
+    buffer = (ctypes.c_char * nbytes).from_address(address)
+    buffer.owner = owner
+    return np.ndarray(shape, dtype=dtype, buffer=buffer, order='F')
+
+
+class DerivedTypeHandle:
+    """An instance of a derived type allocated in Fortran, which is passed by
+    reference to routines taking that type so that nothing is copied on each call.
+
+    Attributes are accessed by standard name. Arrays are numpy views of the Fortran
+    memory, and must be allocated (by allocate, or by a Fortran routine) before they
+    are accessed. Arrays are never reallocated, so views are valid until the handle
+    is closed and values must be updated in-place. Scalars are
+    0-dimensional views, and attributes of derived types are handles.
+    """
+
+    def __init__(self, type_name, address=None, parent=None):
+        """
+        Args:
+            type_name: name of the derived type
+            address: address of an existing instance, by default a new instance is allocated
+            parent: handle owning the instance at address, which is kept alive by this handle
+        """
+        self.type_name = type_name
+        self.address = None
+        ddt = get_derived_type_specs().get(type_name)
+        if ddt is None:
+            raise CCPPError(f"derived type {type_name} is not available")
+        self._attrs = {
+            attr.standard_name: (attr_id, attr)
+            for attr_id, attr in enumerate(ddt.attrs) if meta.is_handle_attr(attr)
+        }
+        self._functions = get_handle_functions(type_name)
+        self._parent = parent
+        self._owned = address is None
+        self.address = self._functions.create() if address is None else address
+
+    @property
+    def standard_names(self):
+        """Standard names of the attributes which can be accessed through this handle."""
+        return list(self._attrs)
+
+    def __contains__(self, standard_name):
+        return standard_name in self._attrs
+
+    def get_attr(self, standard_name):
+        self.check_open()
+        if standard_name not in self._attrs:
+            raise KeyError(f"{self.type_name} has no attribute {standard_name} with handle access")
+        return self._attrs[standard_name]
+
+    def check_open(self):
+        if self.address is None:
+            raise CCPPError(f"handle to {self.type_name} is closed")
+
+    def __getitem__(self, standard_name):
+        attr_id, attr = self.get_attr(standard_name)
+        address = self._functions.attr_loc(self.address, attr_id)
+        if attr.type not in meta.INTRINSIC_TYPES:
+            return DerivedTypeHandle(attr.type, address=address, parent=self)
+        elif len(attr.dimensions) == 0:
+            return get_fortran_view(address, (), get_dtype(attr.type, attr.kind), self)
+        elif address is None:
+            raise CCPPError(f"{standard_name} of {self.type_name} is not allocated")
+        shape = np.zeros(len(attr.dimensions), dtype=np.int32)
+        self._functions.attr_shape(self.address, attr_id, shape.ctypes.data)
+        return get_fortran_view(address, tuple(shape), get_dtype(attr.type, attr.kind), self)
+
+    def is_allocated(self, standard_name):
+        """Return whether an attribute can be accessed, which for arrays requires
+        them to be allocated."""
+        attr_id, _ = self.get_attr(standard_name)
+        return self._functions.attr_loc(self.address, attr_id) is not None
+
+    def allocate(self, standard_name, shape):
+        """Allocate an array attribute in Fortran, and return a view of it.
+
+        The values of the array are not initialized. Raises CCPPError if the
+        attribute is already allocated, as views of it may be in use.
+        """
+        attr_id, attr = self.get_attr(standard_name)
+        shape = (shape,) if np.isscalar(shape) else tuple(shape)
+        if len(shape) != len(attr.dimensions):
+            raise CCPPError(
+                f"{standard_name} of {self.type_name} has dimensions {attr.dimensions}, "
+                f"but shape {shape} was given"
+            )
+        elif self.is_allocated(standard_name):
+            raise CCPPError(f"{standard_name} of {self.type_name} is already allocated")
+        # kept in a variable, so that it is not freed before Fortran reads it
+        shape_array = np.array(shape, dtype=np.int32)
+        self._functions.allocate(self.address, attr_id, shape_array.ctypes.data)
+        return self[standard_name]
+
+    def close(self):
+        """Deallocate the instance and its arrays, if it was allocated by this handle.
+
+        Views of its arrays must not be used after the handle is closed.
+        """
+        if self._owned and self.address is not None:
+            self._functions.destroy(self.address)
+        self.address = None
+
+    def __del__(self):
+        if self.address is not None:
+            self.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __repr__(self):
+        address = 'closed' if self.address is None else f"at {self.address:#x}"
+        return f"<DerivedTypeHandle {self.type_name} {address}>"
+
+
+TraceEvent = namedtuple("TraceEvent", ["routine", "event", "time"])
+TRACE_EVENTS = ('enter', 'exit')
+
+
+def get_routine_names():
+    """Return routine names in the order of the routine ids used by make_cap.py."""
+    return [routine.name for routine in meta.iterate_routines(get_metadata().schemes)]
+
+
+def is_tracing_enabled():
+    return hasattr(get_library(), 'cyppy_trace_info')
+
+
+def read_trace():
+    """Return the routine enter/exit events recorded by the cap, oldest first.
+
+    Times are in seconds from an arbitrary reference. Requires libccpp.so to be
+    built with tracing and OpenMP enabled (make TRACE=Y). Only the most recent
+    events are kept, as many as fit in the ring buffer set by make_cap.py --trace-length.
+    """
+    if not is_tracing_enabled():
+        raise CCPPError("libccpp.so was built without tracing, rebuild it with make TRACE=Y")
+    libccpp = get_library()
+    length, count, count_rate = ctypes.c_int(), ctypes.c_int64(), ctypes.c_int64()
+    libccpp.cyppy_trace_info(ctypes.byref(length), ctypes.byref(count), ctypes.byref(count_rate))
+    routine_ids = np.zeros(length.value, dtype=np.int32)
+    events = np.zeros(length.value, dtype=np.int32)
+    times = np.zeros(length.value, dtype=np.int64)
+    libccpp.cyppy_trace_read(
+        ctypes.c_void_p(routine_ids.ctypes.data),
+        ctypes.c_void_p(events.ctypes.data),
+        ctypes.c_void_p(times.ctypes.data),
+    )
+    n_events = min(count.value, length.value)
+    first = count.value - n_events
+    routine_names = get_routine_names()
+    return [
+        TraceEvent(
+            routine=routine_names[routine_ids[i % length.value]],
+            event=TRACE_EVENTS[events[i % length.value]],
+            time=float(times[i % length.value]) / count_rate.value,
+        )
+        for i in range(first, first + n_events)
+    ]
+
+
+def reset_trace():
+    if not is_tracing_enabled():
+        raise CCPPError("libccpp.so was built without tracing, rebuild it with make TRACE=Y")
+    get_library().cyppy_trace_reset()
+
+
+ProfileRow = namedtuple(
+    "ProfileRow",
+    [
+        "routine", "calls", "total_time", "prep_time", "fortran_time",
+        "min_time", "max_time", "nbytes",
+    ]
+)
+
+
+class ProfileStats:
+    """Totals of the calls to one routine, see get_profile."""
+
+    __slots__ = ('calls', 'total_time', 'fortran_time', 'min_time', 'max_time', 'nbytes')
+
+    def __init__(self):
+        self.calls = 0
+        self.total_time = 0.
+        self.fortran_time = 0.
+        self.min_time = float('inf')
+        self.max_time = 0.
+        self.nbytes = 0
+
+
+def enable_profiling(events=False):
+    """Record the calls, wall time and bytes of array data passed for each routine.
+
+    Times are split into time in the Fortran cap and time spent in Python preparing
+    the call, such as validating and copying arguments. Each chunk of a chunked
+    call is recorded as a call. If events is True, every call is also kept so it
+    can be written with write_chrome_trace.
+    """
+    global _profiling, _profile_events
+    with _profile_lock:
+        if events and _profile_events is None:
+            _profile_events = []
+        elif not events:
+            _profile_events = None
+        _profiling = True
+
+
+def disable_profiling():
+    global _profiling
+    _profiling = False
+
+
+def is_profiling_enabled():
+    return _profiling
+
+
+def reset_profile():
+    with _profile_lock:
+        _profile_stats.clear()
+        if _profile_events is not None:
+            _profile_events.clear()
+
+
+def get_nbytes(args):
+    return sum(arg.nbytes for arg in args if isinstance(arg, np.ndarray))
+
+
+def record_call(name, start, end, fortran_span, nbytes):
+    duration = end - start
+    fortran_time = 0. if fortran_span is None else fortran_span[1] - fortran_span[0]
+    with _profile_lock:
+        stats = _profile_stats.get(name)
+        if stats is None:
+            stats = _profile_stats[name] = ProfileStats()
+        stats.calls += 1
+        stats.total_time += duration
+        stats.fortran_time += fortran_time
+        stats.min_time = min(stats.min_time, duration)
+        stats.max_time = max(stats.max_time, duration)
+        stats.nbytes += nbytes
+        if _profile_events is not None:
+            _profile_events.append(
+                (name, threading.get_ident(), start, end, fortran_span, nbytes)
+            )
+
+
+def call_profiled(plan, nbytes, function, *args):
+    """Return function(*args), recording it as a call of the routine of plan."""
+    _thread_state.fortran_span = None
+    start = time.perf_counter()
+    try:
+        return function(*args)
+    finally:
+        record_call(plan.name, start, time.perf_counter(), _thread_state.fortran_span, nbytes)
+
+
+def get_profile():
+    """Return a ProfileRow for each routine called while profiling, most total time first.
+
+    Times are in seconds, and nbytes is the total size of the arrays passed.
+    """
+    with _profile_lock:
+        rows = [
+            ProfileRow(
+                routine=name,
+                calls=stats.calls,
+                total_time=stats.total_time,
+                prep_time=stats.total_time - stats.fortran_time,
+                fortran_time=stats.fortran_time,
+                min_time=stats.min_time,
+                max_time=stats.max_time,
+                nbytes=stats.nbytes,
+            )
+            for name, stats in _profile_stats.items()
+        ]
+    return sorted(rows, key=lambda row: row.total_time, reverse=True)
+
+
+def format_profile(rows=None):
+    """Return the profile as a text table, with times in milliseconds."""
+    if rows is None:
+        rows = get_profile()
+    lines = [
+        f"{'routine':<40} {'calls':>8} {'total':>10} {'prep':>10} {'fortran':>10} "
+        f"{'min':>10} {'max':>10} {'MB':>10}"
+    ]
+    for row in rows:
+        lines.append(
+            f"{row.routine:<40} {row.calls:>8d} {row.total_time * 1e3:>10.3f} "
+            f"{row.prep_time * 1e3:>10.3f} {row.fortran_time * 1e3:>10.3f} "
+            f"{row.min_time * 1e3:>10.3f} {row.max_time * 1e3:>10.3f} {row.nbytes / 1e6:>10.3f}"
+        )
+    return '\n'.join(lines)
+
+
+def get_chrome_trace():
+    """Return the calls recorded with enable_profiling(events=True) in Chrome trace
+    format, as viewed in chrome://tracing or Perfetto."""
+    with _profile_lock:
+        if _profile_events is None:
+            raise CCPPError("profiling events are not recorded, call enable_profiling(events=True)")
+        events = list(_profile_events)
+    pid = os.getpid()
+    trace_events = []
+    for name, tid, start, end, fortran_span, nbytes in events:
+        trace_events.append({
+            'name': name, 'cat': 'routine', 'ph': 'X', 'pid': pid, 'tid': tid,
+            'ts': start * 1e6, 'dur': (end - start) * 1e6, 'args': {'nbytes': nbytes},
+        })
+        if fortran_span is not None:
+            trace_events.append({
+                'name': f"{name}_cap", 'cat': 'fortran', 'ph': 'X', 'pid': pid, 'tid': tid,
+                'ts': fortran_span[0] * 1e6, 'dur': (fortran_span[1] - fortran_span[0]) * 1e6,
+            })
+    return {'traceEvents': trace_events, 'displayTimeUnit': 'ms'}
+
+
+def write_chrome_trace(filename):
+    with open(filename, 'w') as f:
+        json.dump(get_chrome_trace(), f)
+
+
+def get_library():
+    """Return the CCPP shared library, loading it if needed."""
+    global _libccpp
+    if _libccpp is None:
+        with _load_lock:
+            if _libccpp is None:
+                _libccpp = ctypes.cdll.LoadLibrary(LIBRARY_FILENAME)
+    return _libccpp
+
+
+def get_metadata():
+    """Return the metadata of the CCPP physics, loading it if needed."""
+    global _ccpp_metadata
+    if _ccpp_metadata is None:
+        with _load_lock:
+            if _ccpp_metadata is None:
+                _ccpp_metadata = meta.load_meta_dir(
+                    META_DIR, cache_filename=METADATA_CACHE_FILENAME
+                )
+    return _ccpp_metadata
+
+
+def get_routine_specs():
+    """Return a dict of the RoutineSpec of every routine in the metadata, by name."""
+    global _routine_specs
+    if _routine_specs is None:
+        with _load_lock:
+            if _routine_specs is None:
+                _routine_specs = {
+                    routine.name: routine
+                    for routine in meta.iterate_routines(get_metadata().schemes)
+                }
+    return _routine_specs
+
+
+def get_derived_type_specs():
+    """Return a dict of the DerivedDataTypeSpec of every derived type in the metadata, by name."""
+    global _derived_type_specs
+    if _derived_type_specs is None:
+        with _load_lock:
+            if _derived_type_specs is None:
+                _derived_type_specs = {ddt.name: ddt for ddt in get_metadata().types}
+    return _derived_type_specs
 
 
 def get_fortran_routine(name):
-    getattr(libccpp, f"{name.lower()}_cap")
+    return getattr(get_library(), f"{name.lower()}_cap")
+
+
+def get_routine_name(routine):
+    """Return the name of a routine given by name or as a wrapped python routine."""
+    return routine if isinstance(routine, str) else routine.__name__
 
 
 def get_python_routine(routine):
-    f_routine = get_fortran_routine(routine.name)
-    @forge.sign(
-        *[forge.pos(arg.name) for arg in routine.args[:-2]]  # skip errmsg, errflg args as we treat those internally
-    )
-    def python_routine(**kwargs):
-        fortran_args = []
-        logging.debug(f"calling routine {routine.name}")
-        for signature in routine.args:
-            if signature.name not in ('errmsg', 'errflg'):
-                arg = kwargs[signature.name]
-                if isinstance(arg, np.ndarray):
-                    check_dimensions(arg, signature, kwargs)
-                    check_type(arg, signature)
-                    fortran_args.append(numpy_pointer(arg))
-                else:
-                    raise NotImplementedError()
-        f_routine(*fortran_args, ERRMSG, numpy_pointer(ERRFLG))
-        if ERRFLG != 0:
-            raise CCPPError(f"{routine.name}: {ERRMSG}")
-        logging.debug(f"completed routine {routine.name}")
+    plan = get_call_plan(routine, get_fortran_routine(routine.name))
+
+    def python_routine(*args, validate=True, cast=False):
+        if _profiling:
+            return call_profiled(
+                plan, get_nbytes(args), call_validated, plan, args, validate, cast
+            )
+        return call_validated(plan, args, validate, cast)
     python_routine.__name__ = routine.name
+    # signature is only used for introspection, so that calls skip forge's argument mapping
+    python_routine.__signature__ = forge.FSignature(
+        [forge.pos(arg.name) for arg in get_call_args(routine)] +
+        [forge.kwo('validate', default=True), forge.kwo('cast', default=False)]
+    ).native
+    python_routine.plan = plan
+
+    def bind(*args, validate=True, check=True, cast=False, **kwargs):
+        return BoundRoutine(plan, get_ordered_args(plan, args, kwargs), validate, check, cast)
+    bind.__doc__ = f"Return a BoundRoutine calling {routine.name} on the given arguments."
+    python_routine.bind = bind
+
+    def chunked(*args, n_chunks=None, executor=None, validate=True, cast=False):
+        if validate:
+            validate_args(plan, args, cast)
+        call_chunked(plan, args, n_chunks, executor)
+    chunked.__doc__ = (
+        f"Call {routine.name} with its horizontal dimension split into n_chunks "
+        "chunks run concurrently on executor, by default a shared thread pool."
+    )
+    python_routine.chunked = chunked
+
+    def batched(*args, validate=True, cast=False):
+        if _profiling:
+            call_profiled(plan, get_nbytes(args), call_batched, plan, args, validate, cast)
+        else:
+            call_batched(plan, args, validate, cast)
+    batched.__doc__ = (
+        f"Call {routine.name} once on arrays with a leading ensemble axis, "
+        "with the ensemble members laid out one after another along the horizontal dimension."
+    )
+    python_routine.batched = batched
+
+    def masked(*args, mask, validate=True, cast=False):
+        if _profiling:
+            return call_profiled(
+                plan, get_nbytes(args), call_masked, plan, args, mask, validate, cast
+            )
+        return call_masked(plan, args, mask, validate, cast)
+    masked.__doc__ = (
+        f"Call {routine.name} on only the columns where mask, the name of a horizontal "
+        "mask argument or an array, is nonzero."
+    )
+    python_routine.masked = masked
     return python_routine
 
 
-for scheme in CCPP_METADATA.schemes:
-    locals().update(get_python_routines(scheme))
+def __getattr__(name):
+    # routines are wrapped on first access and stored as module attributes,
+    # so later accesses do not reach this function
+    if name.startswith('__'):
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    elif name == 'libccpp':
+        return get_library()
+    elif name == 'CCPP_METADATA':
+        return get_metadata()
+    routine_specs = get_routine_specs()
+    if name not in routine_specs:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    with _load_lock:
+        if name not in globals():
+            globals()[name] = get_python_routine(routine_specs[name])
+    return globals()[name]
+
+
+def __dir__():
+    return sorted(set(globals()) | {'libccpp', 'CCPP_METADATA'} | set(get_routine_specs()))
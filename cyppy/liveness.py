@@ -0,0 +1,207 @@
+import heapq
+from collections import namedtuple
+import numpy as np
+from . import lib
+from .lib import CCPPError
+from .suite import get_suite_schemes
+
+
+# first and last are indices of the calls accessing a value, in the order of a suite step
+Lifetime = namedtuple("Lifetime", ["standard_name", "first", "last", "group", "first_intent"])
+MemoryReport = namedtuple(
+    "MemoryReport",
+    ["unshared_nbytes", "shared_nbytes", "peak_live_nbytes", "n_interstitials", "n_buffers"]
+)
+
+
+def iterate_step_calls(suite_spec, schemes):
+    """Yield (group name, run routine) for each call made by one step of a suite,
+    running every group in order."""
+    for group in suite_spec.groups:
+        for subcycle in group.subcycles:
+            for _ in range(subcycle.loop):
+                for scheme_name in subcycle.schemes:
+                    yield group.name, schemes[scheme_name].run
+
+
+def is_array_value(arg):
+    """Return whether an argument is an array of intrinsic type, which may be held
+    in a shared buffer."""
+    return len(arg.dimensions) > 0 and arg.type in lib.DTYPE_CHARS
+
+
+def get_lifetimes(suite_spec, schemes):
+    """Return the Lifetime of every array argument of the run routines of a suite,
+    by standard name, given a dict of SchemeSpec by name."""
+    lifetimes = {}
+    for i, (group_name, routine) in enumerate(iterate_step_calls(suite_spec, schemes)):
+        for arg in lib.get_call_args(routine):
+            if not is_array_value(arg):
+                continue
+            lifetime = lifetimes.get(arg.standard_name)
+            if lifetime is None:
+                lifetimes[arg.standard_name] = Lifetime(
+                    standard_name=arg.standard_name, first=i, last=i,
+                    group=group_name, first_intent=arg.intent,
+                )
+            else:
+                # a value used by more than one group may live across groups
+                group = lifetime.group if lifetime.group == group_name else None
+                lifetimes[arg.standard_name] = lifetime._replace(last=i, group=group)
+    return lifetimes
+
+
+def get_persistent_names(schemes):
+    """Return the standard names of the arguments of the init and finalize routines,
+    whose values are used outside of suite steps."""
+    return set(
+        arg.standard_name
+        for scheme in schemes.values()
+        for routine in (scheme.init, scheme.finalize)
+        for arg in lib.get_call_args(routine)
+    )
+
+
+def is_interstitial(lifetime):
+    """Return whether a value is only used within one step of one suite group, so its
+    array may hold other values outside of its lifetime.
+
+    Its first use in the step must be intent(out), as other uses need the value
+    left by the previous step.
+    """
+    return lifetime.first_intent == 'out' and lifetime.group is not None
+
+
+def get_layout_key(arg):
+    """Return a key which is equal for arguments whose arrays have the same shape
+    and dtype, for any dimension lengths."""
+    return (
+        tuple(lib.split_dimension(dim_name) for dim_name in arg.dimensions),
+        lib.get_dtype(arg.type, arg.kind),
+    )
+
+
+def get_layout_keys(schemes):
+    layout_keys = {}
+    for scheme in schemes.values():
+        for arg in lib.get_call_args(scheme.run):
+            if is_array_value(arg):
+                layout_keys[arg.standard_name] = get_layout_key(arg)
+    return layout_keys
+
+
+def assign_buffers(lifetimes):
+    """Return a buffer index for each of a list of Lifetime, such that values
+    with overlapping lifetimes are in different buffers, using the fewest buffers."""
+    assignment = {}
+    free = []  # (last call using the buffer, buffer index)
+    n_buffers = 0
+    for lifetime in sorted(lifetimes, key=lambda lifetime: (lifetime.first, lifetime.standard_name)):
+        if len(free) > 0 and free[0][0] < lifetime.first:
+            _, buffer_index = heapq.heappop(free)
+        else:
+            buffer_index = n_buffers
+            n_buffers += 1
+        assignment[lifetime.standard_name] = buffer_index
+        heapq.heappush(free, (lifetime.last, buffer_index))
+    return assignment
+
+
+def get_interstitial_names(suite_spec, ccpp_metadata=None):
+    """Return the standard names of the values of a suite which may share buffers,
+    in order of first use, as candidates for get_buffer_names.
+
+    These are the interstitial values not used by init or finalize routines.
+    """
+    if ccpp_metadata is None:
+        ccpp_metadata = lib.CCPP_METADATA
+    schemes = get_suite_schemes(suite_spec, ccpp_metadata)
+    persistent_names = get_persistent_names(schemes)
+    return [
+        lifetime.standard_name
+        for lifetime in sorted(
+            get_lifetimes(suite_spec, schemes).values(), key=lambda lifetime: lifetime.first
+        )
+        if is_interstitial(lifetime) and lifetime.standard_name not in persistent_names
+    ]
+
+
+def get_buffer_names(suite_spec, shared_names, ccpp_metadata=None):
+    """Return a dict of the name of the shared buffer holding each of the given
+    interstitial values of a suite, by standard name, for use with State.
+
+    Sharing is opt-in: the scheme first using each value in shared_names must
+    write all of it, as a shared buffer holds other values before that. Values
+    written on only some columns, for example by masked calls or by schemes
+    which only set some columns of an intent(out) argument, must not be shared.
+    Candidates are given by get_interstitial_names.
+
+    Values with the same shape and dtype share a buffer if their lifetimes within
+    a step do not overlap. Buffers are only valid when the groups of the suite are
+    run one at a time.
+    """
+    if ccpp_metadata is None:
+        ccpp_metadata = lib.CCPP_METADATA
+    schemes = get_suite_schemes(suite_spec, ccpp_metadata)
+    lifetimes = get_lifetimes(suite_spec, schemes)
+    layout_keys = get_layout_keys(schemes)
+    invalid = set(shared_names) - set(get_interstitial_names(suite_spec, ccpp_metadata))
+    if len(invalid) > 0:
+        raise CCPPError(
+            f"values {sorted(invalid)} cannot share buffers, as they are not interstitial "
+            "values of the suite"
+        )
+    by_layout = {}
+    for standard_name in shared_names:
+        by_layout.setdefault(layout_keys[standard_name], []).append(lifetimes[standard_name])
+    buffer_names = {}
+    for layout_index, layout_lifetimes in enumerate(by_layout.values()):
+        for standard_name, buffer_index in assign_buffers(layout_lifetimes).items():
+            buffer_names[standard_name] = f"buffer_{layout_index}_{buffer_index}"
+    return buffer_names
+
+
+def get_peak_live_nbytes(lifetimes, nbytes):
+    """Return the most bytes of the given values which are live during any one call."""
+    changes = []
+    for lifetime in lifetimes:
+        changes.append((lifetime.first, nbytes[lifetime.standard_name]))
+        changes.append((lifetime.last + 1, -nbytes[lifetime.standard_name]))
+    peak = live = 0
+    for _, change in sorted(changes):
+        live += change
+        peak = max(peak, live)
+    return peak
+
+
+def get_memory_report(suite_spec, state, ccpp_metadata=None):
+    """Return a MemoryReport comparing the memory of a State whose interstitial
+    values share buffers to the memory it would use without sharing."""
+    if ccpp_metadata is None:
+        ccpp_metadata = lib.CCPP_METADATA
+    schemes = get_suite_schemes(suite_spec, ccpp_metadata)
+    lifetimes = get_lifetimes(suite_spec, schemes)
+    nbytes = {
+        standard_name: value.nbytes for standard_name, value in state.items()
+        if isinstance(value, np.ndarray)
+    }
+    interstitials = [
+        lifetimes[standard_name] for standard_name in state.buffer_names
+        if standard_name in lifetimes
+    ]
+    return MemoryReport(
+        unshared_nbytes=sum(nbytes.values()),
+        shared_nbytes=state.nbytes,
+        peak_live_nbytes=get_peak_live_nbytes(interstitials, nbytes),
+        n_interstitials=len(state.buffer_names),
+        n_buffers=len(set(state.buffer_names.values())),
+    )
+
+
+def format_memory_report(report):
+    return (
+        f"{report.n_interstitials} interstitial values in {report.n_buffers} buffers, "
+        f"state uses {report.shared_nbytes / 2**20:.1f} MiB "
+        f"(unshared {report.unshared_nbytes / 2**20:.1f} MiB, "
+        f"interstitial peak {report.peak_live_nbytes / 2**20:.1f} MiB)"
+    )
@@ -2,36 +2,37 @@ import configparser
 import logging
 import collections
 from collections import namedtuple
-from typing import Sequence, Dict, List
+from typing import Sequence, Dict, List, Tuple
 import io
 import os
+import re
+import pickle
 
 logger = logging.getLogger('ccpp')
 
 ENTRY_HEADER = '[ccpp-arg-table]'
+ENTRY_SECTION = 'ccpp-arg-table'
+COMMENT_PREFIXES = ('#', ';')
+# as for ConfigParser, an option name ends at the first '=' or ':'
+OPTION_PATTERN = re.compile(r"(?P<option>.*?)\s*[=:]\s*(?P<value>.*)$")
+CACHE_VERSION = 2  # increment when the structure or filtering of the metadata changes
 INTENT_VALUES = ('in', 'out', 'inout')
 BOOL_VALUES = ('T', 'F')
 
 # These derived types will not be loaded, and shemes using them will also be ignored.
-# This is because we haven't implemented wrapping/packing/unpacking these types yet.
+# Derived types are passed to the caps as handles (see cyppy.lib.DerivedTypeHandle),
+# whose array attributes are assumed to be pointers.
 IGNORED_TYPES = [
     # these types contain non-pointer array attributes
     'GFS_control_type',
     'GFS_data_type',
     'GFS_init_type',
-    # radtend and diag contain types like topfsw_type which are used as array types
-    'GFS_radtend_type',
-    'GFS_diag_type',
-    'topfsw_type',
-    'topflw_type',
-    'sfcfsw_type',
-    'sfcflw_type',
-    'cmpfsw_type',
-    # interstitial contains cmpfsw_type
-    'GFS_interstitial_type',
     # need to implement special wrapping for character type
     'character',
 ]
+INTRINSIC_TYPES = ('integer', 'real', 'logical', 'complex', 'character')
+# attributes of these types can be accessed through derived type handles
+HANDLE_ATTR_TYPES = ('integer', 'real', 'logical')
 
 _RoutineSpec = namedtuple("Routine", ["name", "args", "internal_args", "types"])
 
@@ -107,6 +108,21 @@ def ignore_routine(routine):
     return False
 
 
+def is_handle_attr(attr):
+    """Return whether an attribute can be accessed through a handle to its derived type.
+
+    These are the numeric attributes, and the scalar attributes of derived types.
+    Subarrays (such as an element of an array attribute) are only used when
+    packing derived types.
+    """
+    if '(' in attr.name:
+        return False
+    elif attr.type in HANDLE_ATTR_TYPES:
+        return True
+    else:
+        return attr.type not in INTRINSIC_TYPES and len(attr.dimensions) == 0
+
+
 def get_scheme_module(scheme):
     members = (scheme.init, scheme.run, scheme.finalize)
     return ModuleSpec(name=scheme.name, members=members)
@@ -122,7 +138,8 @@ def get_module_name(filename):
 
 
 def get_meta_files(dirname):
-    return [fname for fname in os.listdir(dirname) if fname.endswith('.meta')]
+    # sorted so that routine order, and so routine ids in the cap, is reproducible
+    return sorted(fname for fname in os.listdir(dirname) if fname.endswith('.meta'))
 
 
 def get_scheme_parser():
@@ -220,17 +237,94 @@ def get_dimensions(dimension_string):
         return tuple(dim.strip() for dim in dimension_string.strip('()').split(','))
 
 
-def load_meta(filenames):
+def read_entries(lines, filename='<string>'):
+    """Yield each entry of CCPP metadata as a dict from section name to a dict of
+    options, as ConfigParser would read the text of the entry.
+
+    Indented lines are continuations of the previous option, as for ConfigParser.
+    """
+    entry = None
+    section = None
+    option = None
+    option_indent = 0
+    for line_number, line in enumerate(lines, start=1):
+        stripped = line.strip()
+        if stripped == '' or stripped[0] in COMMENT_PREFIXES:
+            continue
+        elif stripped == ENTRY_HEADER:
+            if entry is not None:
+                yield entry
+            section = {}
+            entry = {ENTRY_SECTION: section}
+            option = None
+            continue
+        elif entry is None:
+            continue  # text before the first entry is ignored
+        indent = len(line) - len(line.lstrip())
+        if option is not None and indent > option_indent:
+            section[option] = f"{section[option]}\n{stripped}"
+        elif stripped[0] == '[':
+            end = stripped.rfind(']')
+            if end < 2:
+                raise ValueError(f"{filename}:{line_number}: invalid section header {stripped!r}")
+            name = stripped[1:end]
+            if name in entry:
+                raise ValueError(f"{filename}:{line_number}: duplicate section {name!r}")
+            section = entry[name] = {}
+            option = None
+        else:
+            match = OPTION_PATTERN.match(stripped)
+            if match is None or match.group('option') == '':
+                raise ValueError(f"{filename}:{line_number}: could not parse line {stripped!r}")
+            option = match.group('option').lower()
+            if option in section:
+                raise ValueError(f"{filename}:{line_number}: duplicate option {option!r}")
+            section[option] = match.group('value')
+            option_indent = indent
+    if entry is not None:
+        yield entry
+
+
+def read_meta_file(filename):
+    """Return the entries of a .meta file, as returned by read_entries."""
+    with open(filename, 'r') as f:
+        return list(read_entries(f, filename))
+
+
+def read_meta_file_configparser(filename):
+    """Return the entries of a .meta file using ConfigParser.
+
+    Slower than read_meta_file, kept as a reference for tests and benchmarks.
+    """
+    with open(filename, 'r') as f:
+        data = f.read()
+    entries = []
+    for entry_text in [ENTRY_HEADER + d for d in data.split(ENTRY_HEADER)[1:]]:
+        config = get_scheme_parser()
+        config.read_file(io.StringIO(entry_text))
+        entries.append({
+            name: dict(section) for name, section in config.items() if name != 'DEFAULT'
+        })
+    return entries
+
+
+def load_meta(filenames, executor=None, read_file=read_meta_file):
+    """Load the metadata in the given .meta files, or in one file if a single filename is given.
+
+    Files are read using executor.map if an executor is given, for example to read
+    them in parallel with a concurrent.futures.ProcessPoolExecutor.
+    """
+    if isinstance(filenames, str):
+        filenames = [filenames]
+    if executor is None:
+        file_entries = map(read_file, filenames)
+    else:
+        file_entries = executor.map(read_file, filenames)
     scheme_dict = {}
     module_list = []
     type_list = []
-    for filename in filenames:
-        with open(filename, 'r') as f:
-            data = f.read()
-        file_module_name = get_module_name(filename)
-        for entry_text in [ENTRY_HEADER + d for d in data.split(ENTRY_HEADER)[1:]]:
-            config = get_scheme_parser()
-            config.read_file(io.StringIO(entry_text))
+    for entries in file_entries:
+        for config in entries:
             if config['ccpp-arg-table']['type'] == 'scheme':
                 routine = load_routine(config)
                 scheme_name = get_scheme_name(routine.name)
@@ -250,7 +344,12 @@ def load_meta(filenames):
             )
         )
         module_list.append(get_scheme_module(scheme_list[-1]))
-    scheme_list = [expand_scheme_derived_args(scheme, type_list) for scheme in scheme_list]
+    ddt_lookup = {ddt.name: ddt for ddt in type_list}
+    expansion_cache = {}
+    scheme_list = [
+        expand_scheme_derived_args(scheme, ddt_lookup, expansion_cache)
+        for scheme in scheme_list
+    ]
     return CCPPMetadata(
         modules=consolidate_modules(module_list),
         schemes=remove_ignored_schemes(scheme_list),
@@ -310,7 +409,7 @@ def load_module(config):
 
 
 def load_routine(config):
-    logger.debug(f"Loading routine {config['ccpp-arg-table']['name']}")
+    logger.debug("Loading routine %s", config['ccpp-arg-table']['name'])
     arg_list = []
     for arg_name, data in config.items():
         if arg_name not in ('ccpp-arg-table', 'DEFAULT'):  # first item is header info
@@ -323,19 +422,26 @@ def load_routine(config):
     return routine
 
 
-def expand_scheme_derived_args(scheme: SchemeSpec, derived_types: Sequence[DerivedDataTypeSpec]) -> SchemeSpec:
+def expand_scheme_derived_args(
+        scheme: SchemeSpec,
+        ddt_lookup: Dict[str, DerivedDataTypeSpec],
+        expansion_cache: Dict[str, Tuple] = None) -> SchemeSpec:
+    if expansion_cache is None:
+        expansion_cache = {}
     return SchemeSpec(
         name=scheme.name,
-        init=expand_routine_derived_args(scheme.init, derived_types),
-        run=expand_routine_derived_args(scheme.run, derived_types),
-        finalize=expand_routine_derived_args(scheme.finalize, derived_types)
+        init=expand_routine_derived_args(scheme.init, ddt_lookup, expansion_cache),
+        run=expand_routine_derived_args(scheme.run, ddt_lookup, expansion_cache),
+        finalize=expand_routine_derived_args(scheme.finalize, ddt_lookup, expansion_cache)
     )
 
 
-def expand_routine_derived_args(routine: RoutineSpec, derived_types: Sequence[DerivedDataTypeSpec]) -> RoutineSpec:
-    ddt_lookup = {ddt.name: ddt for ddt in derived_types}
+def expand_routine_derived_args(
+        routine: RoutineSpec,
+        ddt_lookup: Dict[str, DerivedDataTypeSpec],
+        expansion_cache: Dict[str, Tuple] = None) -> RoutineSpec:
     ddt_used = []
-    expanded_args = expand_derived_args(routine.args, ddt_lookup, ddt_used)
+    expanded_args = expand_derived_args(routine.args, ddt_lookup, ddt_used, expansion_cache)
     return RoutineSpec(
         name=routine.name,
         args=tuple(expanded_args),
@@ -347,28 +453,120 @@ def expand_routine_derived_args(routine: RoutineSpec, derived_types: Sequence[De
 def expand_derived_args(
         args: Sequence[ArgSpec],
         ddt_lookup: Dict[str, DerivedDataTypeSpec],
-        ddt_used: List[DerivedDataTypeSpec]) -> List[ArgSpec]:
-    if len(args) == 0:
-        return []
-    elif args[0].type in ddt_lookup:
-        ddt_arg = args[0]
-        ddt = ddt_lookup[ddt_arg.type]
-        ddt_used.append(ddt)
-        expanded_args = []
-        for attr in ddt.attrs:
-            expanded_args.append(
-                get_argument_from_attribute(attr, ddt_arg.intent, ddt_arg.optional)
+        ddt_used: List[DerivedDataTypeSpec],
+        expansion_cache: Dict[str, Tuple] = None) -> List[ArgSpec]:
+    """Replace each argument of a derived type by arguments for its attributes,
+    appending the derived types expanded to ddt_used.
+
+    expansion_cache can be shared between calls to expand each type only once.
+    """
+    if expansion_cache is None:
+        expansion_cache = {}
+    expanded_args = []
+    for arg in args:
+        if arg.type in ddt_lookup:
+            attrs, ddts = get_ddt_expansion(arg.type, ddt_lookup, expansion_cache)
+            ddt_used.extend(ddts)
+            expanded_args.extend(
+                get_argument_from_attribute(attr, arg.intent, arg.optional) for attr in attrs
             )
-        return (
-            expand_derived_args(expanded_args, ddt_lookup, ddt_used) +
-            expand_derived_args(args[1:], ddt_lookup, ddt_used)
-        )
-    else:
-        return [args[0]] + expand_derived_args(args[1:], ddt_lookup, ddt_used)
+        else:
+            expanded_args.append(arg)
+    return expanded_args
+
 
+def get_ddt_expansion(
+        type_name: str,
+        ddt_lookup: Dict[str, DerivedDataTypeSpec],
+        expansion_cache: Dict[str, Tuple]) -> Tuple:
+    """Return (attrs, ddts) where attrs are the attributes of a derived type with
+    any derived type attributes recursively replaced by their attributes, and ddts
+    are the derived types expanded, in order. Results are stored in expansion_cache
+    for the type and any types it contains."""
+    if type_name in expansion_cache:
+        return expansion_cache[type_name]
+    attrs = []
+    ddts = [ddt_lookup[type_name]]
+    # each entry is (attribute iterator, type name, start of its attrs, start of its ddts)
+    stack = [(iter(ddt_lookup[type_name].attrs), type_name, 0, 0)]
+    while len(stack) > 0:
+        attr_iterator, current_type, attrs_start, ddts_start = stack[-1]
+        attr = next(attr_iterator, None)
+        if attr is None:
+            stack.pop()
+            expansion_cache[current_type] = (tuple(attrs[attrs_start:]), tuple(ddts[ddts_start:]))
+        elif attr.type not in ddt_lookup:
+            attrs.append(attr)
+        elif attr.type in expansion_cache:
+            cached_attrs, cached_ddts = expansion_cache[attr.type]
+            attrs.extend(cached_attrs)
+            ddts.extend(cached_ddts)
+        elif any(entry[1] == attr.type for entry in stack):
+            raise ValueError(f"derived type {attr.type} contains itself")
+        else:
+            stack.append((iter(ddt_lookup[attr.type].attrs), attr.type, len(attrs), len(ddts)))
+            ddts.append(ddt_lookup[attr.type])
+    return expansion_cache[type_name]
 
-def load_meta_dir(dirname):
-    return load_meta(os.path.join(dirname, fname) for fname in get_meta_files(dirname))
+
+def load_meta_dir(dirname, cache_filename=None, executor=None):
+    """Load the metadata of all .meta files in a directory.
+
+    If cache_filename is given, the metadata is read from that file if it was
+    written from the same .meta files, and otherwise loaded and written there.
+    """
+    filenames = [os.path.join(dirname, fname) for fname in get_meta_files(dirname)]
+    if cache_filename is None:
+        return load_meta(filenames, executor)
+    cache_key = get_cache_key(filenames)
+    metadata = read_cache(cache_filename, cache_key)
+    if metadata is None:
+        metadata = load_meta(filenames, executor)
+        write_cache(cache_filename, cache_key, metadata)
+    return metadata
+
+
+def get_cache_key(filenames):
+    """Return a key which changes when any of the given files, or this module, changes."""
+    key = [CACHE_VERSION]
+    for filename in list(filenames) + [__file__]:
+        stat = os.stat(filename)
+        key.append((os.path.basename(filename), stat.st_mtime_ns, stat.st_size))
+    return key
+
+
+def read_cache(cache_filename, cache_key):
+    """Return the metadata in a cache file, or None if it is missing or out of date."""
+    try:
+        with open(cache_filename, 'rb') as f:
+            cached_key, metadata = pickle.load(f)
+    except FileNotFoundError:
+        return None
+    except Exception as err:
+        logger.warning("could not read metadata cache %s: %s", cache_filename, err)
+        return None
+    if cached_key != cache_key:
+        logger.debug("metadata cache %s is out of date", cache_filename)
+        return None
+    return metadata
+
+
+def write_cache(cache_filename, cache_key, metadata):
+    # write to a temporary file first so readers never see a partial cache
+    tmp_filename = f"{cache_filename}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_filename, 'wb') as f:
+            pickle.dump((cache_key, metadata), f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_filename, cache_filename)
+    except Exception as err:
+        logger.warning("could not write metadata cache %s: %s", cache_filename, err)
+    finally:
+        # only left behind if writing or replacing failed
+        if os.path.exists(tmp_filename):
+            try:
+                os.remove(tmp_filename)
+            except OSError:
+                pass
 
 
 def combine_metadata(ccpp_metadata_list):
@@ -0,0 +1,256 @@
+import multiprocessing
+from collections import namedtuple
+import numpy as np
+from . import lib
+from .lib import CCPPError
+
+
+# identifies a shared array to worker processes, which attach to it by name;
+# offset and strides are in bytes within the shared memory, so views of shared arrays
+# can be passed. If copy is True the worker uses a private copy of the array
+SharedArrayRef = namedtuple(
+    "SharedArrayRef", ["name", "shape", "dtype", "offset", "strides", "copy"]
+)
+
+
+def get_shared_memory():
+    # multiprocessing.shared_memory is only available from Python 3.8
+    from multiprocessing import shared_memory
+    return shared_memory
+
+
+def attach_shared_array(ref, attached):
+    """Return the array for a SharedArrayRef, attaching to its shared memory if
+    it is not already in the dict attached of SharedMemory by name."""
+    if ref.name not in attached:
+        attached[ref.name] = get_shared_memory().SharedMemory(name=ref.name)
+    array = np.ndarray(
+        ref.shape, dtype=ref.dtype, buffer=attached[ref.name].buf,
+        offset=ref.offset, strides=ref.strides,
+    )
+    if ref.copy:
+        array = array.copy(order='F')
+    return array
+
+
+def run_worker(connection):
+    """Call routines as requested by a ProcessPool until sent None.
+
+    Each request is (routine_name, args, bounds) where shared arrays in args are given
+    as SharedArrayRef, and bounds is a (start, stop) chunk of columns or None to call
+    the routine on all columns. Replies with (True, (return_value, outputs)) where
+    outputs are the values after the call of the 0-dimensional arrays sent by value,
+    by argument index, or with (False, exception).
+    """
+    attached = {}
+    try:
+        while True:
+            request = connection.recv()
+            if request is None:
+                break
+            routine_name, args, bounds = request
+            try:
+                args = [
+                    attach_shared_array(arg, attached) if isinstance(arg, SharedArrayRef) else arg
+                    for arg in args
+                ]
+                plan = getattr(lib, routine_name).plan
+                if bounds is None:
+                    return_value = lib.call_routine(plan, args)
+                else:
+                    lib.call_chunk(plan, args, *bounds)
+                    return_value = None
+                outputs = {
+                    i: arg for i, (arg, slot) in enumerate(zip(args, plan.slots))
+                    if isinstance(arg, np.ndarray) and arg.ndim == 0 and slot.intent != 'in'
+                    and not isinstance(request[1][i], SharedArrayRef)
+                }
+                reply = (True, (return_value, outputs))
+                # drop references to shared buffers so they can be closed
+                del args
+            except Exception as err:
+                reply = (False, err)
+            connection.send(reply)
+    finally:
+        for shm in attached.values():
+            close_shared_memory(shm)
+
+
+def close_shared_memory(shm):
+    try:
+        shm.close()
+    except BufferError:
+        pass  # arrays still use the buffer, it is freed once they are garbage collected
+
+
+def get_byte_bounds(array):
+    """Return the (low, high) addresses of the memory used by an array."""
+    low = high = array.ctypes.data
+    for length, stride in zip(array.shape, array.strides):
+        if stride < 0:
+            low += (length - 1) * stride
+        else:
+            high += (length - 1) * stride
+    return low, high + array.itemsize
+
+
+class ProcessPool:
+    """Calls routines on worker processes which each load their own libccpp.so.
+
+    Use this for schemes which keep module state and so cannot be called
+    concurrently from threads. Arrays are passed through shared memory and
+    must be created with zeros() or share(), or be views of such arrays.
+    Scalars, including 0-dimensional arrays which were not created by the pool,
+    are sent by value, and the values of intent(out) and intent(inout) scalars
+    are copied back.
+
+    Worker i always runs chunk i of a chunked call, so module state set up by a
+    routine called on every worker with call() stays with the same columns.
+
+    Requires Python 3.8 or later.
+    """
+
+    def __init__(self, n_workers=None, context='spawn'):
+        """
+        Args:
+            n_workers: number of worker processes, by default the number of CPUs
+            context: multiprocessing start method used to create the workers
+        """
+        get_shared_memory()
+        if n_workers is None:
+            n_workers = multiprocessing.cpu_count()
+        mp_context = multiprocessing.get_context(context)
+        self._shared = {}  # (array, SharedMemory) by name of the shared memory
+        self._connections = []
+        self._processes = []
+        for _ in range(n_workers):
+            parent_connection, child_connection = mp_context.Pipe()
+            process = mp_context.Process(target=run_worker, args=(child_connection,), daemon=True)
+            process.start()
+            child_connection.close()
+            self._connections.append(parent_connection)
+            self._processes.append(process)
+
+    @property
+    def n_workers(self):
+        return len(self._processes)
+
+    def zeros(self, shape, dtype=np.float64):
+        """Return a Fortran-ordered array of zeros in shared memory."""
+        dtype = np.dtype(dtype)
+        shape = (shape,) if np.isscalar(shape) else tuple(shape)
+        nbytes = int(np.prod(shape)) * dtype.itemsize
+        shm = get_shared_memory().SharedMemory(create=True, size=max(nbytes, 1))
+        array = np.ndarray(shape, dtype=dtype, buffer=shm.buf, order='F')
+        array[...] = 0
+        self._shared[shm.name] = (array, shm)
+        return array
+
+    def share(self, array):
+        """Return a copy of an array in shared memory."""
+        shared = self.zeros(np.shape(array), np.asarray(array).dtype)
+        shared[...] = array
+        return shared
+
+    def get_ref(self, array, copy=False):
+        """Return the SharedArrayRef of an array created by the pool or a view of one,
+        or None if the array is not in shared memory created by the pool."""
+        low, high = get_byte_bounds(array)
+        for name, (shared, shm) in self._shared.items():
+            start = shared.ctypes.data
+            if start <= low and high <= start + shm.size:
+                return SharedArrayRef(
+                    name=name, shape=array.shape, dtype=array.dtype.str,
+                    offset=array.ctypes.data - start, strides=array.strides, copy=copy,
+                )
+        return None
+
+    def get_worker_args(self, plan, args, private=False):
+        """Return the arguments to send to a worker. If private is True, the worker uses
+        private copies of the shared arrays it may modify."""
+        worker_args = []
+        for arg, slot in zip(args, plan.slots):
+            ref = self.get_ref(arg, copy=private and slot.intent != 'in') \
+                if isinstance(arg, np.ndarray) else None
+            if ref is not None:
+                worker_args.append(ref)
+            elif isinstance(arg, np.ndarray) and arg.ndim == 0:
+                worker_args.append(arg.copy())
+            elif isinstance(arg, lib.DerivedTypeHandle):
+                raise CCPPError(
+                    f"value for {slot.name} is a derived type handle, which cannot be "
+                    "passed to worker processes"
+                )
+            elif isinstance(arg, np.ndarray):
+                raise CCPPError(
+                    f"value for {slot.name} must be an array created by ProcessPool.zeros "
+                    "or ProcessPool.share"
+                )
+            else:
+                worker_args.append(arg)
+        return worker_args
+
+    def _run(self, requests):
+        """Send one request to each of the first len(requests) workers and return their
+        replies, raising the first error once every worker has replied."""
+        for connection, request in zip(self._connections, requests):
+            connection.send(request)
+        replies = [connection.recv() for connection in self._connections[:len(requests)]]
+        for success, value in replies:
+            if not success:
+                raise value
+        return [value for _, value in replies]
+
+    def call(self, routine, *args, validate=True):
+        """Call a routine on all columns in every worker, for example to initialize
+        the module state of each worker. Returns a list of the return value from each worker.
+
+        Only the first worker writes to the shared arrays and scalars given, other
+        workers modify private copies which are discarded.
+        """
+        plan = getattr(lib, lib.get_routine_name(routine)).plan
+        if validate:
+            lib.validate_args(plan, args)
+        first_request = (plan.name, self.get_worker_args(plan, args), None)
+        other_request = (plan.name, self.get_worker_args(plan, args, private=True), None)
+        replies = self._run([first_request] + [other_request] * (self.n_workers - 1))
+        for i, value in replies[0][1].items():
+            args[i][...] = value
+        return [return_value for return_value, _ in replies]
+
+    def call_chunked(self, routine, *args, validate=True):
+        """Call a routine with its horizontal dimension split into one chunk per worker."""
+        plan = getattr(lib, lib.get_routine_name(routine)).plan
+        lib.check_chunkable(plan)
+        if validate:
+            lib.validate_args(plan, args)
+        worker_args = self.get_worker_args(plan, args)
+        n_columns = int(args[plan.extent_indices[0]])
+        self._run([
+            (plan.name, worker_args, bounds)
+            for bounds in lib.get_chunk_bounds(n_columns, self.n_workers)
+        ])
+
+    def close(self):
+        """Stop the workers and free the shared memory of every array created by the pool."""
+        for connection in self._connections:
+            try:
+                connection.send(None)
+            except (BrokenPipeError, OSError):
+                pass
+        for process in self._processes:
+            process.join()
+        for connection in self._connections:
+            connection.close()
+        self._connections = []
+        self._processes = []
+        for _, shm in self._shared.values():
+            shm.unlink()
+            close_shared_memory(shm)
+        self._shared = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
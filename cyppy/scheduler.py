@@ -0,0 +1,194 @@
+import os
+import time
+import itertools
+import threading
+import concurrent.futures
+from collections import namedtuple
+from . import lib
+
+
+ChunkStats = namedtuple(
+    "ChunkStats",
+    [
+        "routine", "calls", "chunk_size", "n_chunks", "column_time",
+        "mean_imbalance", "max_imbalance",
+    ]
+)
+
+
+class RoutineSchedule:
+    """The chunk size used for one routine, and its load balance over previous calls."""
+
+    def __init__(self):
+        self.chunk_size = None
+        self.column_time = None  # moving average of seconds per column
+        self.calls = 0
+        self.n_chunks = 0
+        self.total_imbalance = 0.
+        self.max_imbalance = 0.
+
+
+def get_max_chunk_size(n_columns, n_workers, min_chunks_per_worker):
+    return max(1, n_columns // (n_workers * min_chunks_per_worker))
+
+
+def get_imbalance(busy_times):
+    """Return how much longer the busiest worker ran than the mean worker,
+    as a fraction of the mean, which is 0 for a perfectly balanced call."""
+    mean = sum(busy_times) / len(busy_times)
+    if mean <= 0:
+        return 0.
+    return max(busy_times) / mean - 1.
+
+
+class ChunkScheduler:
+    """Calls routines with their horizontal dimension split into many small chunks,
+    which worker threads take in order as soon as they finish their previous chunk,
+    so that workers given cheap columns go on to take more chunks.
+
+    The chunk size of each routine adapts across calls from the measured time per
+    column: chunks are made as small as possible for load balance while each still
+    takes about target_chunk_time, so the cost of each call stays small. Load
+    imbalance per routine is reported by get_stats and format_stats.
+    """
+
+    def __init__(
+            self, n_workers=None, executor=None, target_chunk_time=1e-3,
+            min_chunks_per_worker=4, smoothing=0.5):
+        """
+        Args:
+            n_workers: number of threads taking chunks, by default the number of CPUs
+            executor: executor running the worker threads, by default a thread pool
+                owned by the scheduler
+            target_chunk_time: time in seconds each chunk should take, which must be
+                well above the overhead of calling a chunk (tens of microseconds)
+            min_chunks_per_worker: chunks are no larger than needed to give each worker
+                this many chunks
+            smoothing: weight of the previous time per column when averaging it
+                with the time measured by a call
+        """
+        if n_workers is None:
+            n_workers = os.cpu_count()
+        self.n_workers = n_workers
+        self.target_chunk_time = target_chunk_time
+        self.min_chunks_per_worker = min_chunks_per_worker
+        self.smoothing = smoothing
+        self._owns_executor = executor is None
+        if executor is None:
+            executor = concurrent.futures.ThreadPoolExecutor(max_workers=n_workers)
+        self._executor = executor
+        self._schedules = {}
+        self._lock = threading.Lock()
+
+    def get_chunk_size(self, name, n_columns):
+        """Return the chunk size to use for the next call of a routine."""
+        max_size = get_max_chunk_size(n_columns, self.n_workers, self.min_chunks_per_worker)
+        schedule = self._schedules.get(name)
+        if schedule is None or schedule.column_time is None or schedule.column_time <= 0:
+            return max_size
+        return int(min(max_size, max(1, self.target_chunk_time / schedule.column_time)))
+
+    def call(self, routine, *args, validate=True, cast=False):
+        """Call a routine on dynamically scheduled chunks of its horizontal dimension."""
+        plan = getattr(lib, lib.get_routine_name(routine)).plan
+        lib.check_chunkable(plan)
+        if validate:
+            lib.validate_args(plan, args, cast)
+        n_columns = int(args[plan.extent_indices[0]])
+        chunk_size = self.get_chunk_size(plan.name, n_columns)
+        n_chunks = -(-n_columns // chunk_size)
+        chunk_indices = itertools.count()  # next() is atomic, so workers share it
+        failed = threading.Event()
+
+        def work():
+            busy_time = 0.
+            for chunk_index in chunk_indices:
+                if chunk_index >= n_chunks or failed.is_set():
+                    break
+                start = chunk_index * chunk_size
+                stop = min(start + chunk_size, n_columns)
+                chunk_start = time.perf_counter()
+                try:
+                    lib.call_chunk(plan, args, start, stop)
+                except BaseException:
+                    failed.set()
+                    raise
+                busy_time += time.perf_counter() - chunk_start
+            return busy_time
+
+        futures = [
+            self._executor.submit(work) for _ in range(min(self.n_workers, n_chunks))
+        ]
+        # let every worker stop before raising the first error
+        concurrent.futures.wait(futures)
+        busy_times = [future.result() for future in futures]
+        busy_times += [0.] * (self.n_workers - len(busy_times))
+        self.record(plan.name, n_columns, chunk_size, n_chunks, busy_times)
+
+    def record(self, name, n_columns, chunk_size, n_chunks, busy_times):
+        column_time = sum(busy_times) / n_columns if n_columns > 0 else 0.
+        imbalance = get_imbalance(busy_times)
+        with self._lock:
+            schedule = self._schedules.setdefault(name, RoutineSchedule())
+            if schedule.column_time is None:
+                schedule.column_time = column_time
+            else:
+                schedule.column_time = (
+                    self.smoothing * schedule.column_time + (1 - self.smoothing) * column_time
+                )
+            schedule.chunk_size = chunk_size
+            schedule.n_chunks = n_chunks
+            schedule.calls += 1
+            schedule.total_imbalance += imbalance
+            schedule.max_imbalance = max(schedule.max_imbalance, imbalance)
+
+    def get_stats(self):
+        """Return a list of ChunkStats for each routine called, by descending mean imbalance.
+
+        The chunk size and number of chunks are those of the last call.
+        """
+        with self._lock:
+            rows = [
+                ChunkStats(
+                    routine=name,
+                    calls=schedule.calls,
+                    chunk_size=schedule.chunk_size,
+                    n_chunks=schedule.n_chunks,
+                    column_time=schedule.column_time,
+                    mean_imbalance=schedule.total_imbalance / schedule.calls,
+                    max_imbalance=schedule.max_imbalance,
+                )
+                for name, schedule in self._schedules.items()
+            ]
+        return sorted(rows, key=lambda row: row.mean_imbalance, reverse=True)
+
+    def format_stats(self, rows=None):
+        """Return a table of load balance by routine."""
+        if rows is None:
+            rows = self.get_stats()
+        lines = [
+            f"{'routine':<40} {'calls':>8} {'chunk':>8} {'chunks':>8} "
+            f"{'us/col':>10} {'imbal %':>8} {'max %':>8}"
+        ]
+        for row in rows:
+            lines.append(
+                f"{row.routine:<40} {row.calls:>8d} {row.chunk_size:>8d} {row.n_chunks:>8d} "
+                f"{row.column_time * 1e6:>10.3f} {row.mean_imbalance * 100:>8.1f} "
+                f"{row.max_imbalance * 100:>8.1f}"
+            )
+        return "\n".join(lines)
+
+    def reset(self):
+        """Forget the chunk sizes and load balance of every routine."""
+        with self._lock:
+            self._schedules = {}
+
+    def close(self):
+        if self._owns_executor:
+            self._executor.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -0,0 +1,195 @@
+import collections.abc
+import numpy as np
+from . import lib, meta
+from .lib import CCPPError
+
+
+def get_dimension_length(dim_name, dimensions):
+    """Return the length of a dimension given the lengths of dimensions by standard name,
+    or None if its length is not given."""
+    candidates, offset = lib.split_dimension(dim_name)
+    for candidate in candidates:
+        if candidate in dimensions:
+            return dimensions[candidate] + offset
+    return None
+
+
+def iterate_state_args(ccpp_metadata, scheme_names=None):
+    """Yield the caller-given arguments of every routine of the given schemes,
+    or of all schemes if scheme_names is None."""
+    for scheme in ccpp_metadata.schemes:
+        if scheme_names is None or scheme.name in scheme_names:
+            for routine in scheme.init, scheme.run, scheme.finalize:
+                yield from lib.get_call_args(routine)
+
+
+def get_handle_members(handles):
+    """Return (members, unreachable) where members is the handle giving access to each
+    intrinsic attribute of the given handles or of their derived type attributes, by
+    standard name, and unreachable are the standard names of attributes which
+    cannot be accessed through a handle."""
+    members = {}
+    unreachable = set()
+    stack = list(handles)
+    if len(stack) > 0:
+        ddt_lookup = lib.get_derived_type_specs()
+    while len(stack) > 0:
+        handle = stack.pop()
+        for attr in ddt_lookup[handle.type_name].attrs:
+            if attr.standard_name not in handle:
+                unreachable.add(attr.standard_name)
+            elif attr.type not in meta.INTRINSIC_TYPES:
+                stack.append(handle[attr.standard_name])
+            else:
+                members[attr.standard_name] = handle
+    return members, unreachable
+
+
+class State(collections.abc.Mapping):
+    """Preallocated values for the arguments of a set of schemes, keyed by standard name.
+
+    Arrays are allocated once in Fortran order with the dtype and shape required
+    by the routines using them, so that routines bound to the state can be called
+    repeatedly without allocating. Scalars are held as 0-dimensional arrays, and
+    scalars whose standard name is a dimension are set to its length. Derived types
+    are held as a lib.DerivedTypeHandle to a new instance, whose array attributes
+    must be allocated before use. Values which are also attributes of a derived
+    type in the state are views of that attribute, which is allocated if needed,
+    so routines taking the derived type and routines taking the value directly
+    see the same memory.
+
+    Values given the same buffer name share one array, see liveness.get_buffer_names.
+    """
+
+    def __init__(self, ccpp_metadata, dimensions, scheme_names=None, buffer_names=None):
+        """
+        Args:
+            ccpp_metadata: metadata of the routines using the state
+            dimensions: length of each dimension, by standard name
+            scheme_names: names of the schemes whose arguments to allocate,
+                by default all schemes in ccpp_metadata
+            buffer_names: name of the buffer holding each value whose array is
+                shared with other values, by standard name
+        """
+        self.dimensions = dict(dimensions)
+        self._arrays = {}
+        self._buffers = {}
+        self.buffer_names = {}
+        if buffer_names is None:
+            buffer_names = {}
+        missing_dimensions = set()
+        args = list(iterate_state_args(ccpp_metadata, scheme_names))
+        # derived types are allocated first, so values can be bound to their attributes
+        ddt_args = [arg for arg in args if arg.type not in meta.INTRINSIC_TYPES]
+        for arg in ddt_args:
+            self._add(arg, buffer_names, {}, set(), missing_dimensions)
+        members, unreachable = get_handle_members(
+            value for value in self._arrays.values() if isinstance(value, lib.DerivedTypeHandle)
+        )
+        for arg in args:
+            if arg.type in meta.INTRINSIC_TYPES:
+                self._add(arg, buffer_names, members, unreachable, missing_dimensions)
+        if len(missing_dimensions) > 0:
+            raise CCPPError(
+                f"lengths must be given for dimensions {sorted(missing_dimensions)}"
+            )
+
+    def _add(self, arg, buffer_names, members, unreachable, missing_dimensions):
+        shape = tuple(get_dimension_length(dim, self.dimensions) for dim in arg.dimensions)
+        if None in shape:
+            missing_dimensions.update(
+                dim for dim, length in zip(arg.dimensions, shape) if length is None
+            )
+        elif arg.standard_name in self._arrays:
+            self._check_consistent(arg, shape)
+        elif arg.standard_name in members:
+            self._arrays[arg.standard_name] = self._get_member(
+                arg, shape, members[arg.standard_name]
+            )
+        elif arg.standard_name in unreachable:
+            raise CCPPError(
+                f"{arg.standard_name} is used directly and as an attribute of a derived "
+                "type, but the attribute cannot be accessed through a handle"
+            )
+        elif arg.standard_name in buffer_names:
+            self._arrays[arg.standard_name] = self._get_buffer(
+                arg, shape, buffer_names[arg.standard_name]
+            )
+            self.buffer_names[arg.standard_name] = buffer_names[arg.standard_name]
+        else:
+            self._arrays[arg.standard_name] = self._allocate(arg, shape)
+
+    def _get_member(self, arg, shape, handle):
+        """Return a view of the attribute of handle with the standard name of arg,
+        allocating it if needed."""
+        if len(shape) > 0 and not handle.is_allocated(arg.standard_name):
+            array = handle.allocate(arg.standard_name, shape)
+            array[...] = 0
+        else:
+            array = handle[arg.standard_name]
+        dtype = lib.get_dtype(arg.type, arg.kind)
+        if array.shape != shape or array.dtype != dtype:
+            raise CCPPError(
+                f"{arg.standard_name} is used with shape {shape} and dtype {dtype}, but "
+                f"its attribute of {handle.type_name} has shape {array.shape} and dtype {array.dtype}"
+            )
+        if len(shape) == 0:
+            length = get_dimension_length(arg.standard_name, self.dimensions)
+            if length is not None:
+                array[...] = length
+        return array
+
+    def _allocate(self, arg, shape):
+        if arg.type not in meta.INTRINSIC_TYPES:
+            return lib.DerivedTypeHandle(arg.type)
+        array = np.zeros(shape, dtype=lib.get_dtype(arg.type, arg.kind), order='F')
+        if len(shape) == 0:
+            length = get_dimension_length(arg.standard_name, self.dimensions)
+            if length is not None:
+                array[...] = length
+        return array
+
+    def _get_buffer(self, arg, shape, buffer_name):
+        if buffer_name not in self._buffers:
+            self._buffers[buffer_name] = self._allocate(arg, shape)
+        buffer = self._buffers[buffer_name]
+        dtype = lib.get_dtype(arg.type, arg.kind)
+        if buffer.shape != shape or buffer.dtype != dtype:
+            raise CCPPError(
+                f"{arg.standard_name} has shape {shape} and dtype {dtype}, so it cannot "
+                f"share buffer {buffer_name} of shape {buffer.shape} and dtype {buffer.dtype}"
+            )
+        return buffer
+
+    def _check_consistent(self, arg, shape):
+        array = self._arrays[arg.standard_name]
+        if isinstance(array, lib.DerivedTypeHandle) or arg.type not in meta.INTRINSIC_TYPES:
+            used_type = getattr(array, 'type_name', array.dtype)
+            if used_type != arg.type:
+                raise CCPPError(
+                    f"{arg.standard_name} is used with type {arg.type}, but also with {used_type}"
+                )
+            return
+        dtype = lib.get_dtype(arg.type, arg.kind)
+        if array.shape != shape or array.dtype != dtype:
+            raise CCPPError(
+                f"{arg.standard_name} is used with shape {shape} and dtype {dtype}, "
+                f"but also with shape {array.shape} and dtype {array.dtype}"
+            )
+
+    def __getitem__(self, standard_name):
+        return self._arrays[standard_name]
+
+    def __iter__(self):
+        return iter(self._arrays)
+
+    def __len__(self):
+        return len(self._arrays)
+
+    @property
+    def nbytes(self):
+        """Bytes used by the arrays of the state, counting shared buffers once."""
+        arrays = {id(array): array for array in self._arrays.values()}
+        return sum(
+            array.nbytes for array in arrays.values() if isinstance(array, np.ndarray)
+        )
@@ -0,0 +1,175 @@
+import xml.etree.ElementTree as ET
+from collections import namedtuple
+from . import lib, dataflow
+from .lib import CCPPError
+
+
+SuiteSpec = namedtuple("SuiteSpec", ["name", "groups"])
+GroupSpec = namedtuple("GroupSpec", ["name", "subcycles"])
+SubcycleSpec = namedtuple("SubcycleSpec", ["loop", "schemes"])
+
+
+def load_suite(filename):
+    """Load a CCPP suite definition XML file."""
+    return get_suite(ET.parse(filename).getroot())
+
+
+def parse_suite(xml_string):
+    """Parse the text of a CCPP suite definition XML file."""
+    return get_suite(ET.fromstring(xml_string))
+
+
+def get_suite(root):
+    return SuiteSpec(
+        name=root.get('name'),
+        groups=tuple(get_group(element) for element in root.findall('group')),
+    )
+
+
+def get_group(element):
+    return GroupSpec(
+        name=element.get('name'),
+        subcycles=tuple(get_subcycle(subcycle) for subcycle in element.findall('subcycle')),
+    )
+
+
+def get_subcycle(element):
+    return SubcycleSpec(
+        loop=int(element.get('loop', '1')),
+        schemes=tuple(scheme.text.strip() for scheme in element.findall('scheme')),
+    )
+
+
+def iterate_scheme_names(suite_spec):
+    """Yield each scheme name of a suite once, in order of first appearance."""
+    seen = set()
+    for group in suite_spec.groups:
+        for subcycle in group.subcycles:
+            for scheme_name in subcycle.schemes:
+                if scheme_name not in seen:
+                    seen.add(scheme_name)
+                    yield scheme_name
+
+
+def get_suite_schemes(suite_spec, ccpp_metadata):
+    """Return a dict of the SchemeSpec for each scheme used by a suite."""
+    scheme_lookup = {scheme.name: scheme for scheme in ccpp_metadata.schemes}
+    scheme_names = list(iterate_scheme_names(suite_spec))
+    missing = [name for name in scheme_names if name not in scheme_lookup]
+    if len(missing) > 0:
+        raise CCPPError(
+            f"suite {suite_spec.name} uses schemes which are not available: {missing}"
+        )
+    return {name: scheme_lookup[name] for name in scheme_names}
+
+
+def get_ddt_lookup(ccpp_metadata):
+    return {ddt.name: ddt for ddt in ccpp_metadata.types}
+
+
+def dry_run(suite_spec, ccpp_metadata=None, costs=None):
+    """Print the critical path and achievable parallelism of each group of a suite
+    when run concurrently, without calling any routine.
+
+    costs gives the cost of each run routine by name, for example from
+    dataflow.get_profiled_costs(), by default every call costs 1.
+    """
+    if ccpp_metadata is None:
+        ccpp_metadata = lib.CCPP_METADATA
+    schemes = get_suite_schemes(suite_spec, ccpp_metadata)
+    ddt_lookup = get_ddt_lookup(ccpp_metadata)
+    for group in suite_spec.groups:
+        graph = dataflow.get_group_graph(group, schemes, ddt_lookup=ddt_lookup)
+        print(dataflow.format_schedule(group.name, graph, costs))
+
+
+def get_bound_routine(routine, state):
+    """Bind a routine to the values in state given by the standard names of its arguments."""
+    # use the routine wrapped once by the lib module, rather than wrapping it again
+    python_routine = getattr(lib, routine.name)
+    slots = python_routine.plan.slots
+    missing = [slot.standard_name for slot in slots if slot.standard_name not in state]
+    if len(missing) > 0:
+        raise CCPPError(f"{routine.name} requires values missing from state: {missing}")
+    # state arrays are held by the bound routine and modified in-place,
+    # so their pointers do not need to be checked on each call
+    return python_routine.bind(*[state[slot.standard_name] for slot in slots], check=False)
+
+
+class Suite:
+    """Executes the groups of a CCPP suite on values held in a state mapping
+    from standard name to array.
+
+    Every routine is bound to its arguments when the suite is created, so
+    each step only makes a flat sequence of cached calls. Values must be updated
+    in-place; call bind() after replacing any array in the state.
+
+    If an executor is given to run(), schemes of a group are called concurrently
+    as soon as every earlier scheme reading or writing the same values has completed,
+    following the intent of their arguments (see cyppy.dataflow).
+    """
+
+    def __init__(self, suite_spec, state, ccpp_metadata=None):
+        if ccpp_metadata is None:
+            ccpp_metadata = lib.CCPP_METADATA
+        self.spec = suite_spec
+        self.ccpp_metadata = ccpp_metadata
+        self.state = state
+        self.schemes = get_suite_schemes(suite_spec, ccpp_metadata)
+        self.bind()
+
+    def bind(self):
+        """Bind every routine in the suite to the current values in the state."""
+        run_calls = {
+            name: get_bound_routine(scheme.run, self.state)
+            for name, scheme in self.schemes.items()
+        }
+        self._init_calls = [
+            get_bound_routine(scheme.init, self.state) for scheme in self.schemes.values()
+        ]
+        self._finalize_calls = [
+            get_bound_routine(scheme.finalize, self.state) for scheme in self.schemes.values()
+        ]
+        self._group_calls = {}
+        self._group_graphs = {}
+        ddt_lookup = get_ddt_lookup(self.ccpp_metadata)
+        for group in self.spec.groups:
+            calls = []
+            for subcycle in group.subcycles:
+                for _ in range(subcycle.loop):
+                    calls.extend(run_calls[name] for name in subcycle.schemes)
+            self._group_calls[group.name] = calls
+            self._group_graphs[group.name] = dataflow.get_group_graph(
+                group, self.schemes, getattr(self.state, 'buffer_names', None), ddt_lookup
+            )
+
+    @property
+    def group_names(self):
+        return [group.name for group in self.spec.groups]
+
+    def init(self):
+        for call in self._init_calls:
+            call()
+
+    def run(self, group=None, executor=None):
+        """Run one group of the suite by name, or every group in order if group is None.
+
+        If executor is given, for example a concurrent.futures.ThreadPoolExecutor,
+        schemes without data hazards between them are called concurrently on it.
+        """
+        if group is None:
+            for group_name in self.group_names:
+                self.run(group_name, executor)
+        elif executor is None:
+            for call in self._group_calls[group]:
+                call()
+        else:
+            dataflow.run_graph(self._group_calls[group], self._group_graphs[group], executor)
+
+    def dry_run(self, costs=None):
+        """Print the critical path and achievable parallelism of each group."""
+        dry_run(self.spec, self.ccpp_metadata, costs)
+
+    def finalize(self):
+        for call in self._finalize_calls:
+            call()
@@ -1,3 +1,7 @@
+import argparse
+import functools
+import hashlib
+import re
 import jinja2
 import os
 import sys
@@ -9,10 +13,14 @@ CYPPY_DIR = os.path.join(LIB_DIR, '../cyppy')
 sys.path.append(CYPPY_DIR)
 import meta
 
-CAP_BASENAME = 'physics_cap.F90'
 FORTRAN_DIR = os.path.join(LIB_DIR, 'physics')
-CAP_OUT_FILENAME = os.path.join(LIB_DIR, CAP_BASENAME)
-INTRINSIC_TYPES = ['integer', 'real', 'logical', 'complex', 'character']
+TEMPLATE_DIR = os.path.join(LIB_DIR, 'templates')
+CAP_DIR = os.path.join(LIB_DIR, 'caps')
+CAP_MAKEFILE_BASENAME = 'caps.mk'
+TRACE_BASENAME = 'cyppy_trace.F90'
+TYPES_CAP_BASENAME = 'physics_types_cap.F90'
+SCHEME_CAP_TEMPLATE = 'scheme_cap.F90'
+DEFAULT_TRACE_LENGTH = 65536
 
 # name shortening is necessary to comply with fortran subroutine/variable name limits
 DO_SHORTEN_NAMES = True  # can be disabled to debug generated code if the names are hard to understand
@@ -51,8 +59,8 @@ SHORTEN_NAMES = {
     'water_vapor_specific_humidity': 'spec_hum',
     'perturbation': 'perturb',
     'tendency_of_air_temperature_due_to_radiative_heating': 'radiative_heating_rate',
-    'tendency_of_air_temperature_due_to_longwave_heating': 'longwave_heating_rate',
-    'tendency_of_air_temperature_due_to_shortwave_heating': 'shortwave_heating_rate',
+    'tendency_of_air_temperature_due_to_longwave_heating': 'lw_heating_rate',
+    'tendency_of_air_temperature_due_to_shortwave_heating': 'sw_heating_rate',
     'cumulative_surface_net_downward_diffuse_ultraviolet_and_visible_shortwave_flux_for_coupling_multiplied_by_timestep': 'accum_sfc_dwn_diffuse_uv_vis_sw_flx_for_cpl',  # hard one to shorten
     'ozone': 'o3',
     'concentration': 'conc',
@@ -95,15 +103,42 @@ SHORTEN_NAMES = {
 }
 
 
+def _longest_keys_first(items):
+    return sorted(items, key=lambda x: len(x[0]), reverse=True)
+
+
+# alternatives are tried in order, so longer names take precedence over names they contain
+SHORTEN_PATTERN = re.compile(
+    '|'.join(re.escape(long_name) for long_name, _ in _longest_keys_first(SHORTEN_NAMES.items()))
+)
+
+
 def shorten(standard_name):
     if DO_SHORTEN_NAMES:
-        for long_name, short_name in _longest_keys_first(SHORTEN_NAMES.items()):
-            standard_name = standard_name.replace(long_name, short_name)
+        return _shorten(standard_name)
     return standard_name
 
 
-def _longest_keys_first(items):
-    return sorted(items, key=lambda x: len(x[0]), reverse=True)
+@functools.lru_cache(maxsize=None)
+def _shorten(standard_name):
+    return SHORTEN_PATTERN.sub(lambda match: SHORTEN_NAMES[match.group(0)], standard_name)
+
+
+def check_shortened_names(standard_names, context):
+    """Raise ValueError if two different standard names shorten to the same
+    Fortran name, which would give duplicate names in the generated cap.
+
+    Fortran names are case-insensitive, so names differing only in case collide.
+    """
+    shortened = {}
+    collisions = []
+    for standard_name in standard_names:
+        short_name = shorten(standard_name)
+        other_name = shortened.setdefault(short_name.lower(), standard_name)
+        if other_name != standard_name:
+            collisions.append(f"{other_name} and {standard_name} both shorten to {short_name}")
+    if len(collisions) > 0:
+        raise ValueError(f"name collisions in {context}: " + '; '.join(collisions))
 
 
 def get_module_list(scheme_list):
@@ -118,7 +153,7 @@ def get_module_list(scheme_list):
 
 
 def get_type_string(arg_type, arg_kind):
-    if arg_type not in INTRINSIC_TYPES:
+    if arg_type not in meta.INTRINSIC_TYPES:
         arg_type = f"type({arg_type})"
     if arg_kind is None:
         return arg_type
@@ -146,27 +181,48 @@ def get_arg_list(args_in):
     return arg_list
 
 
+def get_handle_arg_list(args_in, ddt_names):
+    """Return the arguments of a cap, which takes arguments of derived types as handles."""
+    arg_list = get_arg_list(args_in)
+    for arg, arg_dict in zip(args_in, arg_list):
+        arg_dict['ddt'] = arg.type if arg.type in ddt_names else None
+        if arg_dict['ddt'] is None:
+            arg_dict['call_name'] = arg_dict['name']
+        else:
+            arg_dict['call_name'] = f"{arg_dict['name']}_ptr"
+    return arg_list
+
+
+def get_handle_prefix(type_name):
+    return f"cyppy_{type_name.lower()}"
+
+
 def get_types(derived_data_types):
+    """Return the template data for the routines managing instances of each derived type
+    through handles.
+
+    Attributes are identified by their index in ddt.attrs, as in cyppy.lib.DerivedTypeHandle.
+    """
+    ddt_names = set(ddt.name for ddt in derived_data_types)
     return_list = []
     for ddt in derived_data_types:
-        ddt_data = {}
-        ddt_data['name'] = ddt.name
-        ddt_data['packed_name'] = f"packed_{ddt.name.lower()}"
-        attrs = []
-        for attr in ddt.attrs:
-            attr_data = {}
-            attr_data['name'] = attr.name
-            attr_data['standard_name'] = shorten(attr.standard_name)
-            attr_data['is_subarray'] = '(' in attr.name
-            attr_data['type'] = attr.type
-            attr_data['type_string'] = get_type_string(attr.type, attr.kind)
-            attr_data['dimensions'] = get_colon_dimension_string(attr.dimensions)
-            attrs.append(attr_data)
-        ddt_data['attrs'] = attrs
-        ddt_data['attr_standard_names'] = [
-            shorten(attr.standard_name) for attr in ddt.attrs
+        attrs = [
+            {'id': attr_id, 'name': attr.name, 'rank': len(attr.dimensions), 'type': attr.type}
+            for attr_id, attr in enumerate(ddt.attrs) if meta.is_handle_attr(attr)
         ]
-        return_list.append(ddt_data)
+        for attr in attrs:
+            attr['shape_string'] = ', '.join(
+                f"attr_shape({i})" for i in range(1, attr['rank'] + 1)
+            )
+            attr['handle_prefix'] = get_handle_prefix(attr['type'])
+        return_list.append({
+            'name': ddt.name,
+            'handle_prefix': get_handle_prefix(ddt.name),
+            'attrs': attrs,
+            'array_attrs': [attr for attr in attrs if attr['rank'] > 0],
+            # members of derived type attributes are freed with their container
+            'ddt_attrs': [attr for attr in attrs if attr['type'] in ddt_names],
+        })
     return return_list
 
 
@@ -188,19 +244,22 @@ def get_colon_dimension_string(dimensions):
 
 def get_routines(schemes, derived_data_types):
     routine_list = []
-    for routine in meta.iterate_routines(schemes):
-        arg_list = get_arg_list(routine.args)
+    ddt_names = set(ddt.name for ddt in derived_data_types)
+    # routine ids are used by tracing, and must match the order of cyppy.lib.get_routine_names
+    for routine_id, routine in enumerate(meta.iterate_routines(schemes)):
+        check_shortened_names(
+            [arg.standard_name for arg in routine.internal_args], f"routine {routine.name}"
+        )
+        arg_list = get_handle_arg_list(routine.internal_args, ddt_names)
         do_errmsg = len(arg_list) > 0
         arg_list = arg_list[:-2]  # skip errmsg, errflg as these are added manually
-        internal_arg_list = get_arg_list(routine.internal_args)
-        internal_arg_list = internal_arg_list[:-2]
         routine_list.append(
             {
                 'name': routine.name,
+                'id': routine_id,
                 'args': arg_list,
                 'arg_names': [arg['name'] for arg in arg_list],
-                'internal_arg_names': [arg['name'] for arg in arg_list],
-                'derived_data_types': get_types(routine.types),
+                'call_names': [arg['call_name'] for arg in arg_list],
                 'do_errmsg': do_errmsg,
             }
         )
@@ -218,20 +277,138 @@ def get_modules(modules):
     return return_list
 
 
-if __name__ == '__main__':
-    template_kwargs = {}
-    ccpp_metadata = meta.load_meta_dir(FORTRAN_DIR)
+def get_template_env():
+    template_loader = jinja2.FileSystemLoader(searchpath=TEMPLATE_DIR)
+    return jinja2.Environment(loader=template_loader, autoescape=True, trim_blocks=True, lstrip_blocks=True)
+
 
-    template_kwargs['derived_data_type_list'] = get_types(ccpp_metadata.types)
-    template_kwargs['routine_list'] = get_routines(
-        ccpp_metadata.schemes, ccpp_metadata.types)
-    template_kwargs['module_list'] = get_modules(ccpp_metadata.modules)
+def get_scheme_cap_basename(scheme_name):
+    return f"{scheme_name}_cap.F90"
 
-    template_dir = os.path.join(LIB_DIR, 'templates')
-    template_loader = jinja2.FileSystemLoader(searchpath=template_dir)
-    template_env = jinja2.Environment(loader=template_loader, autoescape=True, trim_blocks=True, lstrip_blocks=True)
 
-    cap_template = template_env.get_template(CAP_BASENAME)
-    result = cap_template.render(**template_kwargs)
-    with open(CAP_OUT_FILENAME, 'w') as f:
-        f.write(result)
+def render_caps(ccpp_metadata, tracing=False, trace_length=DEFAULT_TRACE_LENGTH):
+    """Return a dict of the text of each Fortran cap file, by basename.
+
+    There is one cap module per scheme, which uses a module holding the
+    packing routines for derived data types and (if tracing) the trace module,
+    so that metadata changes to one scheme only change that scheme's cap.
+    """
+    template_env = get_template_env()
+    scheme_names = set(scheme.name for scheme in ccpp_metadata.schemes)
+    modules = get_modules(ccpp_metadata.modules)
+    caps = {}
+    if tracing:
+        caps[TRACE_BASENAME] = template_env.get_template(TRACE_BASENAME).render(
+            trace_length=trace_length,
+        )
+    caps[TYPES_CAP_BASENAME] = template_env.get_template(TYPES_CAP_BASENAME).render(
+        derived_data_type_list=get_types(ccpp_metadata.types),
+        module_list=[module for module in modules if module['name'] not in scheme_names],
+    )
+    scheme_template = template_env.get_template(SCHEME_CAP_TEMPLATE)
+    routine_list = get_routines(ccpp_metadata.schemes, ccpp_metadata.types)
+    for scheme in ccpp_metadata.schemes:
+        routine_names = [routine.name for routine in meta.iterate_routines([scheme])]
+        caps[get_scheme_cap_basename(scheme.name)] = scheme_template.render(
+            scheme_name=scheme.name,
+            routine_list=[routine for routine in routine_list if routine['name'] in routine_names],
+            module_list=[module for module in modules if module['name'] == scheme.name],
+            tracing=tracing,
+        )
+    return caps
+
+
+def get_cap_makefile(cap_basenames, cap_dir='$(CAP_DIR)', library='$(CCPP_DIR)/$(CCPP_LIBRARY)'):
+    """Return make rules listing the cap objects as CAP_OBJS, and the order in which
+    they must be compiled so each module is compiled before the modules using it."""
+    def get_object(basename):
+        return f"{cap_dir}/{basename[:-len('.F90')]}.o"
+    types_object = get_object(TYPES_CAP_BASENAME)
+    lines = [
+        '# generated by make_cap.py',
+        'CAP_OBJS = ' + ' '.join(get_object(basename) for basename in cap_basenames),
+        '',
+    ]
+    # scheme caps need the .mod files of the other caps, but are only recompiled
+    # when the source of those caps changes, not whenever they are recompiled
+    scheme_sources = [f"{cap_dir}/{TYPES_CAP_BASENAME}"]
+    scheme_order_only = [types_object, library]
+    if TRACE_BASENAME in cap_basenames:
+        scheme_sources.append(f"{cap_dir}/{TRACE_BASENAME}")
+        scheme_order_only.append(get_object(TRACE_BASENAME))
+    lines.append(f"{types_object}: {library}")
+    for basename in cap_basenames:
+        if basename not in (TRACE_BASENAME, TYPES_CAP_BASENAME):
+            lines.append(
+                f"{get_object(basename)}: {' '.join(scheme_sources)} | {' '.join(scheme_order_only)}"
+            )
+    return '\n'.join(lines) + '\n'
+
+
+def get_content_hash(text):
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+def get_file_hash(filename):
+    try:
+        with open(filename, 'rb') as f:
+            return hashlib.sha256(f.read()).hexdigest()
+    except FileNotFoundError:
+        return None
+
+
+def write_if_changed(filename, text):
+    """Write text to filename unless the file already has that content, so its
+    modification time (and anything make builds from it) is left unchanged.
+
+    Returns True if the file was written.
+    """
+    if get_file_hash(filename) == get_content_hash(text):
+        return False
+    with open(filename, 'w') as f:
+        f.write(text)
+    return True
+
+
+def write_caps(caps, cap_dir=CAP_DIR):
+    """Write cap files and their makefile into cap_dir, skipping unchanged files and
+    removing caps of schemes which no longer exist.
+
+    Returns a list of the basenames of files which were written.
+    """
+    os.makedirs(cap_dir, exist_ok=True)
+    files = dict(caps)
+    files[CAP_MAKEFILE_BASENAME] = get_cap_makefile(sorted(caps))
+    written = [
+        basename for basename, text in files.items()
+        if write_if_changed(os.path.join(cap_dir, basename), text)
+    ]
+    for basename in os.listdir(cap_dir):
+        if basename.endswith('.F90') and basename not in caps:
+            os.remove(os.path.join(cap_dir, basename))
+    return written
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Generate the Fortran cap for CCPP physics.")
+    parser.add_argument(
+        '--trace', action='store_true',
+        help="record routine enter/exit times in a ring buffer readable from cyppy.lib.read_trace",
+    )
+    parser.add_argument(
+        '--trace-length', type=int, default=DEFAULT_TRACE_LENGTH,
+        help="number of events kept in the trace ring buffer",
+    )
+    parser.add_argument(
+        '--cap-dir', default=CAP_DIR,
+        help="directory to write cap files into",
+    )
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    ccpp_metadata = meta.load_meta_dir(FORTRAN_DIR)
+    caps = render_caps(ccpp_metadata, tracing=args.trace, trace_length=args.trace_length)
+    written = write_caps(caps, args.cap_dir)
+    print(f"make_cap.py: {len(written)} of {len(caps) + 1} cap files changed")
@@ -0,0 +1,70 @@
+import numpy as np
+import pytest
+import cyppy
+
+
+@pytest.fixture
+def sfc_ocean_run_args():
+    im = np.array(5, dtype=np.int32)
+    cp = np.array(1005.)
+    rd = np.array(287.04)
+    eps = np.array(rd / 461.50)
+    epsm1 = np.array(eps - 1.0)
+    hvap = np.array(2.501e6)
+    rvrdm1 = np.array(1.0 / eps - 1.0)
+    ps = np.array(1.0e5) * np.ones([im])
+    t1 = np.array(300.0) * np.ones([im])
+    q1 = np.array(1.0e-3) * np.ones([im])
+    tskin = np.array(290.0) * np.ones([im])
+    cm = np.array(0.004) * np.ones([im])
+    ch = np.array(0.004) * np.ones([im])
+    prsl1 = np.array(0.95e5) * np.ones([im])
+    prslki = np.array(1.05) * np.ones([im])
+    # default logical is a 4 byte integer
+    wet = np.ones([im], dtype=np.int32)
+    wind = np.ones([im])
+    flag_iter = np.ones([im], dtype=np.int32)
+
+    qsurf = np.zeros([im])
+    cmm = np.zeros([im])
+    chh = np.zeros([im])
+    gflux = np.zeros([im])
+    evap = np.zeros([im])
+    hflx = np.zeros([im])
+    ep = np.zeros([im])
+
+    return [
+        im, cp, rd, eps, epsm1, hvap, rvrdm1, ps, t1, q1,
+        tskin, cm, ch, prsl1, prslki, wet, wind, flag_iter,
+        qsurf, cmm, chh, gflux, evap, hflx, ep
+    ]
+
+
+def get_arg(standard_name, intent='in', dimensions=(), arg_type='real', kind=None, name=None):
+    return cyppy.ArgSpec(
+        name=standard_name if name is None else name,
+        standard_name=standard_name,
+        long_name=standard_name,
+        units='none',
+        dimensions=dimensions,
+        type=arg_type,
+        kind=kind,
+        intent=intent,
+        optional=False,
+    )
+
+
+ERROR_ARGS = (
+    get_arg('ccpp_error_message', 'out', arg_type='character', kind='len=*', name='errmsg'),
+    get_arg('ccpp_error_flag', 'out', arg_type='integer', name='errflg'),
+)
+
+
+def get_scheme(name, *run_args, init_args=()):
+    """Return a SchemeSpec whose run and init routines take the given arguments."""
+    return cyppy.SchemeSpec(
+        name=name,
+        init=cyppy.RoutineSpec(name=f"{name}_init", args=tuple(init_args) + ERROR_ARGS),
+        run=cyppy.RoutineSpec(name=f"{name}_run", args=tuple(run_args) + ERROR_ARGS),
+        finalize=cyppy.RoutineSpec(name=f"{name}_finalize", args=ERROR_ARGS),
+    )
@@ -0,0 +1,150 @@
+import concurrent.futures
+import threading
+import pytest
+import cyppy
+from cyppy import dataflow
+from conftest import get_arg, get_scheme
+
+
+def access(reads=(), writes=()):
+    return dataflow.Access(reads=frozenset(reads), writes=frozenset(writes))
+
+
+@pytest.mark.parametrize(
+    "accesses, target",
+    [
+        pytest.param(
+            [access(writes=['t']), access(reads=['t'])], [set(), {0}], id="read_after_write"
+        ),
+        pytest.param(
+            [access(reads=['t']), access(writes=['t'])], [set(), {0}], id="write_after_read"
+        ),
+        pytest.param(
+            [access(writes=['t']), access(writes=['t'])], [set(), {0}], id="write_after_write"
+        ),
+        pytest.param(
+            [access(reads=['t']), access(reads=['t'])], [set(), set()], id="read_after_read"
+        ),
+        pytest.param(
+            [access(writes=['t']), access(writes=['q']), access(reads=['t', 'q'])],
+            [set(), set(), {0, 1}],
+            id="join",
+        ),
+        pytest.param(
+            [access(reads=['t']), access(reads=['t']), access(reads=['t'], writes=['t'])],
+            [set(), set(), {0, 1}],
+            id="inout_after_readers",
+        ),
+    ]
+)
+def test_get_graph(accesses, target):
+    names = [f"s{i}_run" for i in range(len(accesses))]
+    graph = dataflow.get_graph(names, accesses)
+    assert [set(predecessors) for predecessors in graph.predecessors] == target
+
+
+def test_get_graph_orders_calls_of_same_routine():
+    graph = dataflow.get_graph(['s_run', 's_run'], [access(reads=['t'])] * 2)
+    assert graph.predecessors == (frozenset(), frozenset({0}))
+
+
+@pytest.fixture
+def diamond():
+    # a -> (b, c) -> d
+    return dataflow.DataflowGraph(
+        names=('a', 'b', 'c', 'd'),
+        predecessors=(frozenset(), frozenset({0}), frozenset({0}), frozenset({1, 2})),
+    )
+
+
+def test_get_schedule_unit_costs(diamond):
+    schedule = dataflow.get_schedule(diamond)
+    assert schedule.work == 4
+    assert schedule.span == 3
+    assert schedule.max_width == 2
+    assert schedule.critical_path[0] == 'a' and schedule.critical_path[-1] == 'd'
+
+
+def test_get_schedule_follows_costs(diamond):
+    schedule = dataflow.get_schedule(diamond, costs={'c': 10.})
+    assert schedule.critical_path == ('a', 'c', 'd')
+    assert schedule.span == 12
+    assert schedule.parallelism == pytest.approx(13 / 12)
+
+
+def test_get_schedule_empty():
+    graph = dataflow.DataflowGraph(names=(), predecessors=())
+    assert dataflow.get_schedule(graph).critical_path == ()
+
+
+def test_run_graph_respects_dependencies(diamond):
+    order = []
+    lock = threading.Lock()
+
+    def get_call(name):
+        def call():
+            with lock:
+                order.append(name)
+        return call
+    with concurrent.futures.ThreadPoolExecutor(4) as executor:
+        dataflow.run_graph([get_call(name) for name in diamond.names], diamond, executor)
+    assert order[0] == 'a' and order[-1] == 'd'
+    assert sorted(order[1:3]) == ['b', 'c']
+
+
+def test_run_graph_raises_and_stops(diamond):
+    called = []
+
+    def fail():
+        raise cyppy.lib.CCPPError('failed')
+    calls = [lambda: called.append('a'), fail, lambda: None, lambda: called.append('d')]
+    with concurrent.futures.ThreadPoolExecutor(2) as executor:
+        with pytest.raises(cyppy.lib.CCPPError, match='failed'):
+            dataflow.run_graph(calls, diamond, executor)
+    assert called == ['a']
+
+
+def test_dry_run(capsys):
+    ccpp_metadata = cyppy.CCPPMetadata(
+        modules=(),
+        schemes=(
+            get_scheme('land', get_arg('temperature', 'in'), get_arg('land_flux', 'out')),
+            get_scheme('ocean', get_arg('temperature', 'in'), get_arg('ocean_flux', 'out')),
+            get_scheme(
+                'combine',
+                get_arg('land_flux', 'in'), get_arg('ocean_flux', 'in'),
+                get_arg('temperature', 'inout'),
+            ),
+        ),
+        types=(),
+    )
+    suite_spec = cyppy.suite.parse_suite(
+        """<suite name="surface">
+  <group name="physics">
+    <subcycle><scheme>land</scheme><scheme>ocean</scheme><scheme>combine</scheme></subcycle>
+  </group>
+</suite>"""
+    )
+    cyppy.suite.dry_run(suite_spec, ccpp_metadata)
+    output = capsys.readouterr().out
+    assert 'group physics: 3 calls, work 3, span 2, parallelism 1.50, max width 2' in output
+    assert 'critical path: land_run -> combine_run' in output
+
+
+def test_derived_type_arg_accesses_attributes():
+    inner = cyppy.DerivedDataTypeSpec(name='Inner_type', attrs=(get_arg('htrsw', 'in'),))
+    outer = cyppy.DerivedDataTypeSpec(
+        name='Radtend_type',
+        attrs=(get_arg('htrlw', 'in'), get_arg('inner', 'in', arg_type='Inner_type')),
+    )
+    ddt_lookup = {ddt.name: ddt for ddt in (inner, outer)}
+    radiation = get_scheme('radiation', get_arg('radtend', 'out', arg_type='Radtend_type'))
+    heating = get_scheme('heating', get_arg('htrsw', 'in'), get_arg('temperature', 'inout'))
+    access = dataflow.get_access(radiation.run, ddt_lookup=ddt_lookup)
+    assert access.writes == {'radtend', 'htrlw', 'htrsw'}
+    group_spec = cyppy.suite.GroupSpec(
+        name='physics', subcycles=(cyppy.suite.SubcycleSpec(loop=1, schemes=('radiation', 'heating')),)
+    )
+    schemes = {scheme.name: scheme for scheme in (radiation, heating)}
+    graph = dataflow.get_group_graph(group_spec, schemes, ddt_lookup=ddt_lookup)
+    assert graph.predecessors == (frozenset(), frozenset({0}))
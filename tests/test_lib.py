@@ -1,5 +1,13 @@
+import concurrent.futures
+import ctypes
+import json
 import cyppy
 import numpy as np
+import pytest
+import subprocess
+import sys
+import types
+from conftest import get_arg
 
 
 def test_h2ophys_init():
@@ -10,36 +18,502 @@ def test_sfc_ocean_init():
     cyppy.lib.sfc_ocean_init()
 
 
-def test_sfc_ocean_run():
-    im = np.array(5)
-    cp = np.array(1005.)
-    rd = np.array(287.04)
-    eps = np.array(rd / 461.50)
-    epsm1 = np.array(eps - 1.0)
-    hvap = np.array(2.501e6)
-    rvrdm1 = np.array(1.0 / eps - 1.0)
-    ps = np.array(1.0e5) * np.ones([im])
-    t1 = np.array(300.0) * np.ones([im])
-    q1 = np.array(1.0e-3) * np.ones([im])
-    tskin = np.array(290.0) * np.ones([im])
-    cm = np.array(0.004) * np.ones([im])
-    ch = np.array(0.004) * np.ones([im])
-    prsl1 = np.array(0.95e5) * np.ones([im])
-    prslki = np.array(1.05) * np.ones([im])
-    wet = np.ones([im], dtype=bool)
-    wind = np.ones([im])
-    flag_iter = np.ones([im], dtype=bool)
-
-    qsurf = np.zeros([im])
-    cmm = np.zeros([im])
-    chh = np.zeros([im])
-    gflux = np.zeros([im])
-    evap = np.zeros([im])
-    hflx = np.zeros([im])
-    ep = np.zeros([im])
-
-    cyppy.lib.sfc_ocean_run(
-        im, cp, rd, eps, epsm1, hvap, rvrdm1, ps, t1, q1,
-        tskin, cm, ch, prsl1, prslki, wet, wind, flag_iter,
-        qsurf, cmm, chh, gflux, evap, hflx, ep
+def test_sfc_ocean_run(sfc_ocean_run_args):
+    cyppy.lib.sfc_ocean_run(*sfc_ocean_run_args)
+
+
+def test_sfc_ocean_run_without_validation(sfc_ocean_run_args):
+    cyppy.lib.sfc_ocean_run(*sfc_ocean_run_args, validate=False)
+
+
+def test_sfc_ocean_run_wrong_length_raises(sfc_ocean_run_args):
+    sfc_ocean_run_args[0] = np.array(6, dtype=np.int32)
+    with pytest.raises(cyppy.lib.CCPPError):
+        cyppy.lib.sfc_ocean_run(*sfc_ocean_run_args)
+
+
+@pytest.mark.parametrize("index, dtype", [(0, np.int64), (15, bool), (7, np.float32)])
+def test_sfc_ocean_run_wrong_dtype_raises(sfc_ocean_run_args, index, dtype):
+    sfc_ocean_run_args[index] = sfc_ocean_run_args[index].astype(dtype)
+    with pytest.raises(cyppy.lib.CCPPError, match='cast=True'):
+        cyppy.lib.sfc_ocean_run(*sfc_ocean_run_args)
+
+
+def test_sfc_ocean_run_cast_matches_exact_dtypes(sfc_ocean_run_args):
+    cast_args = [arg.copy() for arg in sfc_ocean_run_args]
+    cast_args[0] = cast_args[0].astype(np.int64)
+    cast_args[15] = cast_args[15].astype(bool)  # wet
+    cast_args[17] = cast_args[17].astype(bool)  # flag_iter
+    cyppy.lib.reset_copy_counts()
+    cyppy.lib.sfc_ocean_run(*sfc_ocean_run_args)
+    assert cyppy.lib.get_copy_counts() == {}
+    cyppy.lib.sfc_ocean_run(*cast_args, cast=True)
+    assert cyppy.lib.get_copy_counts()[('sfc_ocean_run', 'wet')] == 1
+    for result, target in zip(cast_args, sfc_ocean_run_args):
+        np.testing.assert_array_equal(result, target)
+
+
+@pytest.mark.parametrize(
+    "arg_type, kind, target",
+    [
+        pytest.param('real', 'kind_phys', np.float64, id='kind_phys'),
+        pytest.param('real', None, np.float64, id='default_real'),
+        pytest.param('real', '4', np.float32, id='real_4'),
+        pytest.param('integer', None, np.int32, id='default_integer'),
+        pytest.param('integer', '8', np.int64, id='integer_8'),
+        pytest.param('logical', None, np.int32, id='default_logical'),
+        pytest.param('logical', '1', np.int8, id='logical_1'),
+    ]
+)
+def test_get_dtype(arg_type, kind, target):
+    assert cyppy.lib.get_dtype(arg_type, kind) == target
+
+
+def test_get_dtype_unknown_kind_raises():
+    with pytest.raises(cyppy.lib.CCPPError):
+        cyppy.lib.get_dtype('real', 'kind_unknown')
+
+
+def test_sfc_ocean_run_bound(sfc_ocean_run_args):
+    bound = cyppy.lib.sfc_ocean_run.bind(*sfc_ocean_run_args)
+    bound()
+    bound()
+
+
+def test_sfc_ocean_run_bound_by_name(sfc_ocean_run_args):
+    names = [slot.name for slot in cyppy.lib.sfc_ocean_run.plan.slots]
+    bound = cyppy.lib.sfc_ocean_run.bind(**dict(zip(names, sfc_ocean_run_args)))
+    bound()
+
+
+@pytest.fixture
+def counter_plan():
+    args = (
+        get_arg('counter', 'inout', arg_type='integer', name='n'),
+        get_arg('air_temperature', 'inout', ('vertical_dimension',), name='t'),
+        None,
+        None,
+    )
+    routine = cyppy.RoutineSpec(name='my_counter_run', args=args)
+
+    def f_routine(n, t, errmsg, errflg):
+        ctypes.cast(n, ctypes.POINTER(ctypes.c_int))[0] += 1
+        ctypes.cast(t, ctypes.POINTER(ctypes.c_double))[0] += 1.
+
+    return cyppy.lib.get_call_plan(routine, f_routine)
+
+
+@pytest.mark.parametrize("contiguous", [True, False], ids=["direct", "copied"])
+def test_bound_inout_scalar_keeps_value(counter_plan, contiguous):
+    t = np.zeros(4) if contiguous else np.zeros(8)[::2]
+    bound = cyppy.lib.BoundRoutine(counter_plan, (0, t))
+    assert bound() == 1
+    assert bound() == 2
+    np.testing.assert_array_equal(t, [2., 0., 0., 0.])
+
+
+def test_bound_moved_array_keeps_scalar_values(counter_plan):
+    t = np.zeros(4)
+    bound = cyppy.lib.BoundRoutine(counter_plan, (0, t))
+    assert bound() == 1
+    # as if the data of t had been reallocated since it was bound
+    bound.array_pointers = (0,)
+    assert bound() == 2
+    assert bound.array_pointers == (t.ctypes.data,)
+    np.testing.assert_array_equal(t, [2., 0., 0., 0.])
+
+
+@pytest.fixture
+def first_only_plan():
+    args = (
+        get_arg('horizontal_loop_extent', arg_type='integer', name='im'),
+        get_arg('air_temperature', 'out', ('horizontal_loop_extent', 'vertical_dimension'), name='t'),
+        None,
+        None,
+    )
+    routine = cyppy.RoutineSpec(name='my_first_only_run', args=args)
+
+    def f_routine(im, t, errmsg, errflg):
+        # writes only the first element of its intent(out) argument
+        ctypes.cast(t, ctypes.POINTER(ctypes.c_double))[0] = 1.
+
+    return cyppy.lib.get_call_plan(routine, f_routine)
+
+
+def fill_scratch(shape, value):
+    scratch = cyppy.lib.acquire_scratch(shape, np.dtype(np.float64))
+    scratch[...] = value
+    cyppy.lib.release_scratch(scratch)
+
+
+def test_copied_out_array_keeps_unwritten_values(first_only_plan):
+    fill_scratch((2, 2), -9.)
+    t = np.full((2, 2), 3.)  # C order, so it is copied
+    cyppy.lib.call_routine(first_only_plan, [2, t])
+    np.testing.assert_array_equal(t, [[1., 3.], [3., 3.]])
+
+
+def test_batched_copied_out_array_keeps_unwritten_values(first_only_plan):
+    # (member, column, level) moved to the (column, member, level) layout of the batch
+    fill_scratch((2, 2, 3), -9.)
+    t = np.full((2, 2, 3), 3.)
+    cyppy.lib.call_batched(first_only_plan, [2, t])
+    target = np.full((2, 2, 3), 3.)
+    target[0, 0, 0] = 1.
+    np.testing.assert_array_equal(t, target)
+
+
+def test_masked_out_array_keeps_unwritten_values(first_only_plan):
+    # gather buffers are sized for all columns of the array
+    fill_scratch((12,), -9.)
+    t = np.full((4, 3), 3.)
+    cyppy.lib.call_masked(first_only_plan, [4, t], np.array([0, 1, 1, 0]))
+    target = np.full((4, 3), 3.)
+    target[1, 0] = 1.
+    np.testing.assert_array_equal(t, target)
+
+
+def test_sfc_ocean_run_chunked_matches_unchunked(sfc_ocean_run_args):
+    chunked_args = [arg.copy() for arg in sfc_ocean_run_args]
+    cyppy.lib.sfc_ocean_run(*sfc_ocean_run_args)
+    cyppy.lib.sfc_ocean_run.chunked(*chunked_args, n_chunks=3)
+    for result, target in zip(chunked_args, sfc_ocean_run_args):
+        np.testing.assert_array_equal(result, target)
+
+
+def test_sfc_ocean_run_masked_matches_unmasked(sfc_ocean_run_args):
+    wet = sfc_ocean_run_args[15]
+    wet[[1, 3]] = 0
+    masked_args = [arg.copy() for arg in sfc_ocean_run_args]
+    cyppy.lib.sfc_ocean_run(*sfc_ocean_run_args)
+    cyppy.lib.sfc_ocean_run.masked(*masked_args, mask='wet')
+    for result, target in zip(masked_args, sfc_ocean_run_args):
+        np.testing.assert_array_equal(result, target)
+
+
+@pytest.mark.parametrize(
+    "n_columns, n_chunks, target",
+    [
+        pytest.param(10, 1, [(0, 10)], id="one_chunk"),
+        pytest.param(10, 3, [(0, 3), (3, 6), (6, 10)], id="uneven_chunks"),
+        pytest.param(2, 4, [(0, 1), (1, 2)], id="more_chunks_than_columns"),
+    ]
+)
+def test_get_chunk_bounds(n_columns, n_chunks, target):
+    assert cyppy.lib.get_chunk_bounds(n_columns, n_chunks) == target
+
+
+def get_ensemble_args(args, n_members):
+    """Return arguments with a leading ensemble axis on each horizontally dimensioned
+    array, with different values for each member."""
+    slots = cyppy.lib.sfc_ocean_run.plan.slots
+    ensemble_args = []
+    for arg, slot in zip(args, slots):
+        if slot.horizontal_axis is None:
+            ensemble_args.append(arg.copy())
+        elif arg.dtype.kind != 'f':
+            ensemble_args.append(np.stack([arg] * n_members))
+        else:
+            ensemble_args.append(
+                np.stack([arg * (1 + 0.01 * member) for member in range(n_members)])
+            )
+    return ensemble_args
+
+
+def test_sfc_ocean_run_batched_matches_members(sfc_ocean_run_args):
+    n_members = 3
+    batched_args = get_ensemble_args(sfc_ocean_run_args, n_members)
+    member_args = [
+        cyppy.lib.get_member_args(cyppy.lib.sfc_ocean_run.plan, batched_args, member)
+        for member in range(n_members)
+    ]
+    member_args = [[arg.copy() for arg in args] for args in member_args]
+    cyppy.lib.sfc_ocean_run.batched(*batched_args)
+    for member, args in enumerate(member_args):
+        cyppy.lib.sfc_ocean_run(*args)
+        targets = cyppy.lib.get_member_args(cyppy.lib.sfc_ocean_run.plan, batched_args, member)
+        for result, target in zip(args, targets):
+            np.testing.assert_array_equal(result, target)
+
+
+def test_sfc_ocean_run_batched_contiguous_is_not_copied(sfc_ocean_run_args):
+    # for 1D arrays, a C-ordered (member, column) array has each member's columns in sequence
+    batched_args = get_ensemble_args(sfc_ocean_run_args, 2)
+    cyppy.lib.reset_copy_counts()
+    cyppy.lib.sfc_ocean_run.batched(*batched_args)
+    assert cyppy.lib.get_copy_counts() == {}
+
+
+def test_sfc_ocean_run_batched_inconsistent_members_raises(sfc_ocean_run_args):
+    batched_args = get_ensemble_args(sfc_ocean_run_args, 2)
+    batched_args[7] = batched_args[7][:1]
+    with pytest.raises(cyppy.lib.CCPPError):
+        cyppy.lib.sfc_ocean_run.batched(*batched_args)
+
+
+def test_error_buffers_are_per_thread():
+    main_buffers = cyppy.lib.get_error_buffers()
+    assert cyppy.lib.get_error_buffers() is main_buffers
+    with concurrent.futures.ThreadPoolExecutor(max_workers=1) as executor:
+        thread_buffers = executor.submit(cyppy.lib.get_error_buffers).result()
+    assert thread_buffers is not main_buffers
+
+
+def test_sfc_ocean_run_non_contiguous_matches_contiguous(sfc_ocean_run_args):
+    # every other element of a longer array is not contiguous
+    strided_args = []
+    for arg in sfc_ocean_run_args:
+        if arg.ndim == 1:
+            strided = np.zeros((2 * arg.shape[0],), dtype=arg.dtype)[::2]
+            strided[:] = arg
+            strided_args.append(strided)
+        else:
+            strided_args.append(arg.copy())
+    cyppy.lib.reset_copy_counts()
+    cyppy.lib.sfc_ocean_run(*sfc_ocean_run_args)
+    assert cyppy.lib.get_copy_counts() == {}
+    cyppy.lib.sfc_ocean_run(*strided_args)
+    assert cyppy.lib.get_copy_counts()[('sfc_ocean_run', 'ps')] == 1
+    for result, target in zip(strided_args, sfc_ocean_run_args):
+        np.testing.assert_array_equal(result, target)
+
+
+def test_sfc_ocean_run_python_scalars_match_arrays(sfc_ocean_run_args):
+    scalar_args = [
+        arg.item() if arg.ndim == 0 else arg.copy() for arg in sfc_ocean_run_args
+    ]
+    cyppy.lib.sfc_ocean_run(*sfc_ocean_run_args)
+    assert cyppy.lib.sfc_ocean_run(*scalar_args) is None
+    for result, target in zip(scalar_args, sfc_ocean_run_args):
+        np.testing.assert_array_equal(result, target)
+
+
+def test_python_scalar_wrong_type_raises(sfc_ocean_run_args):
+    sfc_ocean_run_args[0] = 5.0
+    with pytest.raises(cyppy.lib.CCPPError):
+        cyppy.lib.sfc_ocean_run(*sfc_ocean_run_args)
+
+
+@pytest.fixture
+def profiling():
+    cyppy.lib.reset_profile()
+    cyppy.lib.enable_profiling(events=True)
+    yield
+    cyppy.lib.disable_profiling()
+    cyppy.lib.reset_profile()
+
+
+def test_sfc_ocean_run_profiled(profiling, sfc_ocean_run_args):
+    cyppy.lib.sfc_ocean_run(*sfc_ocean_run_args)
+    bound = cyppy.lib.sfc_ocean_run.bind(*sfc_ocean_run_args)
+    bound()
+    [row] = cyppy.lib.get_profile()
+    assert row.routine == 'sfc_ocean_run'
+    assert row.calls == 2
+    assert row.nbytes == 2 * sum(arg.nbytes for arg in sfc_ocean_run_args)
+    assert 0 < row.fortran_time < row.total_time
+    assert row.min_time <= row.max_time
+
+
+def test_profiling_disabled_records_nothing(sfc_ocean_run_args):
+    cyppy.lib.reset_profile()
+    cyppy.lib.sfc_ocean_run(*sfc_ocean_run_args)
+    assert cyppy.lib.get_profile() == []
+
+
+def test_get_profile_sorted_by_total_time(profiling):
+    cyppy.lib.record_call('fast_run', 0., 1., (0.5, 1.), 8)
+    cyppy.lib.record_call('slow_run', 0., 3., None, 16)
+    cyppy.lib.record_call('fast_run', 1., 2., (1.5, 2.), 8)
+    rows = cyppy.lib.get_profile()
+    assert [row.routine for row in rows] == ['slow_run', 'fast_run']
+    assert rows[1] == cyppy.lib.ProfileRow(
+        routine='fast_run', calls=2, total_time=2., prep_time=1., fortran_time=1.,
+        min_time=1., max_time=1., nbytes=16,
+    )
+    assert 'slow_run' in cyppy.lib.format_profile()
+
+
+def test_write_chrome_trace(profiling, tmpdir):
+    cyppy.lib.record_call('my_run', 1., 2., (1.5, 2.), 8)
+    filename = str(tmpdir.join('trace.json'))
+    cyppy.lib.write_chrome_trace(filename)
+    with open(filename) as f:
+        trace = json.load(f)
+    assert [event['cat'] for event in trace['traceEvents']] == ['routine', 'fortran']
+    assert trace['traceEvents'][0]['dur'] == pytest.approx(1e6)
+
+
+def test_import_does_not_load_library():
+    code = (
+        "import cyppy; "
+        "assert cyppy.lib._libccpp is None; "
+        "assert cyppy.lib._ccpp_metadata is None"
+    )
+    subprocess.run([sys.executable, '-c', code], check=True)
+
+
+def test_dir_lists_routines_from_metadata():
+    assert 'sfc_ocean_run' in dir(cyppy.lib)
+
+
+def test_routine_wrapped_once():
+    assert cyppy.lib.sfc_ocean_run is cyppy.lib.sfc_ocean_run
+
+
+@pytest.fixture
+def ddt_plan():
+    ddt_arg = cyppy.ArgSpec(
+        name='state', standard_name='my_state', long_name='state', units='DDT',
+        dimensions=(), type='my_type', kind=None, intent='inout', optional=False,
     )
+    extent_arg = ddt_arg._replace(
+        name='im', standard_name='horizontal_loop_extent', type='integer', intent='in'
+    )
+    routine = cyppy.RoutineSpec(name='my_scheme_run', args=(extent_arg, ddt_arg, None, None))
+    # the plan does not call the routine, so it needs no Fortran cap
+    return cyppy.lib.get_call_plan(routine, types.SimpleNamespace())
+
+
+def test_derived_type_arg_requires_handle(ddt_plan):
+    with pytest.raises(cyppy.lib.CCPPError, match='must be a DerivedTypeHandle of type my_type'):
+        cyppy.lib.validate_args(ddt_plan, (4, np.zeros(4)))
+
+
+@pytest.mark.parametrize(
+    "check", [cyppy.lib.check_chunkable, cyppy.lib.check_batchable], ids=["chunked", "batched"]
+)
+def test_derived_type_arg_cannot_be_split(ddt_plan, check):
+    with pytest.raises(cyppy.lib.CCPPError, match='derived type my_type'):
+        check(ddt_plan)
+
+
+@pytest.mark.parametrize(
+    "dimensions",
+    [
+        ('horizontal_dimension_plus_one',),
+        ('horizontal_dimension', 'horizontal_loop_extent'),
+        ('vertical_dimension', 'horizontal_dimension_plus_one'),
+    ],
+)
+@pytest.mark.parametrize(
+    "check",
+    [cyppy.lib.check_chunkable, cyppy.lib.check_batchable, cyppy.lib.check_maskable],
+    ids=["chunked", "batched", "masked"],
+)
+def test_arg_without_one_horizontal_axis_cannot_be_split(check, dimensions):
+    args = (
+        get_arg('horizontal_loop_extent', arg_type='integer', name='im'),
+        get_arg('air_temperature', dimensions=dimensions, name='t'),
+        None,
+        None,
+    )
+    routine = cyppy.RoutineSpec(name='my_scheme_run', args=args)
+    plan = cyppy.lib.get_call_plan(routine, types.SimpleNamespace())
+    with pytest.raises(cyppy.lib.CCPPError, match='because t has dimensions'):
+        check(plan)
+
+
+@pytest.fixture
+def stub_handle_arrays(monkeypatch):
+    """Makes handles to my_type use Python stubs for the functions of the types cap,
+    with its array attributes held in the returned dict by attribute id."""
+    attr = cyppy.AttributeSpec(
+        name='t', standard_name='air_temperature', long_name='', units='K',
+        dimensions=('horizontal_dimension', 'vertical_dimension'), type='real', kind=None,
+    )
+    spec = cyppy.DerivedDataTypeSpec(name='my_type', attrs=(attr,))
+    monkeypatch.setattr(cyppy.lib, '_derived_type_specs', {'my_type': spec})
+    arrays = {}
+
+    def read_shape(shape_address):
+        # small numpy buffers are reused once freed, so a shape array freed before
+        # this call would be overwritten here
+        [np.full(2, -1, dtype=np.int32) for _ in range(4)]
+        shape_pointer = ctypes.cast(shape_address, ctypes.POINTER(ctypes.c_int32))
+        return tuple(np.ctypeslib.as_array(shape_pointer, (2,)))
+
+    def attr_loc(address, attr_id):
+        return arrays[attr_id].ctypes.data if attr_id in arrays else None
+
+    def attr_shape(address, attr_id, shape_address):
+        shape = np.array(arrays[attr_id].shape, dtype=np.int32)
+        ctypes.memmove(shape_address, shape.ctypes.data, shape.nbytes)
+
+    def allocate(address, attr_id, shape_address):
+        arrays[attr_id] = np.zeros(read_shape(shape_address), order='F')
+
+    functions = cyppy.lib.HandleFunctions(
+        create=lambda: 1, destroy=lambda address: None,
+        attr_loc=attr_loc, attr_shape=attr_shape, allocate=allocate,
+    )
+    monkeypatch.setattr(cyppy.lib, 'get_handle_functions', lambda type_name: functions)
+    return arrays
+
+
+def test_handle_allocate_passes_shape(stub_handle_arrays):
+    with cyppy.lib.DerivedTypeHandle('my_type') as handle:
+        assert not handle.is_allocated('air_temperature')
+        t = handle.allocate('air_temperature', (5, 3))
+        assert stub_handle_arrays[0].shape == (5, 3)
+        assert t.shape == (5, 3)
+        with pytest.raises(cyppy.lib.CCPPError, match='already allocated'):
+            handle.allocate('air_temperature', (5, 3))
+
+
+@pytest.fixture
+def masked_plan():
+    args = (
+        get_arg('horizontal_loop_extent', arg_type='integer', name='im'),
+        get_arg('flag_active', dimensions=('horizontal_dimension',), arg_type='logical', name='flag'),
+        get_arg(
+            'air_temperature', 'inout', ('horizontal_dimension', 'vertical_dimension'), name='t'
+        ),
+        None,
+        None,
+    )
+    routine = cyppy.RoutineSpec(name='my_scheme_run', args=args)
+    return cyppy.lib.get_call_plan(routine, types.SimpleNamespace())
+
+
+def test_compact_args_gather_and_scatter_columns(masked_plan):
+    flag = np.array([1, 0, 1, 0], dtype=np.int32)
+    t = np.asfortranarray(np.arange(8.).reshape(4, 2))
+    columns = np.flatnonzero(flag)
+    compact_args, gathers = cyppy.lib.get_compact_args(masked_plan, [4, flag, t], columns)
+    assert compact_args[0] == 2
+    np.testing.assert_array_equal(compact_args[1], [1, 1])
+    np.testing.assert_array_equal(compact_args[2], t[[0, 2]])
+    assert compact_args[2].flags.f_contiguous
+    compact_args[2][...] = -1.
+    cyppy.lib.finish_gathers(gathers)
+    np.testing.assert_array_equal(t[:, 0], [-1., 2., -1., 6.])
+
+
+@pytest.mark.parametrize(
+    "mask",
+    [np.ones(7, dtype=np.int32), np.ones(3, dtype=np.int32), np.ones((4, 1), dtype=np.int32)],
+    ids=["long", "short", "2d"],
+)
+def test_masked_wrong_mask_shape_raises(masked_plan, mask):
+    t = np.zeros((4, 2), order='F')
+    with pytest.raises(cyppy.lib.CCPPError, match='mask for my_scheme_run should have shape'):
+        cyppy.lib.call_masked(masked_plan, [4, np.ones(4, dtype=np.int32), t], mask, validate=False)
+
+
+def test_finish_gathers_releases_buffers_when_scatter_fails(masked_plan):
+    flag = np.array([1, 0, 1, 0], dtype=np.int32)
+    t = np.asfortranarray(np.arange(8.).reshape(4, 2))
+    _, gathers = cyppy.lib.get_compact_args(masked_plan, [4, flag, t], np.flatnonzero(flag))
+    # an index past the end of the array makes the scatter raise
+    gathers[-1] = gathers[-1]._replace(index=(np.array([0, 9]),))
+    with pytest.raises(IndexError):
+        cyppy.lib.finish_gathers(gathers)
+    for gather in gathers:
+        assert cyppy.lib.acquire_scratch(gather.buffer.shape, gather.buffer.dtype) is gather.buffer
+
+
+@pytest.mark.parametrize("mask", ["t", "missing"])
+def test_masked_invalid_mask_raises(masked_plan, mask):
+    with pytest.raises(cyppy.lib.CCPPError):
+        cyppy.lib.get_mask_index(masked_plan, mask)
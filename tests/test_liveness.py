@@ -0,0 +1,142 @@
+import pytest
+import cyppy
+from cyppy import liveness
+from conftest import get_arg, get_scheme
+
+
+COLUMN = ('horizontal_dimension',)
+
+
+@pytest.fixture
+def ccpp_metadata():
+    return cyppy.CCPPMetadata(
+        modules=(),
+        schemes=(
+            get_scheme('a', get_arg('temperature', 'in', COLUMN), get_arg('tmp1', 'out', COLUMN)),
+            get_scheme('b', get_arg('tmp1', 'in', COLUMN), get_arg('tmp2', 'out', COLUMN)),
+            get_scheme('c', get_arg('tmp2', 'in', COLUMN), get_arg('tmp3', 'out', COLUMN)),
+            get_scheme(
+                'd', get_arg('tmp3', 'in', COLUMN), get_arg('temperature', 'inout', COLUMN)
+            ),
+            get_scheme(
+                'e', get_arg('tmp4', 'out', ('horizontal_dimension', 'vertical_dimension')),
+                get_arg('saved', 'out', COLUMN), init_args=[get_arg('saved', 'in', COLUMN)],
+            ),
+        ),
+        types=(),
+    )
+
+
+@pytest.fixture
+def suite_spec():
+    return cyppy.suite.parse_suite(
+        """<suite name="step">
+  <group name="physics">
+    <subcycle>
+      <scheme>a</scheme><scheme>b</scheme><scheme>c</scheme><scheme>d</scheme><scheme>e</scheme>
+    </subcycle>
+  </group>
+</suite>"""
+    )
+
+
+def test_get_lifetimes(suite_spec, ccpp_metadata):
+    schemes = cyppy.suite.get_suite_schemes(suite_spec, ccpp_metadata)
+    lifetimes = liveness.get_lifetimes(suite_spec, schemes)
+    assert lifetimes['tmp1'] == liveness.Lifetime('tmp1', 0, 1, 'physics', 'out')
+    assert lifetimes['temperature'] == liveness.Lifetime('temperature', 0, 3, 'physics', 'in')
+    assert liveness.is_interstitial(lifetimes['tmp1'])
+    assert not liveness.is_interstitial(lifetimes['temperature'])
+
+
+def test_value_used_in_two_groups_is_not_interstitial(ccpp_metadata):
+    suite_spec = cyppy.suite.parse_suite(
+        """<suite name="step">
+  <group name="first"><subcycle><scheme>a</scheme></subcycle></group>
+  <group name="second"><subcycle><scheme>b</scheme></subcycle></group>
+</suite>"""
+    )
+    schemes = cyppy.suite.get_suite_schemes(suite_spec, ccpp_metadata)
+    lifetimes = liveness.get_lifetimes(suite_spec, schemes)
+    assert not liveness.is_interstitial(lifetimes['tmp1'])
+
+
+@pytest.mark.parametrize(
+    "intervals, target",
+    [
+        pytest.param([(0, 1), (2, 3)], [0, 0], id="disjoint"),
+        pytest.param([(0, 1), (1, 2)], [0, 1], id="touching"),
+        pytest.param([(0, 4), (1, 2), (3, 5)], [0, 1, 1], id="nested"),
+    ]
+)
+def test_assign_buffers(intervals, target):
+    lifetimes = [
+        liveness.Lifetime(f"v{i}", first, last, 'physics', 'out')
+        for i, (first, last) in enumerate(intervals)
+    ]
+    assignment = liveness.assign_buffers(lifetimes)
+    assert [assignment[f"v{i}"] for i in range(len(intervals))] == target
+
+
+def test_get_interstitial_names(suite_spec, ccpp_metadata):
+    # temperature is read before it is written, and saved is used by an init routine
+    assert liveness.get_interstitial_names(suite_spec, ccpp_metadata) == [
+        'tmp1', 'tmp2', 'tmp3', 'tmp4'
+    ]
+
+
+def test_get_buffer_names(suite_spec, ccpp_metadata):
+    shared_names = liveness.get_interstitial_names(suite_spec, ccpp_metadata)
+    buffer_names = liveness.get_buffer_names(suite_spec, shared_names, ccpp_metadata)
+    # tmp4 has another shape
+    assert set(buffer_names) == {'tmp1', 'tmp2', 'tmp3', 'tmp4'}
+    assert buffer_names['tmp1'] == buffer_names['tmp3']
+    assert buffer_names['tmp1'] != buffer_names['tmp2']
+    assert buffer_names['tmp4'] not in (buffer_names['tmp1'], buffer_names['tmp2'])
+
+
+def test_get_buffer_names_only_shares_given_names(suite_spec, ccpp_metadata):
+    buffer_names = liveness.get_buffer_names(suite_spec, ['tmp1', 'tmp2'], ccpp_metadata)
+    assert set(buffer_names) == {'tmp1', 'tmp2'}
+
+
+@pytest.mark.parametrize("standard_name", ['temperature', 'saved', 'unknown'])
+def test_get_buffer_names_invalid_name_raises(suite_spec, ccpp_metadata, standard_name):
+    with pytest.raises(cyppy.lib.CCPPError, match='cannot share buffers'):
+        liveness.get_buffer_names(suite_spec, ['tmp1', standard_name], ccpp_metadata)
+
+
+def test_state_shares_buffers(suite_spec, ccpp_metadata):
+    dimensions = {'horizontal_dimension': 4, 'vertical_dimension': 3}
+    buffer_names = liveness.get_buffer_names(
+        suite_spec, liveness.get_interstitial_names(suite_spec, ccpp_metadata), ccpp_metadata
+    )
+    state = cyppy.State(ccpp_metadata, dimensions, buffer_names=buffer_names)
+    assert state['tmp1'] is state['tmp3']
+    assert state['tmp1'] is not state['tmp2']
+    report = liveness.get_memory_report(suite_spec, state, ccpp_metadata)
+    assert report.unshared_nbytes == cyppy.State(ccpp_metadata, dimensions).nbytes
+    assert report.shared_nbytes == report.unshared_nbytes - 4 * 8
+    assert report.n_interstitials == 4
+    assert report.n_buffers == 3
+    # tmp1 and tmp2 are both live while b runs
+    assert report.peak_live_nbytes == 4 * 3 * 8
+    assert 'in 3 buffers' in liveness.format_memory_report(report)
+
+
+def test_state_inconsistent_buffer_raises(ccpp_metadata):
+    buffer_names = {'tmp1': 'shared', 'tmp4': 'shared'}
+    with pytest.raises(cyppy.lib.CCPPError, match='cannot share buffer shared'):
+        cyppy.State(
+            ccpp_metadata, {'horizontal_dimension': 4, 'vertical_dimension': 3},
+            buffer_names=buffer_names,
+        )
+
+
+def test_get_access_uses_buffer_names(ccpp_metadata):
+    routine = ccpp_metadata.schemes[1].run
+    access = cyppy.dataflow.get_access(routine, {'tmp1': 'shared', 'tmp2': 'shared'})
+    # calls accessing either value are ordered by hazards on their buffer
+    assert access == cyppy.dataflow.Access(
+        reads=frozenset({'shared'}), writes=frozenset({'shared'})
+    )
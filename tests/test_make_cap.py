@@ -9,6 +9,7 @@ LIB_DIR = os.path.join(TEST_DIR, '../lib')
 
 sys.path.append(LIB_DIR)
 import make_cap
+import meta
 
 
 @pytest.mark.parametrize(
@@ -39,3 +40,197 @@ import make_cap
 def test_get_colon_dimension_string(dim_tuple, target):
     result = make_cap.get_colon_dimension_string(dim_tuple)
     assert result == target
+
+
+@pytest.fixture
+def ccpp_metadata():
+    routine = meta.RoutineSpec(
+        name='my_scheme_run',
+        args=(
+            meta.ArgSpec(
+                name='im',
+                standard_name='horizontal_loop_extent',
+                long_name='horizontal loop extent',
+                units='count',
+                dimensions=(),
+                type='integer',
+                kind=None,
+                intent='in',
+                optional=False,
+            ),
+            meta.ArgSpec(
+                name='errmsg',
+                standard_name='ccpp_error_message',
+                long_name='error message for error handling in CCPP',
+                units='none',
+                dimensions=(),
+                type='character',
+                kind='len=*',
+                intent='out',
+                optional=False,
+            ),
+            meta.ArgSpec(
+                name='errflg',
+                standard_name='ccpp_error_flag',
+                long_name='error flag for error handling in CCPP',
+                units='flag',
+                dimensions=(),
+                type='integer',
+                kind=None,
+                intent='out',
+                optional=False,
+            ),
+        ),
+    )
+    scheme = meta.SchemeSpec(
+        name='my_scheme',
+        init=meta.RoutineSpec(name='my_scheme_init', args=()),
+        run=routine,
+        finalize=meta.RoutineSpec(name='my_scheme_finalize', args=()),
+    )
+    return meta.CCPPMetadata(
+        modules=(meta.get_scheme_module(scheme),),
+        schemes=(scheme,),
+        types=(),
+    )
+
+
+def test_render_caps_without_tracing(ccpp_metadata):
+    caps = make_cap.render_caps(ccpp_metadata)
+    assert sorted(caps) == ['my_scheme_cap.F90', 'physics_types_cap.F90']
+    result = caps['my_scheme_cap.F90']
+    assert 'module my_scheme_cap_mod' in result
+    assert 'subroutine my_scheme_run_cap' in result
+    assert 'use physics_types_cap_mod' in result
+    assert 'print *' not in result
+    assert all('cyppy_trace' not in text for text in caps.values())
+
+
+def test_render_caps_with_tracing(ccpp_metadata):
+    caps = make_cap.render_caps(ccpp_metadata, tracing=True, trace_length=16)
+    assert 'trace_length = 16' in caps['cyppy_trace.F90']
+    result = caps['my_scheme_cap.F90']
+    assert 'print *' not in result
+    # routine ids follow the order of meta.iterate_routines
+    assert 'call cyppy_trace_record(1, trace_enter)' in result
+    assert 'call cyppy_trace_record(1, trace_exit)' in result
+
+
+@pytest.fixture
+def ddt_metadata(ccpp_metadata):
+    def get_attr(name, dimensions, attr_type, kind=None):
+        return meta.AttributeSpec(
+            name=name, standard_name=f"{name}_value", long_name=name, units='none',
+            dimensions=dimensions, type=attr_type, kind=kind,
+        )
+    ddt = meta.DerivedDataTypeSpec(
+        name='my_type',
+        attrs=(
+            get_attr('count', (), 'integer'),
+            get_attr('phii', ('horizontal_dimension', 'vertical_dimension'), 'real', 'kind_phys'),
+            get_attr('phii(:,1)', ('horizontal_dimension',), 'real', 'kind_phys'),
+            get_attr('label', (), 'character', 'len=16'),
+        ),
+    )
+    scheme = ccpp_metadata.schemes[0]
+    run_args = scheme.run.args
+    ddt_arg = meta.ArgSpec(
+        name='state', standard_name='my_state', long_name='state', units='DDT', dimensions=(),
+        type='my_type', kind=None, intent='inout', optional=False,
+    )
+    internal_args = run_args[:1] + (ddt_arg,) + run_args[1:]
+    run = meta.RoutineSpec(name=scheme.run.name, args=run_args, internal_args=internal_args)
+    return meta.CCPPMetadata(
+        modules=ccpp_metadata.modules,
+        schemes=(scheme._replace(run=run),),
+        types=(ddt,),
+    )
+
+
+def test_render_caps_passes_derived_types_as_handles(ddt_metadata):
+    caps = make_cap.render_caps(ddt_metadata)
+    result = caps['my_scheme_cap.F90']
+    assert 'type(c_ptr), value :: my_state' in result
+    assert 'call c_f_pointer(my_state, my_state_ptr)' in result
+    assert 'my_state_ptr, &' in result
+    assert 'pack_' not in result
+
+
+def test_render_caps_derived_type_handles(ddt_metadata):
+    result = make_cap.render_caps(ddt_metadata)['physics_types_cap.F90']
+    assert 'function cyppy_my_type_create() bind(c)' in result
+    assert 'subroutine cyppy_my_type_destroy(handle) bind(c)' in result
+    # attributes are identified by their index, subarrays and characters are not accessible
+    assert 'address = c_loc(ddt%count)' in result
+    assert 'case (1)' in result
+    assert 'if (.not. associated(ddt%phii)) allocate(ddt%phii(attr_shape(1), attr_shape(2)))' in result
+    # destroy frees the arrays of the instance before the instance itself
+    assert 'call cyppy_my_type_free_members(ddt)' in result
+    assert 'if (associated(ddt%phii)) deallocate(ddt%phii)' in result
+    assert 'phii(:,1)' not in result
+    assert 'ddt%label' not in result
+
+
+def test_get_cap_makefile_orders_modules():
+    result = make_cap.get_cap_makefile(
+        ['my_scheme_cap.F90', 'physics_types_cap.F90'], cap_dir='caps', library='libccpp.a')
+    assert 'CAP_OBJS = caps/my_scheme_cap.o caps/physics_types_cap.o' in result
+    assert 'caps/my_scheme_cap.o: caps/physics_types_cap.F90 | caps/physics_types_cap.o' in result
+
+
+def test_write_caps_skips_unchanged(ccpp_metadata, tmpdir):
+    cap_dir = str(tmpdir)
+    caps = make_cap.render_caps(ccpp_metadata)
+    assert sorted(make_cap.write_caps(caps, cap_dir)) == sorted(list(caps) + ['caps.mk'])
+    assert make_cap.write_caps(caps, cap_dir) == []
+    caps['my_scheme_cap.F90'] += '\n'
+    assert make_cap.write_caps(caps, cap_dir) == ['my_scheme_cap.F90']
+
+
+def test_write_caps_removes_stale_caps(ccpp_metadata, tmpdir):
+    cap_dir = str(tmpdir)
+    stale_filename = os.path.join(cap_dir, 'old_scheme_cap.F90')
+    with open(stale_filename, 'w') as f:
+        f.write('module old_scheme_cap_mod\nend module old_scheme_cap_mod\n')
+    make_cap.write_caps(make_cap.render_caps(ccpp_metadata), cap_dir)
+    assert not os.path.exists(stale_filename)
+    assert os.path.exists(os.path.join(cap_dir, 'my_scheme_cap.F90'))
+
+
+@pytest.mark.parametrize(
+    "standard_name, target",
+    [
+        pytest.param('air_temperature', 'air_temperature', id='unchanged'),
+        pytest.param('surface_downwelling_shortwave_flux', 'sfc_down_sw_flux', id='several'),
+        pytest.param('convective_precipitation_amount', 'conv_precip_amt', id='adjacent'),
+        pytest.param('dimensionless_exner_function', 'unitless_exner_func', id='longest_first'),
+        pytest.param(
+            'tendency_of_air_temperature_due_to_longwave_heating', 'lw_heating_rate', id='whole_name'
+        ),
+    ]
+)
+def test_shorten(standard_name, target):
+    assert make_cap.shorten(standard_name) == target
+
+
+def test_shorten_is_cached():
+    make_cap.shorten('surface_air_pressure')
+    hits = make_cap._shorten.cache_info().hits
+    make_cap.shorten('surface_air_pressure')
+    assert make_cap._shorten.cache_info().hits == hits + 1
+
+
+@pytest.mark.parametrize(
+    "standard_names",
+    [
+        pytest.param(['surface_air_pressure', 'sfc_air_pressure'], id='shortened'),
+        pytest.param(['Monin_Obukhov_length', 'mon_obuk_length'], id='case_insensitive'),
+    ]
+)
+def test_check_shortened_names_collision(standard_names):
+    with pytest.raises(ValueError, match='both shorten to'):
+        make_cap.check_shortened_names(standard_names, 'routine my_scheme_run')
+
+
+def test_check_shortened_names_repeated_name():
+    make_cap.check_shortened_names(['surface_air_pressure', 'surface_air_pressure'], 'routine')
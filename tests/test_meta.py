@@ -1,4 +1,5 @@
 import os
+import concurrent.futures
 import pytest
 import tempfile
 import os.path
@@ -597,5 +598,240 @@ def test_expand_derived_args_empty():
     assert result == []
 
 
+def get_attribute(name, attr_type='real', dimensions=('horizontal_dimension',)):
+    return cyppy.AttributeSpec(
+        name=name,
+        standard_name=name,
+        long_name=name,
+        units='none',
+        dimensions=dimensions,
+        type=attr_type,
+        kind=None,
+    )
+
+
+def test_expand_derived_args_nested(ddt_arg):
+    inner = cyppy.DerivedDataTypeSpec(
+        name='Inner_Type',
+        attrs=(get_attribute('a'), get_attribute('b')),
+    )
+    outer = cyppy.DerivedDataTypeSpec(
+        name='My_Type',
+        attrs=(get_attribute('c'), get_attribute('inner', 'Inner_Type'), get_attribute('d')),
+    )
+    ddt_lookup = {inner.name: inner, outer.name: outer}
+    ddt_used = []
+    args_out = cyppy.meta.expand_derived_args((ddt_arg,), ddt_lookup, ddt_used)
+    assert [arg.name for arg in args_out] == ['c', 'a', 'b', 'd']
+    assert all(arg.intent == ddt_arg.intent for arg in args_out)
+    assert ddt_used == [outer, inner]
+
+
+def test_expand_derived_args_many_attributes(ddt_arg, not_ddt_arg):
+    n_attrs = 5000
+    ddt = cyppy.DerivedDataTypeSpec(
+        name='My_Type',
+        attrs=tuple(get_attribute(f'attr_{i}') for i in range(n_attrs)),
+    )
+    ddt_lookup = {ddt.name: ddt}
+    ddt_used = []
+    args_in = (ddt_arg,) + (not_ddt_arg,) * n_attrs + (ddt_arg,)
+    args_out = cyppy.meta.expand_derived_args(args_in, ddt_lookup, ddt_used)
+    assert len(args_out) == 3 * n_attrs
+    assert args_out[0].name == 'attr_0'
+    assert args_out[n_attrs] == not_ddt_arg
+    assert args_out[-1].name == f'attr_{n_attrs - 1}'
+    assert ddt_used == [ddt, ddt]
+
+
+def test_expand_derived_args_shares_cache(ddt_arg, ddt):
+    ddt_lookup = {ddt.name: ddt}
+    expansion_cache = {}
+    first = cyppy.meta.expand_derived_args((ddt_arg,), ddt_lookup, [], expansion_cache)
+    assert ddt.name in expansion_cache
+    second = cyppy.meta.expand_derived_args((ddt_arg,), ddt_lookup, [], expansion_cache)
+    assert first == second
+
+
+def test_expand_derived_args_recursive_type_raises(ddt_arg):
+    ddt = cyppy.DerivedDataTypeSpec(
+        name='My_Type',
+        attrs=(get_attribute('self', 'My_Type'),),
+    )
+    with pytest.raises(ValueError):
+        cyppy.meta.expand_derived_args((ddt_arg,), {ddt.name: ddt}, [])
+
+
+MODULE_META = """[ccpp-arg-table]
+  name = machine
+  type = module
+[kind_dyn]
+  standard_name = kind_dyn
+  long_name = definition of kind_dyn
+  units = none
+  dimensions = ()
+  type = integer
+"""
+
+
+@pytest.fixture
+def meta_dir():
+    with tempfile.TemporaryDirectory() as dirname:
+        with open(os.path.join(dirname, 'machine.meta'), 'w') as f:
+            f.write(MODULE_META)
+        yield dirname
+
+
+def test_load_meta_dir_cache_matches_uncached(meta_dir):
+    cache_filename = os.path.join(meta_dir, 'cache.pickle')
+    target = cyppy.meta.load_meta_dir(meta_dir)
+    written = cyppy.meta.load_meta_dir(meta_dir, cache_filename=cache_filename)
+    assert os.path.exists(cache_filename)
+    read = cyppy.meta.load_meta_dir(meta_dir, cache_filename=cache_filename)
+    assert written == target
+    assert read == target
+
+
+def test_load_meta_dir_reads_cache(meta_dir, monkeypatch):
+    cache_filename = os.path.join(meta_dir, 'cache.pickle')
+    target = cyppy.meta.load_meta_dir(meta_dir, cache_filename=cache_filename)
+
+    def fail_load_meta(filenames):
+        raise AssertionError("metadata should be read from the cache")
+    monkeypatch.setattr(cyppy.meta, 'load_meta', fail_load_meta)
+    assert cyppy.meta.load_meta_dir(meta_dir, cache_filename=cache_filename) == target
+
+
+def test_load_meta_dir_cache_regenerated_on_change(meta_dir):
+    cache_filename = os.path.join(meta_dir, 'cache.pickle')
+    cyppy.meta.load_meta_dir(meta_dir, cache_filename=cache_filename)
+    meta_filename = os.path.join(meta_dir, 'machine.meta')
+    with open(meta_filename, 'w') as f:
+        f.write(MODULE_META.replace('kind_dyn', 'kind_grid'))
+    result = cyppy.meta.load_meta_dir(meta_dir, cache_filename=cache_filename)
+    assert result.modules[0].members[0].name == 'kind_grid'
+
+
+def test_write_cache_unpicklable_leaves_no_files(meta_dir):
+    cache_filename = os.path.join(meta_dir, 'cache.pickle')
+    cyppy.meta.write_cache(cache_filename, 'key', lambda: None)
+    assert sorted(os.listdir(meta_dir)) == ['machine.meta']
+
+
+def test_load_meta_dir_corrupt_cache(meta_dir):
+    cache_filename = os.path.join(meta_dir, 'cache.pickle')
+    with open(cache_filename, 'w') as f:
+        f.write('not a pickle')
+    result = cyppy.meta.load_meta_dir(meta_dir, cache_filename=cache_filename)
+    assert result == cyppy.meta.load_meta_dir(meta_dir)
+
+
+PARSER_META = """
+text before the first entry is ignored
+[ccpp-arg-table]
+  name = demo_run
+  type = scheme
+# a comment
+[im]
+  standard_name = horizontal_loop_extent
+  long_name = horizontal loop extent
+  units = count
+  dimensions = ()
+  type = integer
+  intent = in
+  optional = F
+[Ps]
+  standard_name = surface_air_pressure
+  long_name = surface pressure with a : in it = and an equals
+    continued on a second line
+  units = Pa
+  dimensions = (horizontal_dimension)
+  type = real
+  kind = kind_phys
+  intent = inout
+  optional = F
+[errmsg]
+  Standard_Name = ccpp_error_message
+  long_name : error message for error handling in CCPP
+  units = none
+  dimensions = ()
+  type = character
+  kind = len=*
+  intent = out
+  optional = F
+
+; another comment
+[ccpp-arg-table]
+  name = machine
+  type = module
+[kind_phys]
+  standard_name = kind_phys
+  long_name = definition of kind_phys
+  units = %
+  dimensions = ()
+  type = integer
+"""
+
+
+@pytest.fixture
+def parser_meta_filename():
+    with tempfile.TemporaryDirectory() as dirname:
+        filename = os.path.join(dirname, 'demo.meta')
+        with open(filename, 'w') as f:
+            f.write(PARSER_META)
+        yield filename
+
+
+def test_read_meta_file_matches_configparser(parser_meta_filename):
+    result = cyppy.meta.read_meta_file(parser_meta_filename)
+    target = cyppy.meta.read_meta_file_configparser(parser_meta_filename)
+    assert len(result) == 2
+    assert result == target
+
+
+def test_load_meta_matches_configparser(parser_meta_filename):
+    result = cyppy.meta.load_meta([parser_meta_filename])
+    target = cyppy.meta.load_meta(
+        [parser_meta_filename], read_file=cyppy.meta.read_meta_file_configparser)
+    assert result == target
+
+
+def test_load_meta_with_executor(parser_meta_filename):
+    with concurrent.futures.ThreadPoolExecutor(max_workers=2) as executor:
+        result = cyppy.meta.load_meta([parser_meta_filename] * 2, executor=executor)
+    assert result == cyppy.meta.load_meta([parser_meta_filename] * 2)
+
+
+@pytest.mark.parametrize(
+    "meta_string",
+    [
+        pytest.param("[ccpp-arg-table]\n  name = a\n  no separator\n", id='no_separator'),
+        pytest.param("[ccpp-arg-table]\n  name = a\n  Name = b\n", id='duplicate_option'),
+        pytest.param("[ccpp-arg-table]\n  name = a\n[x]\n  type = real\n[x]\n", id='duplicate_section'),
+        pytest.param("[ccpp-arg-table]\n  name = a\n[]\n", id='empty_section'),
+    ]
+)
+def test_read_entries_invalid(meta_string):
+    with pytest.raises(ValueError, match='demo.meta:'):
+        list(cyppy.meta.read_entries(meta_string.splitlines(), 'demo.meta'))
+
+
+@pytest.mark.parametrize(
+    "attr, target",
+    [
+        pytest.param(get_attribute('phii'), True, id="array"),
+        pytest.param(get_attribute('me', 'integer', ()), True, id="scalar"),
+        pytest.param(get_attribute('sub', 'My_Type', ()), True, id="ddt"),
+        pytest.param(
+            get_attribute('subs', 'My_Type', ('horizontal_dimension',)), False, id="ddt_array"
+        ),
+        pytest.param(get_attribute('phii(:,1)'), False, id="subarray"),
+        pytest.param(get_attribute('label', 'character', ()), False, id="character"),
+    ]
+)
+def test_is_handle_attr(attr, target):
+    assert cyppy.meta.is_handle_attr(attr) == target
+
+
 if __name__ == '__main__':
     pytest.main()
@@ -0,0 +1,93 @@
+import numpy as np
+import pytest
+import cyppy
+
+# multiprocessing.shared_memory is only available from Python 3.8
+shared_memory = pytest.importorskip('multiprocessing.shared_memory')
+
+
+@pytest.fixture
+def pool():
+    with cyppy.ProcessPool(n_workers=2) as pool:
+        yield pool
+
+
+def test_zeros(pool):
+    array = pool.zeros((3, 4), dtype=np.float32)
+    assert array.shape == (3, 4)
+    assert array.dtype == np.float32
+    assert array.flags.f_contiguous
+    np.testing.assert_array_equal(array, 0.)
+
+
+def test_share_copies_values(pool):
+    source = np.arange(6.).reshape(2, 3)
+    shared = pool.share(source)
+    np.testing.assert_array_equal(shared, source)
+    assert shared.flags.f_contiguous
+
+
+def test_worker_sees_shared_array(pool):
+    array = pool.share(np.arange(4.))
+    assert pool.get_ref(np.arange(4.)) is None
+    attached = {}
+    result = cyppy.process.attach_shared_array(pool.get_ref(array), attached)
+    np.testing.assert_array_equal(result, array)
+    del result
+    cyppy.process.close_shared_memory(attached.popitem()[1])
+
+
+@pytest.mark.parametrize(
+    "index",
+    [
+        (slice(1, 3),),
+        (slice(None), 2),
+        (slice(None, None, 2), slice(1, None)),
+        (1, 1, Ellipsis),
+    ]
+)
+def test_worker_sees_view_of_shared_array(pool, index):
+    array = pool.share(np.arange(12.).reshape(3, 4))
+    view = array[index]
+    attached = {}
+    result = cyppy.process.attach_shared_array(pool.get_ref(view), attached)
+    np.testing.assert_array_equal(result, view)
+    result[...] = -1.
+    np.testing.assert_array_equal(view, -1.)
+    del result
+    cyppy.process.close_shared_memory(attached.popitem()[1])
+
+
+def test_private_ref_is_copied(pool):
+    array = pool.zeros(4)
+    attached = {}
+    result = cyppy.process.attach_shared_array(pool.get_ref(array, copy=True), attached)
+    result[...] = 1.
+    np.testing.assert_array_equal(array, 0.)
+    del result
+    cyppy.process.close_shared_memory(attached.popitem()[1])
+
+
+def test_close_frees_shared_memory():
+    pool = cyppy.ProcessPool(n_workers=1)
+    array = pool.zeros(4)
+    name = pool.get_ref(array).name
+    pool.close()
+    with pytest.raises(FileNotFoundError):
+        shared_memory.SharedMemory(name=name)
+
+
+def test_sfc_ocean_run_chunked_matches_serial(pool, sfc_ocean_run_args):
+    shared_args = [
+        arg if arg.ndim == 0 else pool.share(arg) for arg in sfc_ocean_run_args
+    ]
+    pool.call('sfc_ocean_init')
+    pool.call_chunked('sfc_ocean_run', *shared_args)
+    cyppy.lib.sfc_ocean_run(*sfc_ocean_run_args)
+    for result, target in zip(shared_args, sfc_ocean_run_args):
+        np.testing.assert_array_equal(result, target)
+
+
+def test_unshared_array_raises(pool, sfc_ocean_run_args):
+    with pytest.raises(cyppy.lib.CCPPError):
+        pool.call_chunked('sfc_ocean_run', *sfc_ocean_run_args)
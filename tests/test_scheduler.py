@@ -0,0 +1,86 @@
+import numpy as np
+import pytest
+import cyppy
+from cyppy.scheduler import get_imbalance, get_max_chunk_size
+
+
+@pytest.fixture
+def scheduler():
+    with cyppy.ChunkScheduler(n_workers=2, target_chunk_time=1e-3, min_chunks_per_worker=4) as scheduler:
+        yield scheduler
+
+
+@pytest.mark.parametrize(
+    "busy_times, imbalance",
+    [
+        ([1., 1.], 0.),
+        ([3., 1.], 0.5),
+        ([2., 0.], 1.),
+        ([0., 0.], 0.),
+    ]
+)
+def test_get_imbalance(busy_times, imbalance):
+    assert get_imbalance(busy_times) == pytest.approx(imbalance)
+
+
+@pytest.mark.parametrize(
+    "n_columns, n_workers, min_chunks_per_worker, size",
+    [
+        (64, 2, 4, 8),
+        (65, 2, 4, 8),
+        (3, 2, 4, 1),
+        (0, 2, 4, 1),
+    ]
+)
+def test_get_max_chunk_size(n_columns, n_workers, min_chunks_per_worker, size):
+    assert get_max_chunk_size(n_columns, n_workers, min_chunks_per_worker) == size
+
+
+def test_first_call_uses_largest_chunks(scheduler):
+    assert scheduler.get_chunk_size('routine', 64) == 8
+
+
+@pytest.mark.parametrize(
+    "column_time, size",
+    [
+        (1e-4, 8),  # cheap columns are capped so each worker gets several chunks
+        (1e-3, 1),
+        (1e-2, 1),
+        (2.5e-4, 4),
+    ]
+)
+def test_chunk_size_adapts_to_column_time(scheduler, column_time, size):
+    scheduler.record('routine', 64, 8, 8, [column_time * 32, column_time * 32])
+    assert scheduler.get_chunk_size('routine', 64) == size
+
+
+def test_column_time_is_smoothed(scheduler):
+    scheduler.record('routine', 10, 1, 10, [1., 1.])
+    scheduler.record('routine', 10, 1, 10, [3., 3.])
+    row, = scheduler.get_stats()
+    assert row.column_time == pytest.approx(0.4)
+
+
+def test_stats_record_imbalance(scheduler):
+    scheduler.record('balanced', 10, 1, 10, [1., 1.])
+    scheduler.record('unbalanced', 10, 1, 10, [3., 1.])
+    scheduler.record('unbalanced', 10, 1, 10, [1., 1.])
+    rows = scheduler.get_stats()
+    assert [row.routine for row in rows] == ['unbalanced', 'balanced']
+    assert rows[0].calls == 2
+    assert rows[0].mean_imbalance == pytest.approx(0.25)
+    assert rows[0].max_imbalance == pytest.approx(0.5)
+    assert 'unbalanced' in scheduler.format_stats()
+    scheduler.reset()
+    assert scheduler.get_stats() == []
+
+
+def test_sfc_ocean_run_scheduled_matches_unchunked(scheduler, sfc_ocean_run_args):
+    scheduled_args = [arg.copy() for arg in sfc_ocean_run_args]
+    cyppy.lib.sfc_ocean_run(*sfc_ocean_run_args)
+    scheduler.call('sfc_ocean_run', *scheduled_args)
+    for result, target in zip(scheduled_args, sfc_ocean_run_args):
+        np.testing.assert_array_equal(result, target)
+    row, = scheduler.get_stats()
+    assert row.routine == 'sfc_ocean_run'
+    assert row.calls == 1
@@ -0,0 +1,156 @@
+import numpy as np
+import pytest
+import cyppy
+from conftest import get_arg, get_scheme
+
+
+def get_metadata(run_args):
+    return cyppy.CCPPMetadata(modules=(), schemes=(get_scheme('my_scheme', *run_args),), types=())
+
+
+@pytest.fixture
+def ccpp_metadata():
+    return get_metadata([
+        get_arg('horizontal_loop_extent', arg_type='integer'),
+        get_arg('vertical_dimension', arg_type='integer'),
+        get_arg('specific_heat_of_dry_air_at_constant_pressure', kind='kind_phys'),
+        get_arg(
+            'flag_nonzero_wet_surface_fraction', dimensions=('horizontal_dimension',),
+            arg_type='logical',
+        ),
+        get_arg(
+            'geopotential_at_interface',
+            dimensions=('horizontal_dimension', 'vertical_dimension_plus_one'), kind='kind_phys',
+        ),
+    ])
+
+
+def test_state_allocates_args(ccpp_metadata):
+    state = cyppy.State(ccpp_metadata, {'horizontal_dimension': 4, 'vertical_dimension': 3})
+    assert set(state) == {
+        'horizontal_loop_extent',
+        'vertical_dimension',
+        'specific_heat_of_dry_air_at_constant_pressure',
+        'flag_nonzero_wet_surface_fraction',
+        'geopotential_at_interface',
+    }
+    phii = state['geopotential_at_interface']
+    assert phii.shape == (4, 4)
+    assert phii.dtype == np.float64
+    assert phii.flags.f_contiguous
+    # default integer and logical are 4 bytes
+    assert state['horizontal_loop_extent'].dtype == np.int32
+    assert state['flag_nonzero_wet_surface_fraction'].dtype == np.int32
+
+
+def test_state_sets_dimension_scalars(ccpp_metadata):
+    state = cyppy.State(ccpp_metadata, {'horizontal_dimension': 4, 'vertical_dimension': 3})
+    assert state['horizontal_loop_extent'] == 4
+    assert state['vertical_dimension'] == 3
+    assert state['specific_heat_of_dry_air_at_constant_pressure'] == 0.
+
+
+def test_state_returns_same_array(ccpp_metadata):
+    state = cyppy.State(ccpp_metadata, {'horizontal_dimension': 4, 'vertical_dimension': 3})
+    assert state['geopotential_at_interface'] is state['geopotential_at_interface']
+
+
+def test_state_missing_dimension_raises(ccpp_metadata):
+    with pytest.raises(cyppy.lib.CCPPError):
+        cyppy.State(ccpp_metadata, {'horizontal_dimension': 4})
+
+
+def test_state_inconsistent_args_raises():
+    ccpp_metadata = get_metadata([
+        get_arg('same_name', dimensions=('horizontal_dimension',), kind='kind_phys'),
+        get_arg('same_name', dimensions=('horizontal_dimension',), arg_type='integer'),
+    ])
+    with pytest.raises(cyppy.lib.CCPPError):
+        cyppy.State(ccpp_metadata, {'horizontal_dimension': 4})
+
+
+def get_attr(name, standard_name, dimensions, attr_type, kind=None):
+    return cyppy.AttributeSpec(
+        name=name, standard_name=standard_name, long_name=standard_name, units='none',
+        dimensions=dimensions, type=attr_type, kind=kind,
+    )
+
+
+DERIVED_TYPE_SPECS = {
+    'my_type': cyppy.DerivedDataTypeSpec(
+        name='my_type',
+        attrs=(
+            get_attr('t', 'air_temperature', ('horizontal_dimension',), 'real', 'kind_phys'),
+            get_attr('t(:,1)', 'surface_air_temperature', ('horizontal_dimension',), 'real', 'kind_phys'),
+            get_attr('sub', 'my_sub_state', (), 'my_sub_type'),
+        ),
+    ),
+    'my_sub_type': cyppy.DerivedDataTypeSpec(
+        name='my_sub_type',
+        attrs=(get_attr('levs', 'vertical_dimension', (), 'integer'),),
+    ),
+}
+
+
+class ArrayHandle:
+    """Stands in for lib.DerivedTypeHandle, holding attributes in numpy arrays."""
+
+    def __init__(self, type_name):
+        self.type_name = type_name
+        self._attrs = {
+            attr.standard_name: attr for attr in DERIVED_TYPE_SPECS[type_name].attrs
+            if cyppy.meta.is_handle_attr(attr)
+        }
+        self._values = {}
+        for standard_name, attr in self._attrs.items():
+            if attr.type not in cyppy.meta.INTRINSIC_TYPES:
+                self._values[standard_name] = ArrayHandle(attr.type)
+            elif len(attr.dimensions) == 0:
+                self._values[standard_name] = np.zeros((), dtype=cyppy.lib.get_dtype(attr.type, attr.kind))
+
+    def __contains__(self, standard_name):
+        return standard_name in self._attrs
+
+    def __getitem__(self, standard_name):
+        return self._values[standard_name]
+
+    def is_allocated(self, standard_name):
+        return standard_name in self._values
+
+    def allocate(self, standard_name, shape):
+        attr = self._attrs[standard_name]
+        self._values[standard_name] = np.empty(
+            shape, dtype=cyppy.lib.get_dtype(attr.type, attr.kind), order='F'
+        )
+        return self._values[standard_name]
+
+
+@pytest.fixture
+def array_handles(monkeypatch):
+    monkeypatch.setattr(cyppy.lib, 'DerivedTypeHandle', ArrayHandle)
+    monkeypatch.setattr(cyppy.lib, '_derived_type_specs', DERIVED_TYPE_SPECS)
+
+
+def test_state_binds_values_to_derived_type_attributes(array_handles):
+    ccpp_metadata = get_metadata([
+        get_arg('horizontal_loop_extent', arg_type='integer'),
+        get_arg('air_temperature', dimensions=('horizontal_dimension',), kind='kind_phys'),
+        get_arg('vertical_dimension', arg_type='integer'),
+        get_arg('my_state', arg_type='my_type'),
+    ])
+    state = cyppy.State(ccpp_metadata, {'horizontal_dimension': 4, 'vertical_dimension': 3})
+    handle = state['my_state']
+    assert state['air_temperature'] is handle['air_temperature']
+    np.testing.assert_array_equal(state['air_temperature'], 0.)
+    # nested derived types are searched, and dimension scalars are set
+    assert state['vertical_dimension'] is handle['my_sub_state']['vertical_dimension']
+    assert state['vertical_dimension'] == 3
+
+
+def test_state_unreachable_derived_type_attribute_raises(array_handles):
+    ccpp_metadata = get_metadata([
+        get_arg('surface_air_temperature', dimensions=('horizontal_dimension',), kind='kind_phys'),
+        get_arg('my_state', arg_type='my_type'),
+    ])
+    with pytest.raises(cyppy.lib.CCPPError, match='cannot be accessed through a handle'):
+        cyppy.State(ccpp_metadata, {'horizontal_dimension': 4})
@@ -0,0 +1,98 @@
+import os
+import types
+import numpy as np
+import pytest
+import cyppy
+from conftest import get_arg
+
+
+TEST_DIR = os.path.dirname(os.path.realpath(__file__))
+SUITE_FILENAME = os.path.join(TEST_DIR, 'suites/suite_FV3_GFS_v15p2.xml')
+
+
+@pytest.fixture
+def suite_spec():
+    return cyppy.load_suite(SUITE_FILENAME)
+
+
+def test_load_suite_groups(suite_spec):
+    assert suite_spec.name == 'FV3_GFS_v15p2'
+    assert [group.name for group in suite_spec.groups] == [
+        'fast_physics', 'time_vary', 'radiation', 'physics', 'stochastics'
+    ]
+
+
+def test_load_suite_subcycles(suite_spec):
+    physics = suite_spec.groups[3]
+    assert [subcycle.loop for subcycle in physics.subcycles] == [1, 2, 1]
+    assert physics.subcycles[1].schemes[:2] == ('sfc_diff', 'GFS_surface_loop_control_part1')
+
+
+@pytest.mark.parametrize(
+    "xml_string, target",
+    [
+        pytest.param(
+            '<suite name="empty"></suite>',
+            cyppy.suite.SuiteSpec(name='empty', groups=()),
+            id="empty",
+        ),
+        pytest.param(
+            """<suite name="one">
+  <group name="physics">
+    <subcycle loop="3">
+      <scheme> sfc_ocean </scheme>
+    </subcycle>
+  </group>
+</suite>""",
+            cyppy.suite.SuiteSpec(
+                name='one',
+                groups=(
+                    cyppy.suite.GroupSpec(
+                        name='physics',
+                        subcycles=(cyppy.suite.SubcycleSpec(loop=3, schemes=('sfc_ocean',)),),
+                    ),
+                ),
+            ),
+            id="one_scheme",
+        ),
+    ]
+)
+def test_parse_suite(xml_string, target):
+    assert cyppy.suite.parse_suite(xml_string) == target
+
+
+def test_iterate_scheme_names_unique():
+    suite_spec = cyppy.suite.parse_suite(
+        """<suite name="repeat">
+  <group name="a"><subcycle><scheme>s1</scheme><scheme>s2</scheme></subcycle></group>
+  <group name="b"><subcycle><scheme>s2</scheme><scheme>s3</scheme></subcycle></group>
+</suite>"""
+    )
+    assert list(cyppy.suite.iterate_scheme_names(suite_spec)) == ['s1', 's2', 's3']
+
+
+def test_suite_missing_scheme_raises(suite_spec):
+    empty_metadata = cyppy.CCPPMetadata(modules=(), schemes=(), types=())
+    with pytest.raises(cyppy.lib.CCPPError):
+        cyppy.Suite(suite_spec, {}, ccpp_metadata=empty_metadata)
+
+
+def test_bound_routine_uses_wrapped_routine(monkeypatch):
+    args = (
+        get_arg('horizontal_loop_extent', arg_type='integer', name='im'),
+        get_arg('air_temperature', 'inout', ('horizontal_loop_extent',), name='t'),
+        None,
+        None,
+    )
+    routine = cyppy.RoutineSpec(name='my_scheme_run', args=args)
+    wrapped = types.SimpleNamespace(
+        plan=cyppy.lib.get_call_plan(routine, types.SimpleNamespace()),
+        bind=lambda *args, check: (args, check),
+    )
+    monkeypatch.setitem(vars(cyppy.lib), 'my_scheme_run', wrapped)
+    state = {'horizontal_loop_extent': 4, 'air_temperature': np.zeros(4)}
+    bound_args, check = cyppy.suite.get_bound_routine(routine, state)
+    assert bound_args == (4, state['air_temperature'])
+    assert not check
+    with pytest.raises(cyppy.lib.CCPPError, match='missing from state'):
+        cyppy.suite.get_bound_routine(routine, {'horizontal_loop_extent': 4})